@@ -4,15 +4,33 @@ Mattermost 聊天記錄查看器
 簡易的 Web 介面來查看下載的聊天記錄
 """
 
+import io
 import os
+import re
+import sys
 import json
 import glob
 import secrets
+import threading
+import time
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, send_from_directory, session, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, session, redirect, url_for, flash
 from pathlib import Path
-from urllib.parse import unquote
+from urllib.parse import unquote, quote
 from functools import wraps
+import gzip
+import mimetypes
+from collections import OrderedDict
+from werkzeug.security import safe_join, generate_password_hash, check_password_hash
+from thumbnails import ensure_thumbnail, is_thumbnail_supported
+from timeline import update_timeline, read_timeline_page, timeline_dir, load_timeline_meta, select_channel_json, ATTACHMENT_NAME_RE
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # 與下載工具共用的 code_fence.py
+from code_fence import CODE_FENCE_PATTERN, extract_code_blocks
+
+try:
+    import brotli  # 選用：安裝後 JSON 回應可使用 br 壓縮
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
@@ -24,6 +42,58 @@ SESSION_TIMEOUT = int(os.environ.get('SESSION_TIMEOUT', '3600'))  # Session 超
 # 設定結果資料夾路徑
 RESULTS_BASE_PATH = Path('../results')
 
+# 修改密碼後的雜湊存放在 results/.index/password.json，所有 worker 依 mtime 重新讀取，重載後仍然有效；
+# 刪除此檔案即恢復使用 ACCESS_PASSWORD
+PASSWORD_FILENAME = 'password.json'
+_password_lock = threading.Lock()
+_password_cache = {'mtime': None, 'hash': None}
+
+# 頻道目錄快取：以資料夾 mtime 判斷是否需要重新掃描
+INDEX_DIRNAME = '.index'  # 各日期/頻道資料夾下存放索引與快取的目錄
+CATALOG_FILENAME = 'catalog.json'
+CATALOG_VERSION = 5
+CHANNEL_PAYLOAD_VERSION = 2  # 頻道衍生資料格式變更時遞增，讓舊的 .index 快取失效
+_catalog_lock = threading.Lock()
+_catalog_cache = {}  # date -> {channel_name: catalog entry}
+_dates_cache = {'mtime': None, 'dates': []}
+
+# 統計彙總：下載器完成頻道時寫入 .index/<頻道>.stats.json（每天的訊息數、使用者、討論串與附件），
+# 目錄快取保存各頻道的彙總，/api/stats 只合併彙總，不需解析頻道 JSON
+ROLLUP_VERSION = 1
+STATS_CACHE_SIZE = int(os.environ.get('STATS_CACHE_SIZE', '32'))  # 記憶體中保留的統計結果數
+STATS_CHECK_INTERVAL = float(os.environ.get('STATS_CHECK_INTERVAL', '30'))  # 統計重新檢查目錄快取的間隔（秒）
+_stats_cache = OrderedDict()  # (日期, 頻道) -> (目錄版本, 統計結果)，最近使用的在最後
+_stats_catalogs = {'checked_at': None, 'catalogs': {}, 'signature': None, 'generation': 0}
+
+# 下載器啟用 pack_small_files 時，小檔案存放在 .index/pack.bin，索引記錄檔名 -> [offset, size, sha256]
+PACK_FILENAME = 'pack.bin'
+PACK_INDEX_FILENAME = 'pack_index.json'
+PACK_INDEX_VERSION = 1
+_pack_cache_lock = threading.Lock()
+_pack_index_cache = OrderedDict()  # 索引路徑 -> (mtime, entries)，LRU
+
+# 附件傳送設定
+# FILE_SERVE_MODE: flask（由 Flask 傳送）、x-sendfile（Apache/lighttpd）、x-accel（nginx X-Accel-Redirect）
+FILE_SERVE_MODE = os.environ.get('FILE_SERVE_MODE', 'flask')
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected-results').rstrip('/')
+FILE_CACHE_MAX_AGE = int(os.environ.get('FILE_CACHE_MAX_AGE', str(30 * 24 * 3600)))  # 封存檔案不會變動，預設快取 30 天
+app.config['USE_X_SENDFILE'] = FILE_SERVE_MODE == 'x-sendfile'
+
+# 頻道資料快取與回應壓縮設定
+CHANNEL_CACHE_SIZE = int(os.environ.get('CHANNEL_CACHE_SIZE', '8'))  # 記憶體中保留的頻道數
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))  # 小於此大小的回應不壓縮
+PRECOMPRESS_CHANNEL_DATA = os.environ.get('PRECOMPRESS_CHANNEL_DATA', '1') == '1'  # 將壓縮後的精簡資料存在 .index
+COMPACT_FIELDS = ['idx', 'id', 'created', 'username', 'message', 'root_id', 'files']
+SEARCH_TOKEN_RE = re.compile(r'\w+')  # 前端 search_worker.js 使用相同的斷詞規則
+_channel_cache_lock = threading.Lock()
+_channel_cache = OrderedDict()  # json path -> (mtime, channel data)
+
+# 跨快照合併時間軸（儲存在 results/.index/timeline，見 timeline.py）
+TIMELINE_PAGE_SIZE = int(os.environ.get('TIMELINE_PAGE_SIZE', '2000'))  # 每次載入的訊息數
+TIMELINE_MAX_PAGE_SIZE = 10000
+_timeline_lock = threading.Lock()
+_timeline_builds = set()  # 背景更新中的頻道名稱
+
 def require_auth(f):
     """認證裝飾器"""
     @wraps(f)
@@ -43,12 +113,52 @@ def require_auth(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def _password_path():
+    return RESULTS_BASE_PATH / INDEX_DIRNAME / PASSWORD_FILENAME
+
+def check_access_password(password):
+    """驗證存取密碼：修改過密碼時比對 password.json 中的雜湊，否則比對 ACCESS_PASSWORD"""
+    if not password:
+        return False
+    path = _password_path()
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return secrets.compare_digest(password.encode('utf-8'), ACCESS_PASSWORD.encode('utf-8'))
+
+    with _password_lock:
+        password_hash = _password_cache['hash'] if _password_cache['mtime'] == mtime else None
+    if password_hash is None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                password_hash = json.load(f)['hash']
+            if not isinstance(password_hash, str):
+                raise ValueError('invalid hash')
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # 檔案損毀時不退回 ACCESS_PASSWORD（舊密碼不應重新生效），刪除檔案即可恢復
+            print(f"Unable to read password file {path}: {e}")
+            return False
+        with _password_lock:
+            _password_cache['mtime'] = mtime
+            _password_cache['hash'] = password_hash
+    return check_password_hash(password_hash, password)
+
+def set_access_password(password):
+    """寫入新密碼的雜湊（原子替換），其他 worker 下次驗證時依 mtime 讀取"""
+    path = _password_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'hash': generate_password_hash(password), 'updated_at': datetime.now().isoformat()}, f)
+    os.replace(tmp_path, path)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """登入頁面"""
     if request.method == 'POST':
         password = request.form.get('password')
-        if password == ACCESS_PASSWORD:
+        if check_access_password(password):
             session['authenticated'] = True
             session['login_time'] = datetime.now().isoformat()
             flash('登入成功！', 'success')
@@ -68,16 +178,14 @@ def logout():
 @app.route('/change_password', methods=['GET', 'POST'])
 @require_auth
 def change_password():
-    """修改密碼"""
-    global ACCESS_PASSWORD
-    
+    """修改密碼（寫入 results/.index/password.json，所有 worker 共用）"""
     if request.method == 'POST':
         current_password = request.form.get('current_password')
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
         
         # 驗證當前密碼
-        if current_password != ACCESS_PASSWORD:
+        if not check_access_password(current_password):
             flash('當前密碼錯誤', 'error')
             return render_template('change_password.html')
         
@@ -90,8 +198,11 @@ def change_password():
             flash('新密碼確認不一致', 'error')
             return render_template('change_password.html')
         
-        # 更新密碼（僅在當前 session 中有效）
-        ACCESS_PASSWORD = new_password
+        try:
+            set_access_password(new_password)
+        except OSError as e:
+            flash(f'無法儲存新密碼: {e}', 'error')
+            return render_template('change_password.html')
         
         # 清除所有 session，強制重新登入
         session.clear()
@@ -102,31 +213,511 @@ def change_password():
     return render_template('change_password.html')
 
 def get_available_dates():
-    """獲取可用的日期資料夾"""
+    """獲取可用的日期資料夾（依根目錄 mtime 快取）"""
+    if not RESULTS_BASE_PATH.exists():
+        return []
+
+    mtime = RESULTS_BASE_PATH.stat().st_mtime_ns
+    with _catalog_lock:
+        if _dates_cache['mtime'] == mtime:
+            return list(_dates_cache['dates'])
+
     dates = []
-    if RESULTS_BASE_PATH.exists():
-        for date_folder in RESULTS_BASE_PATH.iterdir():
-            if date_folder.is_dir() and date_folder.name.isdigit() and len(date_folder.name) == 8:
-                dates.append(date_folder.name)
-    return sorted(dates, reverse=True)
+    with os.scandir(RESULTS_BASE_PATH) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.isdigit() and len(entry.name) == 8:
+                dates.append(entry.name)
+    dates.sort(reverse=True)
+
+    with _catalog_lock:
+        _dates_cache['mtime'] = mtime
+        _dates_cache['dates'] = dates
+    return list(dates)
+
+def _load_catalog_file(date_path):
+    """載入磁碟上的頻道目錄快取"""
+    catalog_path = date_path / INDEX_DIRNAME / CATALOG_FILENAME
+    try:
+        with open(catalog_path, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+        if catalog.get('version') == CATALOG_VERSION:
+            return catalog.get('channels', {})
+    except (OSError, ValueError):
+        pass
+    return {}
+
+def _save_catalog_file(date_path, channels):
+    """儲存頻道目錄快取（結果資料夾唯讀時略過）"""
+    index_dir = date_path / INDEX_DIRNAME
+    try:
+        index_dir.mkdir(exist_ok=True)
+        tmp_path = index_dir / (CATALOG_FILENAME + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CATALOG_VERSION, 'channels': channels}, f, ensure_ascii=False)
+        os.replace(tmp_path, index_dir / CATALOG_FILENAME)
+    except OSError as e:
+        print(f"Unable to write catalog for {date_path}: {e}")
+
+def _load_pack(channel_dir):
+    """讀取頻道的小檔案封裝索引，回傳 (檔名 -> [offset, size, sha256], 封裝檔名稱)；沒有封裝檔時回傳 ({}, None)"""
+    index_path = os.path.join(channel_dir, INDEX_DIRNAME, PACK_INDEX_FILENAME)
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except OSError:
+        return {}, None
+    with _pack_cache_lock:
+        cached = _pack_index_cache.get(index_path)
+        if cached and cached[0] == mtime:
+            _pack_index_cache.move_to_end(index_path)
+            return cached[1], cached[2]
+
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Unable to read pack index {index_path}: {e}")
+        return {}, None
+    entries = data.get('entries', {}) if data.get('version') == PACK_INDEX_VERSION else {}
+    # 下載器整理封裝檔後改用新的檔名（pack.<n>.bin）
+    pack_name = data.get('pack', PACK_FILENAME)
+    if os.path.basename(pack_name) != pack_name or not pack_name.startswith('pack'):
+        pack_name = PACK_FILENAME
+
+    with _pack_cache_lock:
+        _pack_index_cache[index_path] = (mtime, entries, pack_name)
+        _pack_index_cache.move_to_end(index_path)
+        while len(_pack_index_cache) > CHANNEL_CACHE_SIZE:
+            _pack_index_cache.popitem(last=False)
+    return entries, pack_name
+
+def _load_pack_index(channel_dir):
+    """讀取頻道的小檔案封裝索引（檔名 -> [offset, size, sha256]），沒有封裝檔時回傳空 dict"""
+    return _load_pack(channel_dir)[0]
+
+def _attachment_type(filename):
+    """統計用的附件類型：小寫副檔名，沒有副檔名時為 other（與下載器相同）"""
+    name_parts = filename.rsplit('.', 1)
+    return name_parts[1].lower() if len(name_parts) == 2 and name_parts[1] else 'other'
+
+def _load_rollup(channel_path, json_file, json_mtime):
+    """讀取下載器產生的統計彙總；不存在、格式不符或比頻道 JSON 舊（例如 tail 之後又追加訊息）時回傳 None"""
+    rollup_path = os.path.join(channel_path, INDEX_DIRNAME, Path(json_file).stem + '.stats.json')
+    try:
+        if os.stat(rollup_path).st_mtime_ns < json_mtime:
+            return None
+        with open(rollup_path, 'r', encoding='utf-8') as f:
+            rollup = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if rollup.get('version') != ROLLUP_VERSION or rollup.get('json_file') != json_file:
+        return None
+    return rollup
+
+def build_rollup_days(posts, files_by_prefix, file_sizes):
+    """由頻道訊息計算每天的統計（沒有彙總檔時使用；附件大小以實際儲存的檔案計算）"""
+    days = {}
+    threads_by_day = {}
+    for post in posts:
+        day = (post.get('created') or '')[:10]
+        record = days.get(day)
+        if record is None:
+            record = days[day] = {'messages': 0, 'users': {}, 'active_threads': 0, 'attachments': {}}
+        record['messages'] += 1
+        username = post.get('username', '')
+        record['users'][username] = record['users'].get(username, 0) + 1
+        if post.get('root_id'):
+            threads_by_day.setdefault(day, set()).add(post['root_id'])
+        for filename in post.get('files', []):
+            actual = _resolve_attachment(files_by_prefix, post.get('idx', 0), filename)
+            counts = record['attachments'].setdefault(_attachment_type(filename), [0, 0])
+            counts[0] += 1
+            counts[1] += file_sizes.get(actual, 0) if actual else 0
+    for day, roots in threads_by_day.items():
+        days[day]['active_threads'] = len(roots)
+    return days
+
+def _scan_channel_folder(channel_path, dir_mtime, previous=None):
+    """掃描單一頻道資料夾，計算訊息數、最後訊息時間、附件大小（含封裝檔中的小檔案）與每天的統計"""
+    sizes = {}
+    with os.scandir(channel_path) as entries:
+        for entry in entries:
+            if not entry.name.startswith('.') and entry.is_file():
+                sizes[entry.name] = entry.stat().st_size
+    json_file = select_channel_json(sizes, os.path.basename(channel_path))
+    if json_file is None:
+        return None
+
+    # 附件：非 JSON 檔與 NNN_ 前綴的 JSON 附件（含封裝檔中的小檔案）
+    file_sizes = {name: size for name, size in sizes.items()
+                  if name != json_file and (not name.endswith('.json') or ATTACHMENT_NAME_RE.match(name))}
+    for name, entry in _load_pack_index(channel_path).items():
+        file_sizes.setdefault(name, entry[1])
+    attachment_bytes = sum(file_sizes.values())
+    attachment_count = len(file_sizes)
+
+    json_path = os.path.join(channel_path, json_file)
+    json_mtime = os.stat(json_path).st_mtime_ns
+
+    post_count = 0
+    last_message_at = None
+    stats = {}
+    json_unchanged = previous and previous.get('json_file') == json_file and previous.get('json_mtime') == json_mtime
+    # 下載器寫入的彙總與 JSON 一致時直接使用，不必解析整個頻道
+    rollup = None if json_unchanged else _load_rollup(channel_path, json_file, json_mtime)
+    if json_unchanged:
+        # JSON 未變動，只有附件改變時不需重新解析
+        post_count = previous['post_count']
+        last_message_at = previous['last_message_at']
+        stats = previous['stats']
+    elif rollup is not None:
+        post_count = rollup.get('posts', 0)
+        last_message_at = rollup.get('last_message_at')
+        stats = rollup.get('days', {})
+    else:
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                posts = json.load(f).get('posts', [])
+            post_count = len(posts)
+            created = [post.get('created') for post in posts if post.get('created')]
+            last_message_at = max(created) if created else None
+            stats = build_rollup_days(posts, _group_files_by_prefix(file_sizes), file_sizes)
+        except (OSError, ValueError) as e:
+            # 匯出中的 JSON 可能尚未寫完，之後 mtime 變動時會再掃描
+            print(f"Unable to read channel data {json_path}: {e}")
+
+    return {
+        'dir_mtime': dir_mtime,
+        'json_mtime': json_mtime,
+        'json_file': json_file,
+        'json_size': sizes[json_file],
+        'post_count': post_count,
+        'last_message_at': last_message_at,
+        'attachment_bytes': attachment_bytes,
+        'attachment_count': attachment_count,
+        'stats': stats
+    }
+
+def _is_catalog_entry_fresh(entry, channel_path, dir_mtime):
+    """以資料夾與 JSON 檔的 mtime 判斷快取是否仍有效"""
+    if not entry or entry.get('dir_mtime') != dir_mtime:
+        return False
+    try:
+        json_mtime = os.stat(os.path.join(channel_path, entry['json_file'])).st_mtime_ns
+    except OSError:
+        return False
+    return entry.get('json_mtime') == json_mtime
+
+def get_channel_catalog(date):
+    """獲取指定日期的頻道目錄（含訊息數、最後訊息時間、附件大小）"""
+    date_path = RESULTS_BASE_PATH / date
+    if not (date.isdigit() and len(date) == 8) or not date_path.is_dir():
+        return {}
+
+    with _catalog_lock:
+        cached = _catalog_cache.get(date)
+    if cached is None:
+        cached = _load_catalog_file(date_path)
+
+    catalog = {}
+    changed = False
+    with os.scandir(date_path) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            dir_mtime = entry.stat().st_mtime_ns
+            channel_entry = cached.get(entry.name)
+            if not _is_catalog_entry_fresh(channel_entry, entry.path, dir_mtime):
+                channel_entry = _scan_channel_folder(entry.path, dir_mtime, channel_entry)
+                changed = True
+            if channel_entry:
+                catalog[entry.name] = channel_entry
+
+    if changed or catalog.keys() != cached.keys():
+        _save_catalog_file(date_path, catalog)
+
+    with _catalog_lock:
+        _catalog_cache[date] = catalog
+    return catalog
 
 def get_channels_for_date(date):
     """獲取指定日期的所有頻道"""
-    channels = []
     date_path = RESULTS_BASE_PATH / date
-    if date_path.exists():
-        for channel_folder in date_path.iterdir():
-            if channel_folder.is_dir():
-                # 尋找 JSON 檔案
-                json_files = list(channel_folder.glob('*.json'))
-                if json_files:
-                    channels.append({
-                        'name': channel_folder.name,
-                        'path': str(channel_folder),
-                        'json_file': json_files[0].name
-                    })
+    channels = []
+    for name, entry in get_channel_catalog(date).items():
+        channels.append({
+            'name': name,
+            'path': str(date_path / name),
+            'json_file': entry['json_file'],
+            'post_count': entry['post_count'],
+            'last_message_at': entry['last_message_at'],
+            'attachment_bytes': entry['attachment_bytes'],
+            'attachment_count': entry['attachment_count']
+        })
     return sorted(channels, key=lambda x: x['name'].lower())
 
+def get_timeline_channels():
+    """彙整所有日期的頻道目錄，列出可合併檢視的頻道"""
+    channels = {}
+    for date in get_available_dates():
+        for name, entry in get_channel_catalog(date).items():
+            channel = channels.setdefault(name, {
+                'name': name,
+                'json_file': entry['json_file'],
+                'post_count': 0,
+                'last_message_at': None,
+                'attachment_bytes': 0,
+                'attachment_count': 0,
+                'snapshot_count': 0
+            })
+            channel['snapshot_count'] += 1
+            channel['post_count'] = max(channel['post_count'], entry['post_count'])
+            channel['last_message_at'] = max(filter(None, [channel['last_message_at'], entry['last_message_at']]), default=None)
+            channel['attachment_bytes'] += entry['attachment_bytes']
+            channel['attachment_count'] += entry['attachment_count']
+
+    for channel in channels.values():
+        # 已建立時間軸的頻道使用去重後的訊息數
+        meta = load_timeline_meta(timeline_dir(RESULTS_BASE_PATH, channel['name']))
+        if meta:
+            channel['post_count'] = max(channel['post_count'], meta['total_posts'])
+    return sorted(channels.values(), key=lambda x: x['name'].lower())
+
+def _get_stats_catalogs(date=None):
+    """回傳所有日期的頻道目錄與目錄版本（目錄內容變動時版本加一）
+
+    STATS_CHECK_INTERVAL 秒內重複的統計請求直接使用上次檢查的目錄，不重新檢查每個日期的資料夾；
+    指定的日期不在上次檢查的結果中時（例如新的快照）立即重新檢查。
+    """
+    now = time.monotonic()
+    with _catalog_lock:
+        checked_at = _stats_catalogs['checked_at']
+        if (checked_at is not None and now - checked_at < STATS_CHECK_INTERVAL
+                and (date is None or date in _stats_catalogs['catalogs'])):
+            return _stats_catalogs['catalogs'], _stats_catalogs['generation']
+
+    catalogs = {d: get_channel_catalog(d) for d in get_available_dates()}
+    signature = tuple((d, name, entry['json_mtime'], entry['dir_mtime'])
+                      for d, catalog in catalogs.items() for name, entry in sorted(catalog.items()))
+    with _catalog_lock:
+        if signature != _stats_catalogs['signature']:
+            _stats_catalogs['signature'] = signature
+            _stats_catalogs['generation'] += 1
+        _stats_catalogs['catalogs'] = catalogs
+        _stats_catalogs['checked_at'] = now
+        return catalogs, _stats_catalogs['generation']
+
+def get_stats(date=None, channel=None):
+    """彙整統計：各頻道、使用者、每天的訊息數、討論串與各類型附件
+
+    只合併目錄快取中各頻道的每日彙總。未指定日期時合併所有快照：同一頻道同一天出現在多個快照時，
+    使用訊息數最多的那一份（重疊的快照不會重複計算）。結果依目錄版本快取；頻道不存在時回傳 None。
+    """
+    all_catalogs, generation = _get_stats_catalogs(date)
+    dates = [date] if date else list(all_catalogs)
+    catalogs = [(d, all_catalogs[d]) for d in dates]
+    if channel is not None and not any(channel in catalog for _, catalog in catalogs):
+        return None
+    key = (date, channel)
+    with _catalog_lock:
+        cached = _stats_cache.get(key)
+        if cached and cached[0] == generation:
+            _stats_cache.move_to_end(key)
+            return cached[1]
+
+    # (頻道, 日期) -> 每日彙總；dates 由新到舊，訊息數相同時使用較新的快照
+    selected = {}
+    for _, catalog in catalogs:
+        for name, entry in catalog.items():
+            if channel is not None and name != channel:
+                continue
+            for day, record in entry.get('stats', {}).items():
+                current = selected.get((name, day))
+                if current is None or record['messages'] > current['messages']:
+                    selected[(name, day)] = record
+
+    channels = {}
+    users = {}
+    days = {}
+    attachments = {}
+    for (name, day), record in selected.items():
+        attachment_count = sum(counts[0] for counts in record['attachments'].values())
+        attachment_bytes = sum(counts[1] for counts in record['attachments'].values())
+        channel_stats = channels.setdefault(name, {'name': name, 'messages': 0, 'users': set(), 'active_threads': 0,
+                                                   'attachment_count': 0, 'attachment_bytes': 0,
+                                                   'first_day': day, 'last_day': day})
+        channel_stats['messages'] += record['messages']
+        channel_stats['users'].update(record['users'])
+        channel_stats['active_threads'] += record['active_threads']
+        channel_stats['attachment_count'] += attachment_count
+        channel_stats['attachment_bytes'] += attachment_bytes
+        channel_stats['first_day'] = min(channel_stats['first_day'], day)
+        channel_stats['last_day'] = max(channel_stats['last_day'], day)
+
+        for username, count in record['users'].items():
+            user_stats = users.setdefault(username, {'name': username, 'messages': 0, 'channels': set()})
+            user_stats['messages'] += count
+            user_stats['channels'].add(name)
+
+        day_stats = days.setdefault(day, {'day': day, 'messages': 0, 'active_threads': 0, 'attachment_bytes': 0})
+        day_stats['messages'] += record['messages']
+        day_stats['active_threads'] += record['active_threads']
+        day_stats['attachment_bytes'] += attachment_bytes
+
+        for kind, (count, size) in record['attachments'].items():
+            type_stats = attachments.setdefault(kind, {'type': kind, 'count': 0, 'bytes': 0})
+            type_stats['count'] += count
+            type_stats['bytes'] += size
+
+    for channel_stats in channels.values():
+        channel_stats['users'] = len(channel_stats['users'])
+    for user_stats in users.values():
+        user_stats['channels'] = len(user_stats['channels'])
+    day_list = sorted(days.values(), key=lambda x: x['day'])
+    stats = {
+        'dates': dates,
+        'totals': {
+            'channels': len(channels),
+            'users': len(users),
+            'messages': sum(x['messages'] for x in channels.values()),
+            'active_threads': sum(x['active_threads'] for x in channels.values()),
+            'attachment_count': sum(x['count'] for x in attachments.values()),
+            'attachment_bytes': sum(x['bytes'] for x in attachments.values()),
+            'first_day': day_list[0]['day'] if day_list else None,
+            'last_day': day_list[-1]['day'] if day_list else None
+        },
+        'channels': sorted(channels.values(), key=lambda x: (-x['messages'], x['name'].lower())),
+        'users': sorted(users.values(), key=lambda x: (-x['messages'], x['name'].lower())),
+        'days': day_list,
+        'attachments': sorted(attachments.values(), key=lambda x: (-x['bytes'], x['type']))
+    }
+
+    with _catalog_lock:
+        _stats_cache[key] = (generation, stats)
+        _stats_cache.move_to_end(key)
+        while len(_stats_cache) > STATS_CACHE_SIZE:
+            _stats_cache.popitem(last=False)
+    return stats
+
+def get_channel_snapshots(channel_name):
+    """由各日期的頻道目錄找出頻道的所有快照，格式與 timeline.find_channel_snapshots 相同
+
+    每個日期只檢查頻道資料夾與 JSON 的 mtime，目錄快取過期時才重新掃描該日期。
+    """
+    snapshots = {}
+    for date in get_available_dates():
+        channel_path = RESULTS_BASE_PATH / date / channel_name
+        try:
+            dir_mtime = os.stat(channel_path).st_mtime_ns
+        except OSError:
+            continue
+        with _catalog_lock:
+            entry = _catalog_cache.get(date, {}).get(channel_name)
+        if not _is_catalog_entry_fresh(entry, channel_path, dir_mtime):
+            entry = get_channel_catalog(date).get(channel_name)
+        if entry:
+            snapshots[date] = {
+                'json_file': entry['json_file'],
+                'json_mtime': entry['json_mtime'],
+                'json_size': entry['json_size']
+            }
+    return snapshots
+
+def get_timeline_meta(channel_name):
+    """取得頻道的合併時間軸，回傳 (meta, 是否更新中)；頻道不存在時回傳 (None, False)
+
+    時間軸過期時在背景更新，更新完成前繼續提供上一個完成的世代；尚未建立過時 meta 為 None。
+    """
+    if '/' in channel_name or safe_join(str(RESULTS_BASE_PATH), INDEX_DIRNAME, channel_name) is None:
+        return None, False
+    snapshots = get_channel_snapshots(channel_name)
+    if not snapshots:
+        return None, False
+    meta = load_timeline_meta(timeline_dir(RESULTS_BASE_PATH, channel_name))
+    if meta and meta['snapshots'] == snapshots:
+        return meta, False
+    _start_timeline_build(channel_name, snapshots)
+    return meta, True
+
+def _start_timeline_build(channel_name, snapshots):
+    """在背景執行緒更新頻道的時間軸（同一頻道同時只有一個；跨程序由 timeline.py 的重建鎖協調）"""
+    with _timeline_lock:
+        if channel_name in _timeline_builds:
+            return
+        _timeline_builds.add(channel_name)
+
+    def build():
+        try:
+            update_timeline(RESULTS_BASE_PATH, channel_name, snapshots)
+        except Exception as e:
+            print(f"Unable to update timeline for {channel_name}: {e}")
+        finally:
+            with _timeline_lock:
+                _timeline_builds.discard(channel_name)
+
+    threading.Thread(target=build, name=f"timeline-{channel_name}", daemon=True).start()
+
+def _read_channel_file(json_path):
+    """讀取頻道 JSON 並依時間排序，結果依檔案 mtime 快取（LRU）"""
+    mtime = json_path.stat().st_mtime_ns
+    key = str(json_path)
+    with _channel_cache_lock:
+        cached = _channel_cache.get(key)
+        if cached and cached[0] == mtime:
+            _channel_cache.move_to_end(key)
+            return cached[1]
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    posts = data.get('posts', [])
+    # 按時間排序
+    posts.sort(key=lambda x: x.get('created', ''))
+    channel_data = {'channel': data.get('channel', {}), 'posts': posts}
+
+    with _channel_cache_lock:
+        _channel_cache[key] = (mtime, channel_data)
+        _channel_cache.move_to_end(key)
+        while len(_channel_cache) > CHANNEL_CACHE_SIZE:
+            _channel_cache.popitem(last=False)
+    return channel_data
+
+def _group_files_by_prefix(names):
+    """依 NNN_ 前綴分組檔案名稱"""
+    files_by_prefix = {}
+    for name in names:
+        prefix, sep, _ = name.partition('_')
+        if sep and prefix.isdigit():
+            files_by_prefix.setdefault(prefix, []).append(name)
+    for grouped in files_by_prefix.values():
+        grouped.sort()
+    return files_by_prefix
+
+def _index_channel_files(channel_dir):
+    """單次掃描頻道資料夾，依 NNN_ 前綴分組檔案名稱（含封裝檔中的小檔案）"""
+    with os.scandir(channel_dir) as entries:
+        names = {entry.name for entry in entries if entry.is_file()}
+    names.update(_load_pack_index(channel_dir))
+    return _group_files_by_prefix(names)
+
+def _resolve_attachment(files_by_prefix, idx, filename):
+    """尋找實際的檔案（可能有數字後綴），找不到時回傳 None"""
+    prefix = f"{idx:03d}"
+    for name in files_by_prefix.get(prefix, []):
+        if filename in name[len(prefix) + 1:]:
+            return name
+    return None
+
+def resolve_channel_json(date, channel_name, json_filename):
+    """驗證路徑參數並回傳頻道 JSON 的路徑；參數含 ..、路徑分隔字元（含解碼後的 %2F）或檔案不存在時回傳 None"""
+    if not (date.isdigit() and len(date) == 8) or not json_filename.endswith('.json'):
+        return None
+    for part in (channel_name, json_filename):
+        if part in ('', '.', '..') or any(ch in part for ch in ('/', '\\', '\0')):
+            return None
+    json_path = safe_join(str(RESULTS_BASE_PATH), date, channel_name, json_filename)
+    if json_path is None or not os.path.isfile(json_path):
+        return None
+    return Path(json_path)
+
 def load_channel_data(date, channel_name, json_filename):
     """載入頻道的聊天資料"""
     json_path = RESULTS_BASE_PATH / date / channel_name / json_filename
@@ -139,17 +730,13 @@ def load_channel_data(date, channel_name, json_filename):
         return None
     
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # 處理訊息資料
-        posts = data.get('posts', [])
+        channel_data = _read_channel_file(json_path)
+        files_by_prefix = _index_channel_files(json_path.parent)
         
-        # 按時間排序
-        posts.sort(key=lambda x: x.get('created', ''))
-        
-        # 處理每個訊息
-        for post in posts:
+        # 處理每個訊息（複製後再加入顯示欄位，避免修改快取內容）
+        posts = []
+        for cached_post in channel_data['posts']:
+            post = dict(cached_post)
             # 格式化時間
             if 'created' in post:
                 try:
@@ -168,24 +755,16 @@ def load_channel_data(date, channel_name, json_filename):
             if 'files' in post:
                 post['existing_files'] = []
                 for filename in post['files']:
-                    # 尋找實際的檔案（可能有數字後綴）
-                    file_pattern = f"{post['idx']:03d}_*{filename}*"
-                    matching_files = list((RESULTS_BASE_PATH / date / channel_name).glob(file_pattern))
-                    if matching_files:
-                        post['existing_files'].append({
-                            'original_name': filename,
-                            'actual_name': matching_files[0].name,
-                            'exists': True
-                        })
-                    else:
-                        post['existing_files'].append({
-                            'original_name': filename,
-                            'actual_name': filename,
-                            'exists': False
-                        })
+                    actual_name = _resolve_attachment(files_by_prefix, post['idx'], filename)
+                    post['existing_files'].append({
+                        'original_name': filename,
+                        'actual_name': actual_name or filename,
+                        'exists': actual_name is not None
+                    })
+            posts.append(post)
         
         return {
-            'channel': data.get('channel', {}),
+            'channel': channel_data['channel'],
             'posts': posts,
             'total_posts': len(posts)
         }
@@ -196,12 +775,209 @@ def load_channel_data(date, channel_name, json_filename):
         traceback.print_exc()
         return None
 
+def _compact_rows(posts, files_by_prefix):
+    """將訊息轉為精簡格式的欄位陣列（欄位順序見 COMPACT_FIELDS）"""
+    rows = []
+    for post in posts:
+        files = None
+        if 'files' in post:
+            files = [[filename, _resolve_attachment(files_by_prefix, post['idx'], filename)]
+                     for filename in post['files']]
+        rows.append([post.get('idx'), post.get('id'), post.get('created'), post.get('username'),
+                     post.get('message', ''), post.get('root_id'), files])
+    return rows
+
+def build_thread_index(posts):
+    """由頻道訊息建立討論串索引（格式與下載器輸出的 .index/<頻道>.threads.json 相同）"""
+    idx_by_id = {post.get('id'): post.get('idx') for post in posts}
+    threads = {}
+    for post in posts:
+        root_id = post.get('root_id')
+        if not root_id:
+            continue
+        thread = threads.setdefault(root_id, {
+            'root_idx': idx_by_id.get(root_id),
+            'replies': [],
+            'reply_count': 0,
+            'last_reply_at': None
+        })
+        # posts 已依時間排序，回覆會依序加入
+        thread['replies'].append(post.get('idx'))
+        thread['reply_count'] += 1
+        thread['last_reply_at'] = post.get('created')
+    return threads
+
+def get_thread_index(json_path, channel_data=None):
+    """取得討論串索引：優先使用下載器產生的索引檔，不存在或比頻道 JSON 舊時由訊息建立"""
+    channel_data = channel_data or _read_channel_file(json_path)
+    threads = channel_data.get('threads')
+    if threads is not None:
+        return threads
+
+    index_path = json_path.parent / INDEX_DIRNAME / f"{json_path.stem}.threads.json"
+    try:
+        if index_path.stat().st_mtime_ns >= json_path.stat().st_mtime_ns:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                threads = json.load(f).get('threads')
+    except (OSError, ValueError):
+        threads = None
+    if threads is None:
+        threads = build_thread_index(channel_data['posts'])
+
+    # 快取在頻道資料中，頻道 JSON 變動時一併失效
+    channel_data['threads'] = threads
+    channel_data['by_idx'] = {post.get('idx'): post for post in channel_data['posts']}
+    return threads
+
+def get_code_index(json_path, channel_data=None):
+    """取得程式碼區塊（訊息 id -> 區塊列表）：優先使用下載器產生的索引檔，不存在或比頻道 JSON 舊時由訊息擷取"""
+    channel_data = channel_data or _read_channel_file(json_path)
+    code = channel_data.get('code')
+    if code is not None:
+        return code
+
+    index_path = json_path.parent / INDEX_DIRNAME / f"{json_path.stem}.code.jsonl"
+    try:
+        if index_path.stat().st_mtime_ns >= json_path.stat().st_mtime_ns:
+            code = {}
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    # 同一則訊息以最後一行為準（tail 模式編輯或刪除訊息時會追加新的一行）
+                    entry = json.loads(line)
+                    if entry.get('blocks'):
+                        code[entry['id']] = entry['blocks']
+                    else:
+                        code.pop(entry['id'], None)
+    except (OSError, ValueError):
+        code = None
+    if code is None:
+        code = {}
+        for post in channel_data['posts']:
+            blocks = extract_code_blocks(post.get('message', ''))
+            if blocks:
+                code[post.get('id')] = blocks
+
+    # 快取在頻道資料中，頻道 JSON 變動時一併失效
+    channel_data['code'] = code
+    return code
+
+def build_compact_channel_payload(json_path):
+    """建立精簡格式的頻道資料（JSON bytes）
+
+    每則訊息為固定欄位順序的陣列，時間格式化與換行處理交由前端完成；
+    附件欄位為 [原始檔名, 實際檔名或 null] 的列表，threads 為 root_id -> 回覆數。
+    """
+    channel_data = _read_channel_file(json_path)
+    files_by_prefix = _index_channel_files(json_path.parent)
+    threads = get_thread_index(json_path, channel_data)
+
+    rows = _compact_rows(channel_data['posts'], files_by_prefix)
+    payload = {
+        'channel': channel_data['channel'],
+        'fields': COMPACT_FIELDS,
+        'posts': rows,
+        'total_posts': len(rows),
+        'threads': {root_id: thread['reply_count'] for root_id, thread in threads.items()}
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def build_search_index_payload(json_path):
+    """建立頻道的倒排索引（JSON bytes），供前端 Web Worker 搜尋使用
+
+    tokens 為排序後的詞彙表，postings[i] 為包含 tokens[i] 的訊息位置（與精簡格式的訊息順序相同），
+    以差值編碼縮小體積。
+    """
+    posts = _read_channel_file(json_path)['posts']
+    postings = {}
+    for position, post in enumerate(posts):
+        text = f"{post.get('message', '')} {post.get('username', '')}".lower()
+        for token in set(SEARCH_TOKEN_RE.findall(text)):
+            postings.setdefault(token, []).append(position)
+
+    tokens = sorted(postings)
+    encoded_postings = []
+    for token in tokens:
+        positions = postings[token]
+        encoded_postings.append([positions[0]] + [positions[i] - positions[i - 1] for i in range(1, len(positions))])
+
+    payload = {
+        'total_posts': len(posts),
+        'tokens': tokens,
+        'postings': encoded_postings
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def get_cached_channel_payload(json_path, kind, builder):
+    """取得 gzip 壓縮後的頻道衍生資料，並快取在頻道資料夾的 .index 目錄
+
+    快取檔名包含格式版本、頻道 JSON 與資料夾的 mtime，任一變動（新訊息、新附件）即重新產生。
+    """
+    channel_dir = json_path.parent
+    signature = f"v{CHANNEL_PAYLOAD_VERSION}-{json_path.stat().st_mtime_ns}-{channel_dir.stat().st_mtime_ns}"
+    index_dir = channel_dir / INDEX_DIRNAME
+    cache_prefix = f"{json_path.stem}.{kind}."
+    cache_path = index_dir / f"{cache_prefix}{signature}.json.gz"
+
+    if PRECOMPRESS_CHANNEL_DATA and cache_path.exists():
+        return cache_path.read_bytes()
+
+    compressed = gzip.compress(builder(json_path), compresslevel=6)
+    if PRECOMPRESS_CHANNEL_DATA:
+        try:
+            index_dir.mkdir(exist_ok=True)
+            for old_cache in index_dir.glob(f"{glob.escape(cache_prefix)}*.json.gz"):
+                old_cache.unlink()
+            tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+            tmp_path.write_bytes(compressed)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Unable to write {kind} cache for {json_path}: {e}")
+    return compressed
+
+def _precompressed_json_response(compressed):
+    """直接送出預先壓縮的 JSON；用戶端不支援 gzip 時才解壓縮"""
+    if 'gzip' in _accepted_encodings():
+        response = app.response_class(compressed, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+    return app.response_class(gzip.decompress(compressed), mimetype='application/json')
+
+def _accepted_encodings():
+    """解析 Accept-Encoding 中可使用的壓縮方式"""
+    accepted = {value.strip().split(';')[0] for value in request.headers.get('Accept-Encoding', '').split(',')}
+    return accepted
+
+@app.after_request
+def compress_response(response):
+    """壓縮 JSON 回應（brotli 優先，其次 gzip）"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = _accepted_encodings()
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/')
 @require_auth
 def index():
     """主頁面"""
     dates = get_available_dates()
-    return render_template('index.html', dates=dates)
+    return render_template('index.html', dates=dates, code_fence_pattern=CODE_FENCE_PATTERN)
 
 @app.route('/api/channels/<date>')
 @require_auth
@@ -213,11 +989,18 @@ def get_channels(date):
 @app.route('/api/channel/<date>/<path:channel_name>/<json_filename>')
 @require_auth
 def get_channel_data(date, channel_name, json_filename):
-    """API: 獲取頻道聊天資料"""
+    """API: 獲取頻道聊天資料（?format=compact 回傳精簡格式）"""
     try:
         # URL 解碼
         channel_name = unquote(channel_name)
         json_filename = unquote(json_filename)
+        json_path = resolve_channel_json(date, channel_name, json_filename)
+        if json_path is None:
+            return jsonify({'error': f'Channel data not found: {channel_name}/{json_filename}'}), 404
+        
+        if request.args.get('format') == 'compact':
+            compressed = get_cached_channel_payload(json_path, 'compact', build_compact_channel_payload)
+            return _precompressed_json_response(compressed)
         
         data = load_channel_data(date, channel_name, json_filename)
         if data:
@@ -227,41 +1010,279 @@ def get_channel_data(date, channel_name, json_filename):
     except Exception as e:
         return jsonify({'error': f'Error loading channel: {str(e)}'}), 500
 
+@app.route('/api/thread/<date>/<path:channel_name>/<json_filename>/<root_id>')
+@require_auth
+def get_thread(date, channel_name, json_filename, root_id):
+    """API: 獲取討論串（根訊息與依時間排序的回覆，精簡格式）"""
+    try:
+        channel_name = unquote(channel_name)
+        json_filename = unquote(json_filename)
+        json_path = resolve_channel_json(date, channel_name, json_filename)
+        if json_path is None:
+            return jsonify({'error': f'Channel data not found: {channel_name}/{json_filename}'}), 404
+        
+        channel_data = _read_channel_file(json_path)
+        thread = get_thread_index(json_path, channel_data).get(root_id)
+        if thread is None:
+            return jsonify({'error': f'Thread not found: {root_id}'}), 404
+        
+        by_idx = channel_data['by_idx']
+        root_post = by_idx.get(thread['root_idx']) if thread['root_idx'] is not None else None
+        posts = [by_idx[idx] for idx in thread['replies'] if idx in by_idx]
+        if root_post:
+            posts.insert(0, root_post)
+        
+        return jsonify({
+            'channel': channel_data['channel'],
+            'fields': COMPACT_FIELDS,
+            'posts': _compact_rows(posts, _index_channel_files(json_path.parent)),
+            'total_posts': len(posts),
+            'root_id': root_id,
+            'root_found': root_post is not None,
+            'reply_count': thread['reply_count'],
+            'last_reply_at': thread['last_reply_at']
+        })
+    except Exception as e:
+        return jsonify({'error': f'Error loading thread: {str(e)}'}), 500
+
+@app.route('/api/code/<date>/<path:channel_name>/<json_filename>')
+@require_auth
+def get_code_blocks(date, channel_name, json_filename):
+    """API: 獲取頻道的程式碼區塊（訊息 id -> [{lang, code}]），可用 lang、post_id 參數過濾"""
+    try:
+        channel_name = unquote(channel_name)
+        json_filename = unquote(json_filename)
+        json_path = resolve_channel_json(date, channel_name, json_filename)
+        if json_path is None:
+            return jsonify({'error': f'Channel data not found: {channel_name}/{json_filename}'}), 404
+        
+        code = get_code_index(json_path)
+        post_id = request.args.get('post_id')
+        if post_id:
+            code = {post_id: code[post_id]} if post_id in code else {}
+        lang = request.args.get('lang', '').lower()
+        if lang:
+            code = {pid: [block for block in blocks if block['lang'] == lang] for pid, blocks in code.items()}
+            code = {pid: blocks for pid, blocks in code.items() if blocks}
+        
+        return jsonify({
+            'blocks': code,
+            'total_blocks': sum(len(blocks) for blocks in code.values())
+        })
+    except Exception as e:
+        return jsonify({'error': f'Error loading code blocks: {str(e)}'}), 500
+
+@app.route('/api/search_index/<date>/<path:channel_name>/<json_filename>')
+@require_auth
+def get_search_index(date, channel_name, json_filename):
+    """API: 獲取頻道的搜尋倒排索引"""
+    try:
+        channel_name = unquote(channel_name)
+        json_filename = unquote(json_filename)
+        json_path = resolve_channel_json(date, channel_name, json_filename)
+        if json_path is None:
+            return jsonify({'error': f'Channel data not found: {channel_name}/{json_filename}'}), 404
+        
+        compressed = get_cached_channel_payload(json_path, 'search', build_search_index_payload)
+        return _precompressed_json_response(compressed)
+    except Exception as e:
+        return jsonify({'error': f'Error building search index: {str(e)}'}), 500
+
+@app.route('/api/stats')
+@require_auth
+def get_stats_api():
+    """API: 統計（?date=YYYYMMDD 只統計單一快照，?channel= 只統計單一頻道）"""
+    date = request.args.get('date') or None
+    if date is not None and date not in get_available_dates():
+        return jsonify({'error': f'Date not found: {date}'}), 404
+    channel = request.args.get('channel') or None
+    stats = get_stats(date, channel)
+    if stats is None:
+        return jsonify({'error': f'Channel not found: {channel}'}), 404
+    return jsonify(stats)
+
+@app.route('/api/timeline_channels')
+@require_auth
+def get_timeline_channel_list():
+    """API: 獲取可合併檢視的頻道列表（跨所有日期）"""
+    return jsonify(get_timeline_channels())
+
+@app.route('/api/timeline/<path:channel_name>')
+@require_auth
+def get_timeline(channel_name):
+    """API: 分頁獲取跨快照合併的頻道時間軸（精簡格式，未指定 offset 時回傳最新一頁）"""
+    try:
+        channel_name = unquote(channel_name)
+        meta, building = get_timeline_meta(channel_name)
+        if meta is None:
+            if building:
+                # 第一次建立時間軸：前端稍後重試
+                response = jsonify({'building': True})
+                response.headers['Retry-After'] = '1'
+                return response, 202
+            return jsonify({'error': f'Channel not found: {channel_name}'}), 404
+        
+        total = meta['total_posts']
+        limit = max(1, min(request.args.get('limit', TIMELINE_PAGE_SIZE, type=int), TIMELINE_MAX_PAGE_SIZE))
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            offset = max(total - limit, 0)
+        offset = max(0, min(offset, total))
+        posts = read_timeline_page(RESULTS_BASE_PATH, channel_name, meta, offset, limit)
+        
+        # 附件位於訊息的來源快照資料夾，每個快照只掃描一次
+        files_by_snapshot = {}
+        rows = []
+        for post in posts:
+            snapshot = post['snapshot']
+            if snapshot not in files_by_snapshot:
+                try:
+                    files_by_snapshot[snapshot] = _index_channel_files(RESULTS_BASE_PATH / snapshot / channel_name)
+                except OSError:
+                    files_by_snapshot[snapshot] = {}
+            row = _compact_rows([post], files_by_snapshot[snapshot])[0]
+            row.append(snapshot)
+            rows.append(row)
+        
+        return jsonify({
+            'channel': meta['channel'],
+            'fields': COMPACT_FIELDS + ['snapshot'],
+            'posts': rows,
+            'total_posts': total,
+            'offset': offset,
+            'snapshots': {date: info['json_file'] for date, info in meta['snapshots'].items()},
+            'updating': building,
+            'threads': {post['id']: post['reply_count'] for post in posts if post.get('reply_count')}
+        })
+    except Exception as e:
+        return jsonify({'error': f'Error loading timeline: {str(e)}'}), 500
+
+def _apply_file_cache_headers(response):
+    """封存附件不會變動：允許瀏覽器長期快取，但因需登入而標記為 private"""
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = FILE_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def _x_accel_response(date, channel_name, filename):
+    """交由 nginx 透過 X-Accel-Redirect 傳送檔案內容"""
+    file_path = safe_join(str(RESULTS_BASE_PATH / date / channel_name), filename)
+    if file_path is None or not os.path.isfile(file_path):
+        return jsonify({'error': f'File not found: {filename}'}), 404
+
+    response = app.response_class()
+    response.headers['X-Accel-Redirect'] = quote(f"{X_ACCEL_PREFIX}/{date}/{channel_name}/{filename}")
+    response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return _apply_file_cache_headers(response)
+
+def _packed_file_response(channel_dir, filename):
+    """實體檔案不存在時，依封裝索引的 offset 從 .index/pack.bin 讀取；不在封裝檔中時回傳 None"""
+    channel_dir = str(channel_dir)
+    file_path = safe_join(channel_dir, filename)
+    if file_path is None or os.path.isfile(file_path):
+        return None
+    entries, pack_name = _load_pack(channel_dir)
+    entry = entries.get(filename)
+    if entry is None:
+        return None
+
+    offset, size = entry[0], entry[1]
+    pack_path = os.path.join(channel_dir, INDEX_DIRNAME, pack_name)
+    try:
+        with open(pack_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size)
+    except OSError:
+        return None
+    if len(data) != size:
+        return None
+    # 索引記錄內容的 sha256（舊索引沒有時以位置與大小代替，同名項目重新寫入時位置會改變）
+    etag = entry[2].split(':', 1)[-1] if len(entry) > 2 else f"pack-{offset}-{size}"
+    response = send_file(io.BytesIO(data), mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                         conditional=True, etag=etag,
+                         last_modified=os.stat(pack_path).st_mtime, max_age=FILE_CACHE_MAX_AGE)
+    return _apply_file_cache_headers(response)
+
 @app.route('/files/<date>/<path:channel_name>/<filename>')
 @require_auth
 def serve_file(date, channel_name, filename):
-    """提供檔案下載"""
+    """提供檔案下載（支援 ETag/Last-Modified 條件請求與 Range 斷點/拖曳播放）"""
     try:
         # URL 解碼
         channel_name = unquote(channel_name)
         filename = unquote(filename)
         
+        # 封裝檔中的小檔案由 Flask 直接傳送（前端伺服器無法依 offset 讀取）
+        channel_dir = safe_join(str(RESULTS_BASE_PATH), date, channel_name)
+        packed = _packed_file_response(channel_dir, filename) if channel_dir else None
+        if packed is not None:
+            return packed
+        
+        if FILE_SERVE_MODE == 'x-accel':
+            return _x_accel_response(date, channel_name, filename)
+        
         file_path = RESULTS_BASE_PATH / date / channel_name
-        return send_from_directory(file_path, filename)
+        # conditional=True 會處理 If-None-Match/If-Modified-Since 與 Range 標頭；
+        # x-sendfile 模式下 Flask 只回傳 X-Sendfile 標頭，由前端伺服器傳送內容
+        response = send_from_directory(file_path, filename, conditional=True, etag=True,
+                                       max_age=FILE_CACHE_MAX_AGE)
+        return _apply_file_cache_headers(response)
     except Exception as e:
         return jsonify({'error': f'File not found: {str(e)}'}), 404
 
+@app.route('/thumbs/<date>/<path:channel_name>/<filename>')
+@require_auth
+def serve_thumbnail(date, channel_name, filename):
+    """提供圖片縮圖（第一次請求時產生並快取），無法產生時改送原始檔案"""
+    channel_name = unquote(channel_name)
+    filename = unquote(filename)
+    original_url = url_for('serve_file', date=date, channel_name=channel_name, filename=filename)
+    
+    channel_dir = safe_join(str(RESULTS_BASE_PATH), date, channel_name)
+    if channel_dir is None or safe_join(channel_dir, filename) is None or not is_thumbnail_supported(filename):
+        return redirect(original_url)
+    
+    try:
+        thumb_path = ensure_thumbnail(channel_dir, filename)
+    except Exception as e:
+        print(f"Unable to create thumbnail for {channel_name}/{filename}: {e}")
+        thumb_path = None
+    if thumb_path is None:
+        return redirect(original_url)
+    
+    response = send_file(thumb_path, mimetype='image/jpeg', conditional=True, etag=True,
+                         max_age=FILE_CACHE_MAX_AGE)
+    return _apply_file_cache_headers(response)
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("🔐 EasyViewer 安全模式已啟用")
     print("="*60)
     
-    if ACCESS_PASSWORD == 'mattermost2024':
+    if _password_path().exists():
+        print("✅ 使用「修改密碼」設定的密碼")
+        print(f"   💡 刪除 {_password_path()} 即恢復使用 ACCESS_PASSWORD")
+    elif ACCESS_PASSWORD == 'mattermost2024':
         print("⚠️  警告：正在使用預設密碼！")
-        print("   🔑 當前密碼：mattermost2024 (固定不變)")
-        print("   💡 如要更改密碼，請重新啟動並設定：")
+        print("   🔑 當前密碼：mattermost2024")
+        print("   💡 如要更改密碼，請登入後使用「修改密碼」，或重新啟動並設定：")
         print("      export ACCESS_PASSWORD=\"你的新密碼\" && python app.py")
     else:
         print("✅ 已設定自訂密碼")
-        print(f"   🔑 當前密碼已設定 (重啟前不會改變)")
+    
+    # Werkzeug 除錯器可執行任意程式碼：只在 FLASK_DEBUG 明確啟用時開啟，且只綁定本機
+    debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
+    host = '127.0.0.1' if debug else '0.0.0.0'
     
     print(f"\n🕐 Session 有效期：{SESSION_TIMEOUT // 60} 分鐘")
     print("🌐 存取網址：http://127.0.0.1:5005")
+    if debug:
+        print("🐞 除錯模式已啟用（FLASK_DEBUG），只接受本機連線")
     print("\n💡 密碼說明：")
-    print("   • 密碼在服務運行期間保持不變")
-    print("   • 忘記密碼時，停止服務重新啟動即可")
-    print("   • 重啟時可重新設定 ACCESS_PASSWORD 環境變數")
-    print("📖 詳細說明：請參考 README_安全設定.md")
+    print("   • 修改的密碼儲存在 results/.index/password.json，重新啟動後仍然有效")
+    print("   • 忘記密碼時，刪除此檔案即恢復使用 ACCESS_PASSWORD 環境變數（預設 mattermost2024）")
+    print("📖 詳細說明：請參考 security_config.md")
     print("\n" + "="*60 + "\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5005)
\ No newline at end of file
+    app.run(debug=debug, host=host, port=5005)
@@ -0,0 +1,45 @@
+"""
+EasyViewer 正式環境 Gunicorn 設定
+使用方式：./start.sh prod 或 gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import secrets
+import multiprocessing
+
+# 多個 worker 必須共用同一組 SECRET_KEY，否則 Session 會在 worker 之間失效
+# 設定檔在 master 程序載入，這裡寫入的環境變數會被所有 worker 繼承
+if not os.environ.get('SECRET_KEY'):
+    os.environ['SECRET_KEY'] = secrets.token_hex(32)
+
+bind = os.environ.get('EASYVIEWER_BIND', '0.0.0.0:5005')
+workers = int(os.environ.get('EASYVIEWER_WORKERS', str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+threads = int(os.environ.get('EASYVIEWER_THREADS', '4'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# 大型附件下載可能需要較長時間
+timeout = int(os.environ.get('EASYVIEWER_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('EASYVIEWER_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# PID 檔案供 ./start.sh reload 送出 HUP 進行平滑重載
+pidfile = os.environ.get('EASYVIEWER_PIDFILE', 'easyviewer.pid')
+
+# 請求計時日誌：%(D)s 為處理時間（微秒）
+accesslog = os.environ.get('EASYVIEWER_ACCESS_LOG', '-')
+errorlog = os.environ.get('EASYVIEWER_ERROR_LOG', '-')
+loglevel = os.environ.get('EASYVIEWER_LOG_LEVEL', 'info')
+access_log_format = '%(h)s "%(r)s" %(s)s %(B)s %(D)sus pid=%(p)s'
+
+
+def post_worker_init(worker):
+    """每個 worker 啟動後預熱日期與頻道目錄快取（磁碟上的 catalog 由所有 worker 共用）"""
+    from app import get_available_dates, get_channel_catalog
+
+    try:
+        dates = get_available_dates()
+        for date in dates:
+            get_channel_catalog(date)
+        worker.log.info("Catalog cache warmed for %d dates", len(dates))
+    except Exception as e:
+        worker.log.warning("Catalog warm-up failed: %s", e)
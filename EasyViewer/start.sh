@@ -1,8 +1,32 @@
 #!/bin/bash
 
 # Mattermost 聊天記錄查看器啟動腳本
+# 用法：
+#   ./start.sh          開發模式（Flask 內建伺服器，單一程序）
+#   ./start.sh prod     正式模式（Gunicorn 多 worker）
+#   ./start.sh reload   平滑重載正式模式的 worker
+#   ./start.sh stop     停止正式模式
+
+MODE=${1:-dev}
+PIDFILE=${EASYVIEWER_PIDFILE:-easyviewer.pid}
 
 echo "=== Mattermost 聊天記錄查看器 ==="
+
+if [ "$MODE" = "reload" ] || [ "$MODE" = "stop" ]; then
+    if [ ! -f "$PIDFILE" ]; then
+        echo "錯誤：找不到 PID 檔案 $PIDFILE，正式模式是否已啟動？"
+        exit 1
+    fi
+    if [ "$MODE" = "reload" ]; then
+        # HUP：重新載入設定並以新 worker 平滑替換舊 worker
+        kill -HUP "$(cat "$PIDFILE")" && echo "已送出平滑重載訊號"
+    else
+        # TERM：等待處理中的請求完成後停止
+        kill -TERM "$(cat "$PIDFILE")" && echo "已送出停止訊號"
+    fi
+    exit $?
+fi
+
 echo "正在啟動 Web 介面..."
 echo ""
 
@@ -26,10 +50,31 @@ if ! python -c "import flask" &> /dev/null; then
     pip install -r requirements.txt
 fi
 
+if [ "$MODE" = "prod" ]; then
+    if ! python -c "import gunicorn" &> /dev/null; then
+        echo "正在安裝 Gunicorn..."
+        pip install -r requirements.txt
+    fi
+
+    # 所有 worker 必須共用同一組 SECRET_KEY
+    if [ -z "$SECRET_KEY" ]; then
+        export SECRET_KEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+        echo "提示：未設定 SECRET_KEY，已產生本次執行使用的隨機金鑰（重啟後需重新登入）"
+    fi
+
+    echo "啟動正式模式 (Gunicorn)..."
+    echo "綁定位址: ${EASYVIEWER_BIND:-0.0.0.0:5005}"
+    echo "Worker 數量: ${EASYVIEWER_WORKERS:-自動}  每個 Worker 執行緒: ${EASYVIEWER_THREADS:-4}"
+    echo "平滑重載: ./start.sh reload    停止: ./start.sh stop"
+    echo ""
+
+    exec gunicorn -c gunicorn.conf.py app:app
+fi
+
 # 啟動應用程式
 echo "啟動 Web 伺服器..."
-echo "請在瀏覽器中開啟: http://localhost:5001"
+echo "請在瀏覽器中開啟: http://localhost:5005"
 echo "按 Ctrl+C 停止伺服器"
 echo ""
 
-python app.py
\ No newline at end of file
+python app.py
@@ -0,0 +1,136 @@
+// 頻道搜尋 Web Worker
+// 使用伺服器產生的倒排索引（/api/search_index/...）縮小候選訊息，再以原始文字確認匹配，
+// 搜尋結果分批回傳，主執行緒在輸入時不會被阻塞。
+//
+// 訊息格式：
+//   主執行緒 -> worker: {type: 'load', channelKey, index, texts}
+//                       {type: 'search', requestId, query}
+//   worker -> 主執行緒: {type: 'loaded', channelKey}
+//                       {type: 'results', requestId, positions, done}
+
+// 與 app.py 的 SEARCH_TOKEN_RE (\w+) 相同的斷詞規則
+const TOKEN_RE = /[\p{L}\p{N}_]+/gu;
+const RESULT_CHUNK_SIZE = 500; // 每批回傳的結果數
+const VERIFY_SLICE = 5000; // 每次讓出執行緒前確認的候選訊息數
+const TOKEN_CACHE_LIMIT = 256; // 子詞匹配快取的最大數量
+
+let channelKey = null;
+let tokens = [];
+let postings = [];
+let texts = [];
+let currentRequestId = 0;
+let tokenMatchCache = new Map(); // 子詞 -> 包含該子詞的詞彙索引列表
+
+function tokenize(text) {
+    return text.match(TOKEN_RE) || [];
+}
+
+// 解開差值編碼的 posting list
+function decodePostings(encoded) {
+    return encoded.map(list => {
+        const positions = new Uint32Array(list.length);
+        let value = 0;
+        for (let i = 0; i < list.length; i++) {
+            value += list[i];
+            positions[i] = value;
+        }
+        return positions;
+    });
+}
+
+// 找出包含子詞的所有詞彙；輸入延伸時（例如 "hel" -> "hell"）只需掃描上一次的結果
+function matchTokens(subToken) {
+    if (tokenMatchCache.has(subToken)) {
+        return tokenMatchCache.get(subToken);
+    }
+    let candidates = null;
+    for (const [cachedToken, cachedMatches] of tokenMatchCache) {
+        if (subToken.includes(cachedToken) && (!candidates || cachedMatches.length < candidates.length)) {
+            candidates = cachedMatches;
+        }
+    }
+    const matches = [];
+    if (candidates) {
+        for (const tokenIndex of candidates) {
+            if (tokens[tokenIndex].includes(subToken)) matches.push(tokenIndex);
+        }
+    } else {
+        for (let i = 0; i < tokens.length; i++) {
+            if (tokens[i].includes(subToken)) matches.push(i);
+        }
+    }
+    if (tokenMatchCache.size >= TOKEN_CACHE_LIMIT) {
+        tokenMatchCache = new Map();
+    }
+    tokenMatchCache.set(subToken, matches);
+    return matches;
+}
+
+// 以倒排索引計算候選訊息（所有子詞都必須出現），無法使用索引時回傳 null
+function candidatePositions(keywords) {
+    let candidates = null;
+    for (const keyword of keywords) {
+        for (const subToken of tokenize(keyword)) {
+            const marks = new Uint8Array(texts.length);
+            for (const tokenIndex of matchTokens(subToken)) {
+                const positions = postings[tokenIndex];
+                for (let i = 0; i < positions.length; i++) {
+                    marks[positions[i]] = 1;
+                }
+            }
+            if (candidates) {
+                for (let i = 0; i < candidates.length; i++) {
+                    candidates[i] &= marks[i];
+                }
+            } else {
+                candidates = marks;
+            }
+        }
+    }
+    return candidates;
+}
+
+function search(requestId, query) {
+    const keywords = query.trim().toLowerCase().split(/\s+/).filter(Boolean);
+    const candidates = candidatePositions(keywords);
+    let position = 0;
+    let pending = [];
+
+    // 分段確認候選訊息，每段之間讓出執行緒，以便處理新的搜尋請求
+    function verifySlice() {
+        if (requestId !== currentRequestId) return; // 已有較新的搜尋
+        const sliceEnd = Math.min(position + VERIFY_SLICE, texts.length);
+        for (; position < sliceEnd; position++) {
+            if (candidates && !candidates[position]) continue;
+            const text = texts[position];
+            if (keywords.every(keyword => text.includes(keyword))) {
+                pending.push(position);
+                if (pending.length >= RESULT_CHUNK_SIZE) {
+                    postMessage({ type: 'results', requestId: requestId, positions: pending, done: false });
+                    pending = [];
+                }
+            }
+        }
+        if (position < texts.length) {
+            setTimeout(verifySlice, 0);
+        } else {
+            postMessage({ type: 'results', requestId: requestId, positions: pending, done: true });
+        }
+    }
+    verifySlice();
+}
+
+onmessage = function(event) {
+    const message = event.data;
+    if (message.type === 'load') {
+        channelKey = message.channelKey;
+        tokens = message.index.tokens;
+        postings = decodePostings(message.index.postings);
+        texts = message.texts;
+        tokenMatchCache = new Map();
+        postMessage({ type: 'loaded', channelKey: channelKey });
+    } else if (message.type === 'search') {
+        currentRequestId = message.requestId;
+        search(message.requestId, message.query);
+    }
+};
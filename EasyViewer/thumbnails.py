@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+圖片附件縮圖產生工具
+EasyViewer 的 /thumbs 路由會在第一次請求時產生縮圖；下載完成後也可以批次預先產生：
+
+    python thumbnails.py ../results/20240101 --workers 4
+    python thumbnails.py ../results            # 處理所有日期
+
+縮圖儲存在各頻道資料夾的 .index/thumbs/ 目錄，原始檔案較新時會重新產生。
+"""
+
+import os
+import sys
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+INDEX_DIRNAME = '.index'
+THUMB_DIRNAME = 'thumbs'
+THUMB_SIZE = int(os.environ.get('THUMB_SIZE', '400'))  # 縮圖最長邊（像素）
+THUMB_QUALITY = int(os.environ.get('THUMB_QUALITY', '80'))
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+
+
+def is_thumbnail_supported(filename: str) -> bool:
+    """檢查是否能為此檔案產生縮圖（需安裝 Pillow）"""
+    return Image is not None and os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def thumbnail_path(channel_dir: Path, filename: str, size: int = THUMB_SIZE) -> Path:
+    """縮圖的儲存路徑"""
+    return channel_dir / INDEX_DIRNAME / THUMB_DIRNAME / f"{filename}.{size}.jpg"
+
+
+def ensure_thumbnail(channel_dir, filename: str, size: int = THUMB_SIZE):
+    """確保縮圖存在且比原始檔案新，回傳縮圖路徑；無法產生時回傳 None"""
+    channel_dir = Path(channel_dir)
+    source = channel_dir / filename
+    target = thumbnail_path(channel_dir, filename, size)
+
+    if not is_thumbnail_supported(filename) or not source.is_file():
+        return None
+
+    try:
+        if target.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+            return target
+    except FileNotFoundError:
+        pass
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(source) as img:
+        # JPEG 可在解碼時直接縮小，大幅減少大圖的解碼時間
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        img.save(tmp_path, 'JPEG', quality=THUMB_QUALITY, optimize=True)
+    os.replace(tmp_path, target)
+    return target
+
+
+def _thumbnail_job(args):
+    """批次處理用的 worker 函數，回傳 (檔案路徑, 是否成功, 錯誤訊息)"""
+    channel_dir, filename, size = args
+    try:
+        return str(Path(channel_dir) / filename), ensure_thumbnail(channel_dir, filename, size) is not None, None
+    except Exception as e:
+        return str(Path(channel_dir) / filename), False, str(e)
+
+
+def find_image_attachments(root: Path):
+    """找出 root 底下所有頻道資料夾中的圖片附件"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        # 略過 .index 等隱藏目錄
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if is_thumbnail_supported(filename):
+                yield dirpath, filename
+
+
+def generate_thumbnails(root, workers: int = None, size: int = THUMB_SIZE) -> dict:
+    """以程序池批次產生縮圖"""
+    jobs = [(dirpath, filename, size) for dirpath, filename in find_image_attachments(Path(root))]
+    stats = {'total': len(jobs), 'generated': 0, 'failed': 0, 'errors': []}
+    if not jobs:
+        return stats
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, success, error in executor.map(_thumbnail_job, jobs, chunksize=16):
+            if success:
+                stats['generated'] += 1
+            else:
+                stats['failed'] += 1
+                stats['errors'].append(f"{path}: {error}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次產生圖片附件縮圖")
+    parser.add_argument('root', help="results 資料夾、日期資料夾或頻道資料夾")
+    parser.add_argument('--workers', type=int, default=None, help="平行處理的程序數（預設為 CPU 數）")
+    parser.add_argument('--size', type=int, default=THUMB_SIZE, help=f"縮圖最長邊像素（預設 {THUMB_SIZE}）")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("錯誤：需要安裝 Pillow 才能產生縮圖 (pip install Pillow)")
+        sys.exit(1)
+
+    stats = generate_thumbnails(args.root, args.workers, args.size)
+    print(f"圖片附件: {stats['total']} 個，縮圖就緒（含既有）: {stats['generated']} 個，失敗: {stats['failed']} 個")
+    for error in stats['errors'][:20]:
+        print(f"  - {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+跨快照合併時間軸
+每次下載都會產生 results/<YYYYMMDD>/<頻道>/ 的完整或增量副本，本模組將同一頻道在所有日期的
+訊息依 id 去重後合併成單一時間軸，只儲存一次，供 EasyViewer 分頁讀取：
+
+    results/.index/timeline/<頻道>/
+        meta.json               # 已合併的快照、訊息總數、目前的世代
+        posts.<世代>.jsonl      # 依時間排序的訊息，每行一則（含來源快照日期 snapshot）
+        offsets.<世代>.bin      # 每行的起始位置（uint64），分頁時直接 seek
+        replies.<世代>.json     # 根訊息 id -> 回覆數
+
+新增或修改最新的快照時（新的一天、重新匯出今天、即時同步追加訊息），只讀取變動的快照，
+並以串流方式合併進既有時間軸；較舊的快照被修改或刪除時才完整重建。
+同一則訊息出現在多個快照時，以最新快照的內容為準（保留編輯後的訊息）。
+
+下載工具匯出完成後會自動更新時間軸，也可以手動建立：
+
+    python timeline.py ../results              # 所有頻道
+    python timeline.py ../results 頻道名稱
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import argparse
+from array import array
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+INDEX_DIRNAME = '.index'
+TIMELINE_DIRNAME = 'timeline'
+TIMELINE_VERSION = 2
+BUILD_LOCK_TIMEOUT = 3600  # 重建鎖超過此秒數視為殘留（持有的程序異常結束）
+OFFSET_TYPECODE = 'Q'
+ATTACHMENT_NAME_RE = re.compile(r'^\d{3,}_')  # 下載器儲存附件的 NNN_ 前綴（附件也可能是 .json 檔）
+
+
+def timeline_dir(results_root, channel_name: str) -> Path:
+    """時間軸的儲存目錄"""
+    return Path(results_root) / INDEX_DIRNAME / TIMELINE_DIRNAME / channel_name
+
+
+def _snapshot_dates(results_root):
+    """所有日期資料夾（由舊到新）"""
+    try:
+        with os.scandir(results_root) as entries:
+            return sorted(entry.name for entry in entries
+                          if entry.is_dir() and entry.name.isdigit() and len(entry.name) == 8)
+    except FileNotFoundError:
+        return []
+
+
+def select_channel_json(names, channel_name: str):
+    """從頻道資料夾的檔案名稱中找出頻道 JSON
+
+    優先使用與資料夾同名的 <頻道>.json；否則取排序後第一個不是附件（NNN_ 前綴）的 JSON 檔。
+    找不到時回傳 None。
+    """
+    candidates = [name for name in names if name.endswith('.json') and not name.startswith('.')]
+    if f"{channel_name}.json" in candidates:
+        return f"{channel_name}.json"
+    candidates = sorted(name for name in candidates if not ATTACHMENT_NAME_RE.match(name))
+    return candidates[0] if candidates else None
+
+
+def find_channel_snapshots(results_root, channel_name: str) -> dict:
+    """找出頻道在各日期的 JSON 檔，回傳 {日期: {json_file, json_mtime, json_size}}"""
+    snapshots = {}
+    for date in _snapshot_dates(results_root):
+        channel_path = os.path.join(results_root, date, channel_name)
+        try:
+            with os.scandir(channel_path) as entries:
+                json_file = select_channel_json([entry.name for entry in entries if entry.is_file()],
+                                                channel_name)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        if json_file is None:
+            continue
+        stat = os.stat(os.path.join(channel_path, json_file))
+        snapshots[date] = {
+            'json_file': json_file,
+            'json_mtime': stat.st_mtime_ns,
+            'json_size': stat.st_size
+        }
+    return snapshots
+
+
+def list_timeline_channels(results_root) -> list:
+    """所有日期中出現過的頻道名稱"""
+    names = set()
+    for date in _snapshot_dates(results_root):
+        with os.scandir(os.path.join(results_root, date)) as entries:
+            names.update(entry.name for entry in entries
+                         if entry.is_dir() and not entry.name.startswith('.'))
+    return sorted(names, key=str.lower)
+
+
+def load_timeline_meta(channel_timeline_dir: Path):
+    """載入時間軸的 meta.json，不存在或版本不符時回傳 None"""
+    try:
+        with open(channel_timeline_dir / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != TIMELINE_VERSION:
+        return None
+    return meta
+
+
+def _post_key(post: dict):
+    """去重用的鍵值：優先使用 Mattermost 訊息 id"""
+    return post.get('id') or f"{post.get('snapshot')}:{post.get('idx')}"
+
+
+def _sort_key(post: dict):
+    """時間軸的排序鍵值"""
+    return (post.get('created', ''), post.get('id', ''))
+
+
+def _encode_post(post: dict) -> bytes:
+    return json.dumps(post, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _tmp_path(path: Path) -> Path:
+    """寫入中的暫存檔名稱（含 pid，多個 worker 同時重建時不會互相覆寫）"""
+    return path.with_name(f"{path.name}.{os.getpid()}.tmp")
+
+
+class _RebuildRequired(Exception):
+    """增量合併無法保證結果正確（重新匯出的快照少了原本的訊息），需要完整重建"""
+
+
+@contextmanager
+def _build_lock(channel_timeline_dir: Path):
+    """跨程序的重建鎖（build.lock 記錄 pid）；其他程序重建中時等待，持有的程序已結束或逾時則接手"""
+    lock_path = channel_timeline_dir / 'build.lock'
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                with open(lock_path, 'r') as f:
+                    pid = int(f.read() or 0)
+                stale = time.time() - lock_path.stat().st_mtime > BUILD_LOCK_TIMEOUT
+            except (OSError, ValueError):
+                pid, stale = 0, False
+            if pid and not stale:
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    stale = True
+                except OSError:
+                    pass
+            if stale:
+                try:
+                    os.unlink(lock_path)
+                except OSError:
+                    pass
+                continue
+            time.sleep(0.5)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.unlink(lock_path)
+        except OSError:
+            pass
+
+
+def _load_reply_counts(channel_timeline_dir: Path, generation: int) -> dict:
+    """世代的回覆數（根訊息 id -> 回覆數），依檔案 mtime 快取"""
+    path = channel_timeline_dir / f"replies.{generation}.json"
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return {}
+    return _read_reply_counts(str(path), mtime)
+
+
+@lru_cache(maxsize=16)
+def _read_reply_counts(path: str, mtime: int) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_timeline(channel_timeline_dir: Path, generation: int, lines, reply_counts: dict):
+    """寫入新世代的訊息檔、位置檔與回覆數；lines 為依時間排序的 (排序鍵值, JSON 行)，回傳 (訊息數, 最後的排序鍵值)"""
+    posts_path = channel_timeline_dir / f"posts.{generation}.jsonl"
+    offsets_path = channel_timeline_dir / f"offsets.{generation}.bin"
+    replies_path = channel_timeline_dir / f"replies.{generation}.json"
+    offsets = array(OFFSET_TYPECODE)
+    position = 0
+    last_key = None
+    try:
+        with open(_tmp_path(posts_path), 'wb') as f:
+            for last_key, line in lines:
+                offsets.append(position)
+                f.write(line)
+                position += len(line)
+        offsets.append(position)  # 結尾位置，讀取最後一頁時使用
+        with open(_tmp_path(offsets_path), 'wb') as f:
+            offsets.tofile(f)
+        with open(_tmp_path(replies_path), 'w', encoding='utf-8') as f:
+            json.dump(reply_counts, f, ensure_ascii=False, separators=(',', ':'))
+    except BaseException:
+        for path in (posts_path, offsets_path, replies_path):
+            try:
+                os.unlink(_tmp_path(path))
+            except OSError:
+                pass
+        raise
+    os.replace(_tmp_path(posts_path), posts_path)
+    os.replace(_tmp_path(offsets_path), offsets_path)
+    os.replace(_tmp_path(replies_path), replies_path)
+    return len(offsets) - 1, last_key
+
+
+def _remove_old_generations(channel_timeline_dir: Path, keep: set):
+    """刪除舊世代的檔案（保留目前與前一個世代，讓正在讀取的請求可以完成）"""
+    for path in channel_timeline_dir.iterdir():
+        parts = path.name.split('.')
+        if parts[0] in ('posts', 'offsets', 'replies') and len(parts) == 3 and parts[1].isdigit() \
+                and int(parts[1]) not in keep:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def _read_snapshots(results_root, channel_name: str, snapshots: dict, dates: list, channel_info: dict):
+    """讀取指定日期的快照，回傳 (id -> 訊息, 頻道資訊)；較新的快照覆蓋較舊的內容
+
+    匯出中的 JSON 可能尚未寫完，讀取失敗的日期從 snapshots 移除，mtime 變動後會重新合併。
+    """
+    posts = {}
+    for date in sorted(dates):
+        json_path = Path(results_root) / date / channel_name / snapshots[date]['json_file']
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            snapshots.pop(date)
+            continue
+        channel_info = data.get('channel', channel_info)
+        for post in data.get('posts', []):
+            post = dict(post)
+            post['snapshot'] = date
+            post.pop('reply_count', None)
+            posts[_post_key(post)] = post
+        del data
+    return posts, channel_info
+
+
+def _count_replies(posts) -> dict:
+    reply_counts = {}
+    for post in posts:
+        if post.get('root_id'):
+            reply_counts[post['root_id']] = reply_counts.get(post['root_id'], 0) + 1
+    return reply_counts
+
+
+def _merge_newest(channel_timeline_dir: Path, meta: dict, generation: int, replaced: set, new_posts: dict):
+    """把最新的快照合併進既有時間軸：逐行讀取既有世代，移除被取代的訊息，與新訊息依時間合併寫入
+
+    只解析變動的快照；既有時間軸以串流方式處理，記憶體只需容納新快照與回覆數。
+    replaced 為重新合併的既有快照日期，這些快照原本的訊息會被移除；
+    若重新匯出的快照少了原本由它提供的訊息（可能遮蓋了較舊快照的版本），拋出 _RebuildRequired。
+    """
+    reply_counts = dict(_load_reply_counts(channel_timeline_dir, meta['generation']))
+
+    def adjust(root_id, delta):
+        count = reply_counts.get(root_id, 0) + delta
+        if count > 0:
+            reply_counts[root_id] = count
+        else:
+            reply_counts.pop(root_id, None)
+
+    def existing_lines():
+        with open(channel_timeline_dir / f"posts.{meta['generation']}.jsonl", 'rb') as f:
+            for line in f:
+                post = json.loads(line)
+                key = _post_key(post)
+                if key in new_posts or post.get('snapshot') in replaced:
+                    if key not in new_posts:
+                        raise _RebuildRequired()
+                    if post.get('root_id'):
+                        adjust(post['root_id'], -1)
+                    continue
+                yield _sort_key(post), line
+
+    for post in new_posts.values():
+        if post.get('root_id'):
+            adjust(post['root_id'], 1)
+    new_lines = sorted((_sort_key(post), _encode_post(post)) for post in new_posts.values())
+    # 回覆數在串流結束後才確定，先寫入訊息再寫入回覆數
+    return _write_timeline(channel_timeline_dir, generation, heapq.merge(existing_lines(), new_lines),
+                           reply_counts)
+
+
+def update_timeline(results_root, channel_name: str, snapshots: dict = None) -> dict:
+    """建立或更新頻道的合併時間軸，回傳 meta；頻道不存在於任何快照時回傳 None
+
+    snapshots 為 find_channel_snapshots 格式的快照清單；呼叫端已有頻道目錄時可直接傳入，避免重新掃描各日期資料夾。
+    只有最新的快照新增或變動時（新的一天、重新匯出今天、即時同步追加訊息），只讀取這些快照並合併進既有時間軸；
+    較舊的快照變動或被刪除時才重新讀取所有快照。其他程序正在建立同一頻道時等待其完成。
+    """
+    channel_timeline_dir = timeline_dir(results_root, channel_name)
+    if snapshots is None:
+        snapshots = find_channel_snapshots(results_root, channel_name)
+    snapshots = dict(snapshots)
+    if not snapshots:
+        return None
+
+    meta = load_timeline_meta(channel_timeline_dir)
+    if meta and meta['snapshots'] == snapshots:
+        return meta
+
+    channel_timeline_dir.mkdir(parents=True, exist_ok=True)
+    with _build_lock(channel_timeline_dir):
+        # 等待期間其他程序可能已完成相同的更新
+        meta = load_timeline_meta(channel_timeline_dir)
+        if meta and meta['snapshots'] == snapshots:
+            return meta
+        return _build_timeline(results_root, channel_name, snapshots, meta)
+
+
+def _build_timeline(results_root, channel_name: str, snapshots: dict, meta: dict) -> dict:
+    channel_timeline_dir = timeline_dir(results_root, channel_name)
+    merged = meta['snapshots'] if meta else {}
+    changed = sorted(date for date, info in snapshots.items() if merged.get(date) != info)
+    unchanged = [date for date, info in merged.items() if snapshots.get(date) == info]
+    removed = [date for date in merged if date not in snapshots]
+    generation = (meta['generation'] + 1) if meta else 1
+
+    result = None
+    if meta and changed and not removed and changed[0] > max(unchanged, default=''):
+        new_posts, channel_info = _read_snapshots(results_root, channel_name, snapshots, changed,
+                                                  meta.get('channel', {}))
+        # 讀取失敗（尚未寫完）的既有快照沿用原本合併的內容
+        replaced = {date for date in changed if date in merged and date in snapshots}
+        for date in changed:
+            if date not in snapshots and date in merged:
+                snapshots[date] = merged[date]
+        if snapshots == merged:
+            return meta
+        try:
+            result = _merge_newest(channel_timeline_dir, meta, generation, replaced, new_posts)
+        except _RebuildRequired:
+            result = None
+        del new_posts
+
+    if result is None:
+        posts, channel_info = _read_snapshots(results_root, channel_name, snapshots, list(snapshots), {})
+        ordered = sorted(posts.values(), key=_sort_key)
+        del posts
+        # 依合併後的訊息重新計算回覆數（根訊息可能與回覆位於不同快照）
+        result = _write_timeline(channel_timeline_dir, generation,
+                                 ((_sort_key(post), _encode_post(post)) for post in ordered),
+                                 _count_replies(ordered))
+        del ordered
+
+    total_posts, last_key = result
+    new_meta = {
+        'version': TIMELINE_VERSION,
+        'generation': generation,
+        'channel': channel_info,
+        'snapshots': snapshots,
+        'total_posts': total_posts,
+        'last_message_at': last_key[0] if last_key else None
+    }
+    tmp_path = _tmp_path(channel_timeline_dir / 'meta.json')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(new_meta, f, ensure_ascii=False)
+    os.replace(tmp_path, channel_timeline_dir / 'meta.json')
+
+    _remove_old_generations(channel_timeline_dir, {generation, generation - 1})
+    return new_meta
+
+
+def read_timeline_page(results_root, channel_name: str, meta: dict, offset: int, limit: int) -> list:
+    """讀取時間軸中 [offset, offset + limit) 的訊息（根訊息附上 reply_count）"""
+    channel_timeline_dir = timeline_dir(results_root, channel_name)
+    generation = meta['generation']
+    total = meta['total_posts']
+    start = max(0, min(offset, total))
+    end = max(start, min(start + limit, total))
+    if start == end:
+        return []
+
+    item_size = array(OFFSET_TYPECODE).itemsize
+    bounds = array(OFFSET_TYPECODE)
+    with open(channel_timeline_dir / f"offsets.{generation}.bin", 'rb') as f:
+        for index in (start, end):
+            f.seek(index * item_size)
+            bounds.fromfile(f, 1)
+
+    with open(channel_timeline_dir / f"posts.{generation}.jsonl", 'rb') as f:
+        f.seek(bounds[0])
+        chunk = f.read(bounds[1] - bounds[0])
+    reply_counts = _load_reply_counts(channel_timeline_dir, generation)
+    posts = [json.loads(line) for line in chunk.splitlines()]
+    for post in posts:
+        if post.get('id') in reply_counts:
+            post['reply_count'] = reply_counts[post['id']]
+    return posts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="建立跨快照合併的頻道時間軸")
+    parser.add_argument('results', help="results 資料夾")
+    parser.add_argument('channels', nargs='*', help="頻道名稱（預設為所有頻道）")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.results):
+        print(f"錯誤：找不到資料夾 {args.results}")
+        sys.exit(1)
+
+    for channel_name in args.channels or list_timeline_channels(args.results):
+        meta = update_timeline(args.results, channel_name)
+        if meta is None:
+            print(f"找不到頻道: {channel_name}")
+        else:
+            print(f"{channel_name}: {meta['total_posts']} 則訊息，{len(meta['snapshots'])} 個快照")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,15 +4,43 @@
 這個腳本會自動下載指定團隊中的所有頻道，無需手動選擇
 """
 
+import io
 import os
+import re
 import sys
 import json
+import time
+import shutil
+import fnmatch
+import random
+import hashlib
+import zipfile
+import mmap
+import mimetypes
 import pathlib
+import queue
+import atexit
+import asyncio
+import contextlib
 import getpass
+import argparse
 import logging
+import threading
+import logging.handlers
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, date, timezone
 from typing import Dict, Optional, Tuple
 from mattermostdriver import Driver, exceptions
+from code_fence import extract_code_blocks  # 與 EasyViewer 共用的程式碼區塊規則
+
+# 各頻道資料夾下存放索引檔案的目錄（EasyViewer 也使用此目錄存放快取）
+INDEX_DIRNAME = ".index"
+
+# 單一檔案層級的訊息（下載、跳過、重新命名）使用獨立的 logger，依 verbosity 設定決定是否顯示在控制台
+file_event_logger = logging.getLogger("auto_download.files")
+_log_listener = None
 
 
 def should_download_file(filename: str, config: Dict) -> Tuple[bool, str]:
@@ -30,6 +58,119 @@ def should_download_file(filename: str, config: Dict) -> Tuple[bool, str]:
     return True, "allowed"
 
 
+def file_sha256(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+class DownloadPolicy:
+    """
+    附件下載政策：在呼叫 API 下載前，依訊息 metadata 中的檔名、大小與 MIME 類型決定是否下載
+    - excluded_extensions：排除的副檔名
+    - max_file_size：單一檔案的大小上限（bytes）
+    - allowed_mime_types / denied_mime_types：允許與拒絕的 MIME 類型（可用 image/* 等萬用字元）
+    - channel_byte_budget / total_byte_budget：每個頻道與整次執行的下載位元組上限
+    - oversized_files：超過大小上限或預算的檔案 "skip"（預設）或 "metadata_only"（訊息中保留檔案資訊）
+    因大小上限、預算或下載失敗而未下載的附件記錄在 state 的 skipped_files，之後可用 backfill 子命令補下載，
+    不需重新掃描頻道；依副檔名或 MIME 類型刻意排除的附件不記錄
+    """
+    
+    DOWNLOAD = "download"
+    SKIP = "skip"
+    METADATA_ONLY = "metadata_only"
+    BACKFILL_REASONS = ("file_too_large", "channel_budget_exceeded", "total_budget_exceeded", "download_failed")
+    
+    def __init__(self, config: Dict = None, state: "IncrementalDownloadManager" = None):
+        config = config or {}
+        self.config = config
+        self.state = state
+        self.max_file_size = int(config.get("max_file_size") or 0)
+        self.allowed_mime_types = [pattern.lower() for pattern in config.get("allowed_mime_types") or []]
+        self.denied_mime_types = [pattern.lower() for pattern in config.get("denied_mime_types") or []]
+        self.channel_byte_budget = int(config.get("channel_byte_budget") or 0)
+        self.total_byte_budget = int(config.get("total_byte_budget") or 0)
+        self.oversized_action = (self.METADATA_ONLY if config.get("oversized_files") == self.METADATA_ONLY
+                                 else self.SKIP)
+        self.channel_bytes = {}  # 頻道 -> 已預留的位元組
+        self.total_bytes = 0
+        self._lock = threading.Lock()  # 多個頻道同時匯出時共用預算
+    
+    @staticmethod
+    def _matches(mime_type: str, patterns: list) -> bool:
+        return any(fnmatch.fnmatchcase(mime_type, pattern) for pattern in patterns)
+    
+    def evaluate(self, file: Dict, channel_key: str) -> Tuple[str, str]:
+        """回傳 (動作, 原因)；決定下載時即預留預算，下載失敗時以 release() 歸還"""
+        allowed, reason = should_download_file(file.get("name", ""), self.config)
+        if not allowed:
+            return self.SKIP, reason
+        
+        mime_type = (file.get("mime_type") or "").lower()
+        if mime_type and self._matches(mime_type, self.denied_mime_types):
+            return self.SKIP, f"mime_denied_{mime_type}"
+        if self.allowed_mime_types and not self._matches(mime_type, self.allowed_mime_types):
+            return self.SKIP, f"mime_not_allowed_{mime_type or 'unknown'}"
+        
+        size = file.get("size") or 0
+        if self.max_file_size and size > self.max_file_size:
+            return self.oversized_action, "file_too_large"
+        with self._lock:
+            channel_bytes = self.channel_bytes.get(channel_key, 0)
+            if self.channel_byte_budget and channel_bytes + size > self.channel_byte_budget:
+                return self.oversized_action, "channel_budget_exceeded"
+            if self.total_byte_budget and self.total_bytes + size > self.total_byte_budget:
+                return self.oversized_action, "total_budget_exceeded"
+            self.channel_bytes[channel_key] = channel_bytes + size
+            self.total_bytes += size
+        return self.DOWNLOAD, "allowed"
+    
+    def release(self, channel_key: str, size: int):
+        """歸還下載失敗的檔案所預留的預算"""
+        with self._lock:
+            self.channel_bytes[channel_key] = self.channel_bytes.get(channel_key, 0) - (size or 0)
+            self.total_bytes -= size or 0
+    
+    def record_skip(self, file: Dict, post: Dict, i_post: int, channel_dir, reason: str):
+        """記錄未下載的附件，backfill 時依此直接下載到原本的頻道資料夾（只記錄 BACKFILL_REASONS）"""
+        if self.state is None or not file.get("id") or reason not in self.BACKFILL_REASONS:
+            return
+        self.state.record_skipped_file(file["id"], {
+            "channel_id": post.get("channel_id", ""),
+            "channel_dir": str(channel_dir),
+            "post_id": post.get("id", ""),
+            "idx": i_post,
+            "name": file.get("name", ""),
+            "size": file.get("size", 0),
+            "mime_type": file.get("mime_type", ""),
+            "reason": reason
+        })
+    
+    def record_downloaded(self, file_id: str):
+        if self.state is not None:
+            self.state.clear_skipped_file(file_id)
+    
+    def describe(self) -> str:
+        """政策摘要（顯示在日誌中）"""
+        rules = []
+        if self.config.get("excluded_extensions"):
+            rules.append(f"排除 {', '.join(self.config['excluded_extensions'])} 檔案")
+        if self.max_file_size:
+            rules.append(f"單檔上限 {self.max_file_size / 1024 / 1024:.1f} MB")
+        if self.allowed_mime_types:
+            rules.append(f"只下載 {', '.join(self.allowed_mime_types)}")
+        if self.denied_mime_types:
+            rules.append(f"不下載 {', '.join(self.denied_mime_types)}")
+        if self.channel_byte_budget:
+            rules.append(f"每頻道上限 {self.channel_byte_budget / 1024 / 1024:.1f} MB")
+        if self.total_byte_budget:
+            rules.append(f"總量上限 {self.total_byte_budget / 1024 / 1024:.1f} MB")
+        if not rules:
+            return "下載所有檔案"
+        if self.oversized_action == self.METADATA_ONLY and (self.max_file_size or self.channel_byte_budget
+                                                            or self.total_byte_budget):
+            rules.append("超過上限的檔案只保留資訊")
+        return "，".join(rules)
+
+
 class IncrementalDownloadManager:
     """增量下載管理器"""
     
@@ -37,6 +178,8 @@ class IncrementalDownloadManager:
         self.output_base = output_base
         self.sync_state_file = os.path.join(output_base, 'sync_state.json')
         self.sync_state = self._load_sync_state()
+        # 多個頻道同時匯出時共用同一個管理器，狀態修改與存檔需互斥
+        self._lock = threading.RLock()
     
     def _load_sync_state(self) -> Dict:
         """載入同步狀態"""
@@ -55,7 +198,7 @@ class IncrementalDownloadManager:
             "created_at": datetime.now().isoformat(),
             "last_full_sync": None,
             "channels_last_sync": {},
-            "downloaded_files": {},  # file_id -> {"path": "", "hash": "", "timestamp": ""}
+            "downloaded_files": {},  # file_id -> {"path": "", "hash": "", "size": 0, "timestamp": ""}
             "sync_history": []
         }
     
@@ -74,35 +217,80 @@ class IncrementalDownloadManager:
     def update_channel_sync_time(self, channel_id: str, channel_name: str, 
                                 last_post_timestamp: str, last_post_id: str):
         """更新頻道的同步時間"""
-        if channel_id not in self.sync_state['channels_last_sync']:
-            self.sync_state['channels_last_sync'][channel_id] = {}
-        
-        self.sync_state['channels_last_sync'][channel_id].update({
-            "channel_name": channel_name,
-            "last_post_timestamp": last_post_timestamp,
-            "last_sync_time": datetime.now().isoformat(),
-            "last_post_id": last_post_id
-        })
-        self._save_sync_state()
+        with self._lock:
+            if channel_id not in self.sync_state['channels_last_sync']:
+                self.sync_state['channels_last_sync'][channel_id] = {}
+            
+            self.sync_state['channels_last_sync'][channel_id].update({
+                "channel_name": channel_name,
+                "last_post_timestamp": last_post_timestamp,
+                "last_sync_time": datetime.now().isoformat(),
+                "last_post_id": last_post_id
+            })
+            self._save_sync_state()
+    
+    def get_channel_export_stats(self, channel_id: str) -> Optional[Dict]:
+        """獲取頻道上次匯出的耗時與資料量（排程器用來估算成本）"""
+        channel_info = self.sync_state['channels_last_sync'].get(channel_id)
+        return channel_info.get('last_export') if channel_info else None
+    
+    def record_channel_export(self, channel_id: str, channel_name: str, seconds: float,
+                              posts: int, nbytes: int):
+        """記錄頻道本次匯出的耗時、訊息數與下載位元組數"""
+        with self._lock:
+            channel_info = self.sync_state['channels_last_sync'].setdefault(channel_id, {})
+            channel_info["channel_name"] = channel_name
+            channel_info["last_export"] = {
+                "seconds": round(seconds, 3),
+                "posts": posts,
+                "bytes": nbytes,
+                "finished_at": datetime.now().isoformat()
+            }
+            self._save_sync_state()
     
     def is_file_downloaded(self, file_id: str) -> bool:
         """檢查檔案是否已下載"""
         return file_id in self.sync_state['downloaded_files']
     
-    def mark_file_downloaded(self, file_id: str, file_path: str, file_hash: str = None):
-        """標記檔案為已下載"""
-        self.sync_state['downloaded_files'][file_id] = {
-            "path": file_path,
-            "hash": file_hash,
-            "timestamp": datetime.now().isoformat()
-        }
+    def mark_file_downloaded(self, file_id: str, file_path: str, file_hash: str = None, size: int = None,
+                             save: bool = True):
+        """標記檔案為已下載（hash 為 "sha256:<hex>"，verify 子命令用來檢查檔案是否完整）"""
+        with self._lock:
+            self.sync_state['downloaded_files'][file_id] = {
+                "path": file_path,
+                "hash": file_hash,
+                "size": size,
+                "timestamp": datetime.now().isoformat()
+            }
+            if save:
+                self._save_sync_state()
+    
+    def save(self):
+        """立即儲存同步狀態（累積的附件記錄與匯出歷史一併寫入）"""
         self._save_sync_state()
     
     def _save_sync_state(self):
         """儲存同步狀態"""
-        os.makedirs(os.path.dirname(self.sync_state_file), exist_ok=True)
-        with open(self.sync_state_file, 'w', encoding='utf-8') as f:
-            json.dump(self.sync_state, f, indent=2, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.sync_state_file), exist_ok=True)
+            with open(self.sync_state_file, 'w', encoding='utf-8') as f:
+                json.dump(self.sync_state, f, indent=2, ensure_ascii=False)
+    
+    def record_skipped_file(self, file_id: str, entry: Dict):
+        """記錄未下載的附件（下載政策或下載失敗）；與下一次狀態儲存一起寫入，不會每個檔案各寫一次"""
+        with self._lock:
+            self.sync_state.setdefault('skipped_files', {})[file_id] = dict(
+                entry, skipped_at=datetime.now().isoformat())
+    
+    def clear_skipped_file(self, file_id: str):
+        with self._lock:
+            self.sync_state.get('skipped_files', {}).pop(file_id, None)
+    
+    def get_skipped_files(self) -> Dict:
+        """待補下載的附件（舊版本記錄的副檔名、MIME 類型排除不算在內）"""
+        with self._lock:
+            return {file_id: entry for file_id, entry in self.sync_state.get('skipped_files', {}).items()
+                    if entry.get("reason") in DownloadPolicy.BACKFILL_REASONS}
     
     def has_sync_history(self) -> bool:
         """檢查是否有同步歷史"""
@@ -110,8 +298,638 @@ class IncrementalDownloadManager:
     
     def clear_sync_state(self):
         """清空同步狀態（用於完整重新同步）"""
-        self.sync_state = self._create_empty_sync_state()
-        self._save_sync_state()
+        with self._lock:
+            self.sync_state = self._create_empty_sync_state()
+            self._save_sync_state()
+
+
+class DownloadMetrics:
+    """下載效能指標：各 API 端點的請求數、延遲、位元組數、重試次數與各頻道耗時（執行緒安全）"""
+    
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    LATENCY_SAMPLE_SIZE = 4096  # 每個端點保留的延遲樣本數（reservoir sampling），百分位數由樣本估算
+    ID_PATTERN = re.compile(r'[a-z0-9]{26}')  # Mattermost 的 id 固定為 26 個字元
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.endpoints = {}  # 端點 -> 統計
+        self.channels = []  # 已完成頻道的耗時與資料量
+        self._current_channels = {}  # 執行緒 id -> 該執行緒正在匯出的頻道統計（可同時匯出多個頻道）
+        self.posts_processed = 0
+        self._random = random.Random()
+    
+    @classmethod
+    def endpoint_label(cls, method: str, endpoint: str) -> str:
+        """將 API 路徑中的 id 替換為 {id}，避免每個頻道/檔案產生不同的標籤"""
+        return f"{method.upper()} {cls.ID_PATTERN.sub('{id}', endpoint)}"
+    
+    def _endpoint(self, label: str) -> Dict:
+        stats = self.endpoints.get(label)
+        if stats is None:
+            stats = self.endpoints[label] = {
+                'requests': 0,
+                'errors': 0,
+                'retries': 0,
+                'bytes': 0,
+                'latency_sum': 0.0,
+                'latency_max': 0.0,
+                'latencies': [],  # 固定大小的隨機樣本，請求數再多記憶體用量也不變
+                'buckets': [0] * len(self.LATENCY_BUCKETS)
+            }
+        return stats
+    
+    def record_request(self, label: str, seconds: float, nbytes: int = 0, error: bool = False):
+        """記錄一次 API 請求"""
+        with self._lock:
+            stats = self._endpoint(label)
+            stats['requests'] += 1
+            stats['bytes'] += nbytes
+            stats['latency_sum'] += seconds
+            channel = self._current_channels.get(threading.get_ident())
+            if channel is not None:
+                channel['requests'] += 1
+                channel['bytes'] += nbytes
+            stats['latency_max'] = max(stats['latency_max'], seconds)
+            latencies = stats['latencies']
+            if len(latencies) < self.LATENCY_SAMPLE_SIZE:
+                latencies.append(seconds)
+            else:
+                slot = self._random.randrange(stats['requests'])
+                if slot < self.LATENCY_SAMPLE_SIZE:
+                    latencies[slot] = seconds
+            if error:
+                stats['errors'] += 1
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+    
+    def record_retry(self, label: str):
+        """記錄一次重試"""
+        with self._lock:
+            self._endpoint(label)['retries'] += 1
+    
+    def add_posts(self, count: int):
+        with self._lock:
+            self.posts_processed += count
+            channel = self._current_channels.get(threading.get_ident())
+            if channel is not None:
+                channel['posts'] += count
+    
+    def _totals(self) -> Tuple[int, int]:
+        return (sum(stats['requests'] for stats in self.endpoints.values()),
+                sum(stats['bytes'] for stats in self.endpoints.values()))
+    
+    def start_channel(self, channel_name: str):
+        """開始計算目前執行緒所匯出頻道的耗時；請求、位元組與訊息數依執行緒歸屬到該頻道"""
+        with self._lock:
+            self._current_channels[threading.get_ident()] = {
+                'channel': channel_name,
+                'started': time.time(),
+                'requests': 0,
+                'bytes': 0,
+                'posts': 0
+            }
+    
+    def finish_channel(self, success: bool = True, files_downloaded: int = 0) -> Optional[Dict]:
+        """結束目前執行緒所匯出頻道的計時並記錄資料量，回傳該頻道的統計"""
+        with self._lock:
+            channel = self._current_channels.pop(threading.get_ident(), None)
+            if channel is None:
+                return None
+            entry = {
+                'channel': channel['channel'],
+                'success': success,
+                'seconds': round(time.time() - channel['started'], 3),
+                'requests': channel['requests'],
+                'bytes': channel['bytes'],
+                'posts': channel['posts'],
+                'files_downloaded': files_downloaded
+            }
+            self.channels.append(entry)
+            return entry
+    
+    @staticmethod
+    def _percentile(sorted_values, fraction: float) -> float:
+        if not sorted_values:
+            return 0.0
+        return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+    
+    def prometheus_text(self) -> str:
+        """輸出 Prometheus 文字格式的指標"""
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            requests_total, bytes_total = self._totals()
+            lines = [
+                '# HELP mattermost_dl_requests_total API requests sent to the Mattermost server.',
+                '# TYPE mattermost_dl_requests_total counter'
+            ]
+            for label, stats in sorted(self.endpoints.items()):
+                lines.append(f'mattermost_dl_requests_total{{endpoint="{label}"}} {stats["requests"]}')
+            for name, key, help_text in (
+                    ('mattermost_dl_request_errors_total', 'errors', 'API requests that raised an error.'),
+                    ('mattermost_dl_retries_total', 'retries', 'Retried API requests.'),
+                    ('mattermost_dl_response_bytes_total', 'bytes', 'Response body bytes received.')):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for label, stats in sorted(self.endpoints.items()):
+                    lines.append(f'{name}{{endpoint="{label}"}} {stats[key]}')
+            
+            lines.append('# HELP mattermost_dl_request_duration_seconds API request latency.')
+            lines.append('# TYPE mattermost_dl_request_duration_seconds histogram')
+            for label, stats in sorted(self.endpoints.items()):
+                for bound, count in zip(self.LATENCY_BUCKETS, stats['buckets']):
+                    lines.append(f'mattermost_dl_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {count}')
+                lines.append(f'mattermost_dl_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {stats["requests"]}')
+                lines.append(f'mattermost_dl_request_duration_seconds_sum{{endpoint="{label}"}} {stats["latency_sum"]:.6f}')
+                lines.append(f'mattermost_dl_request_duration_seconds_count{{endpoint="{label}"}} {stats["requests"]}')
+            
+            lines.extend([
+                '# HELP mattermost_dl_posts_processed_total Posts processed.',
+                '# TYPE mattermost_dl_posts_processed_total counter',
+                f'mattermost_dl_posts_processed_total {self.posts_processed}',
+                '# HELP mattermost_dl_channels_completed_total Channels finished (successfully or not).',
+                '# TYPE mattermost_dl_channels_completed_total counter',
+                f'mattermost_dl_channels_completed_total {len(self.channels)}',
+                '# HELP mattermost_dl_requests_per_second Average request rate since start.',
+                '# TYPE mattermost_dl_requests_per_second gauge',
+                f'mattermost_dl_requests_per_second {requests_total / elapsed:.3f}',
+                '# HELP mattermost_dl_bytes_per_second Average download rate since start.',
+                '# TYPE mattermost_dl_bytes_per_second gauge',
+                f'mattermost_dl_bytes_per_second {bytes_total / elapsed:.1f}',
+                '# HELP mattermost_dl_channel_duration_seconds Time spent exporting each channel.',
+                '# TYPE mattermost_dl_channel_duration_seconds gauge'
+            ])
+            for channel in self.channels:
+                name = channel['channel'].replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'mattermost_dl_channel_duration_seconds{{channel="{name}"}} {channel["seconds"]}')
+        return '\n'.join(lines) + '\n'
+    
+    def report(self) -> Dict:
+        """產生本次執行的統計報告（可序列化為 JSON）"""
+        with self._lock:
+            finished_at = time.time()
+            elapsed = max(finished_at - self.started_at, 1e-9)
+            requests_total, bytes_total = self._totals()
+            endpoints = {}
+            for label, stats in sorted(self.endpoints.items()):
+                latencies = sorted(stats['latencies'])
+                endpoints[label] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'bytes': stats['bytes'],
+                    'latency_mean': round(stats['latency_sum'] / stats['requests'], 4) if stats['requests'] else 0.0,
+                    'latency_p50': round(self._percentile(latencies, 0.50), 4),
+                    'latency_p90': round(self._percentile(latencies, 0.90), 4),
+                    'latency_p99': round(self._percentile(latencies, 0.99), 4),
+                    'latency_max': round(stats['latency_max'], 4)
+                }
+            return {
+                'started_at': datetime.fromtimestamp(self.started_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'finished_at': datetime.fromtimestamp(finished_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'elapsed_seconds': round(elapsed, 3),
+                'requests': requests_total,
+                'bytes': bytes_total,
+                'posts_processed': self.posts_processed,
+                'requests_per_second': round(requests_total / elapsed, 3),
+                'bytes_per_second': round(bytes_total / elapsed, 1),
+                'errors': sum(stats['errors'] for stats in self.endpoints.values()),
+                'retries': sum(stats['retries'] for stats in self.endpoints.values()),
+                'endpoints': endpoints,
+                'channels': list(self.channels)
+            }
+    
+    def write_report(self, report_path: str) -> Dict:
+        """將統計報告寫入 JSON 檔案"""
+        report = self.report()
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return report
+
+
+def instrument_driver(d: Driver, metrics: DownloadMetrics):
+    """包裝 Driver 的 HTTP 請求，記錄每個請求的延遲、回應大小與錯誤"""
+    make_request = d.client.make_request
+    
+    def timed_make_request(method, endpoint, *args, **kwargs):
+        label = metrics.endpoint_label(method, endpoint)
+        start = time.perf_counter()
+        try:
+            response = make_request(method, endpoint, *args, **kwargs)
+        except Exception:
+            metrics.record_request(label, time.perf_counter() - start, error=True)
+            raise
+        metrics.record_request(label, time.perf_counter() - start, len(response.content or b''))
+        return response
+    
+    d.client.make_request = timed_make_request
+
+
+def start_metrics_server(metrics: DownloadMetrics, port: int, host: str = "127.0.0.1"):
+    """在背景執行緒提供 Prometheus 格式的 /metrics 端點"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass  # 不要讓抓取請求干擾下載進度輸出
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server
+
+
+class _ProgressStream:
+    """包裝 stdout：輸出其他訊息前先清除進度列，讓進度列固定顯示在最下方"""
+    
+    def __init__(self, tracker, stream):
+        self._tracker = tracker
+        self._stream = stream
+    
+    def write(self, text):
+        with self._tracker._lock:
+            self._tracker._clear_line()
+            return self._stream.write(text)
+    
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class ProgressTracker:
+    """下載進度：依頻道的 total_msg_count 與附件大小顯示各頻道與整體進度、速率與預估剩餘時間
+    
+    更新只累加計數器，畫面依 interval 限制重繪頻率；輸出不是終端機時改為定期輸出一行進度。
+    多個頻道同時匯出時，各執行緒的頻道進度分開累計，頻道欄位顯示所有進行中頻道的合計。
+    有 plan 子命令的估算結果時，改用估算的訊息數，並依預計下載的位元組數估算剩餘時間。
+    """
+    
+    BAR_WIDTH = 20
+    
+    def __init__(self, channels, interval: float = 0.5, stream=None, plan: Dict = None):
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty()
+        # 輸出重新導向到檔案時，每 10 秒輸出一行即可
+        self.interval = interval if self.interactive else max(interval, 10.0)
+        self.total_channels = len(channels)
+        planned = [plan['channels'][channel['id']] for channel in channels
+                   if plan and channel.get('id') in plan.get('channels', {})]
+        self._planned_posts = {entry['id']: entry['scan_posts'] for entry in planned}
+        self.planned_files = sum(entry['download_files'] for entry in planned)
+        self.planned_bytes = sum(entry['download_bytes'] for entry in planned)
+        self.total_posts = sum(self._channel_total(channel) for channel in channels)
+        self.started = time.monotonic()
+        self.completed_channels = 0
+        self.completed_posts = 0
+        self.channel_name = ''
+        self._active = {}  # 執行緒 id -> [頻道名稱, total_msg_count, 已處理訊息數]
+        self.files_seen = 0
+        self.files_done = 0
+        self.bytes_seen = 0
+        self.bytes_done = 0
+        self._last_render = 0.0
+        self._line_visible = False
+        self._lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._wrapped_handlers = []
+        self._original_stdout = None
+    
+    def install(self):
+        """接管 stdout 與 console logging handler，讓其他輸出不會與進度列混在同一行"""
+        if not self.interactive:
+            return self
+        self._original_stdout = sys.stdout
+        wrapper = _ProgressStream(self, sys.stdout)
+        sys.stdout = wrapper
+        handlers = logging.getLogger().handlers
+        for handler in handlers:
+            if type(handler) is logging.StreamHandler and handler.stream is self._original_stdout:
+                handler.setStream(wrapper)
+                self._wrapped_handlers.append(handler)
+        return self
+    
+    def close(self):
+        """輸出最終進度並還原 stdout"""
+        self._render(time.monotonic())
+        with self._lock:
+            if self._line_visible:
+                self.stream.write('\n')
+                self._line_visible = False
+        if self._original_stdout is not None:
+            for handler in self._wrapped_handlers:
+                handler.setStream(self._original_stdout)
+            sys.stdout = self._original_stdout
+            self._original_stdout = None
+    
+    def _channel_total(self, channel: Dict) -> int:
+        return self._planned_posts.get(channel.get('id'), channel.get('total_msg_count') or 0)
+    
+    def start_channel(self, channel: Dict):
+        with self._counter_lock:
+            self.channel_name = channel.get('display_name', '')
+            self._active[threading.get_ident()] = [self.channel_name, self._channel_total(channel), 0]
+        self._maybe_render()
+    
+    def finish_channel(self):
+        with self._counter_lock:
+            self.completed_channels += 1
+            state = self._active.pop(threading.get_ident(), None)
+            if state is not None:
+                # 以實際處理的訊息數為準（total_msg_count 可能包含已刪除或系統訊息）
+                self.completed_posts += state[2]
+                self.total_posts += state[2] - state[1]
+        self._maybe_render()
+    
+    def advance_posts(self, count: int):
+        with self._counter_lock:
+            state = self._active.get(threading.get_ident())
+            if state is not None:
+                state[2] += count
+        self._maybe_render()
+    
+    def add_file(self, size: int):
+        """遇到附件（大小取自訊息的 metadata）"""
+        with self._counter_lock:
+            self.files_seen += 1
+            self.bytes_seen += size or 0
+    
+    def file_done(self, size: int):
+        with self._counter_lock:
+            self.files_done += 1
+            self.bytes_done += size or 0
+        self._maybe_render()
+    
+    def _maybe_render(self):
+        now = time.monotonic()
+        # 進度列被其他輸出清除時立即重繪，否則依 interval 限制頻率
+        if now - self._last_render >= self.interval or (self.interactive and not self._line_visible):
+            self._render(now)
+    
+    def _clear_line(self):
+        if self._line_visible:
+            self.stream.write('\r\x1b[K')
+            self._line_visible = False
+    
+    @classmethod
+    def _bar(cls, fraction: float) -> str:
+        filled = int(cls.BAR_WIDTH * min(max(fraction, 0.0), 1.0))
+        return '█' * filled + '░' * (cls.BAR_WIDTH - filled)
+    
+    @staticmethod
+    def _format_duration(seconds: float) -> str:
+        seconds = int(seconds)
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    
+    def _status_line(self, now: float) -> str:
+        elapsed = max(now - self.started, 1e-9)
+        with self._counter_lock:
+            active = [list(state) for state in self._active.values()]
+        channel_posts = sum(state[2] for state in active)
+        channel_total = sum(state[1] for state in active)
+        posts_done = self.completed_posts + channel_posts
+        posts_rate = posts_done / elapsed
+        total_posts = max(self.total_posts, posts_done)
+        overall = posts_done / total_posts if total_posts else 0.0
+        if self.completed_channels >= self.total_channels:
+            channel = 1.0
+        else:
+            channel = min(channel_posts / channel_total, 1.0) if channel_total else 0.0
+        if len(active) > 1:
+            channel_name = f"{len(active)} 個頻道進行中"
+        else:
+            channel_name = active[0][0] if active else self.channel_name
+        remaining = []
+        if posts_rate > 0 and total_posts > posts_done:
+            remaining.append((total_posts - posts_done) / posts_rate)
+        # 有估算的下載量時，附件集中在後段的頻道也不會低估剩餘時間
+        if self.planned_bytes > self.bytes_done and self.bytes_done > 0:
+            remaining.append((self.planned_bytes - self.bytes_done) / (self.bytes_done / elapsed))
+        eta = self._format_duration(max(remaining)) if remaining else '--:--:--'
+        files_total = max(self.files_seen, self.planned_files)
+        return (f"[{min(self.completed_channels + max(len(active), 1), self.total_channels)}/{self.total_channels}] "
+                f"{channel_name[:20]} {self._bar(channel)} {channel:4.0%} | "
+                f"總計 {self._bar(overall)} {overall:4.0%} {posts_done}/{total_posts} | "
+                f"檔案 {self.files_done}/{files_total} {self.bytes_done / 1024 / 1024:.1f}MB | "
+                f"{posts_rate:.0f} 則/秒 {self.bytes_done / elapsed / 1024 / 1024:.2f} MB/秒 | "
+                f"ETA {eta}")
+    
+    def _render(self, now: float):
+        with self._lock:
+            self._last_render = now
+            line = self._status_line(now)
+            if self.interactive:
+                self.stream.write('\r\x1b[K' + line)
+                self._line_visible = True
+            else:
+                self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class _ProfileSection:
+    """計時區段：記錄自身耗時（扣除巢狀子區段）到目前的呼叫路徑"""
+    
+    __slots__ = ('state', 'name', 'started')
+    
+    def __init__(self, state, name: str):
+        self.state = state
+        self.name = name
+    
+    def __enter__(self):
+        self.state['stack'].append(self.name)
+        self.state['child_time'].append(0.0)
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        state = self.state
+        path = ';'.join(state['stack'])
+        self_time = elapsed - state['child_time'].pop()
+        state['self_time'][path] = state['self_time'].get(path, 0.0) + self_time
+        totals = state['sections'].setdefault(self.name, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] += self_time
+        state['stack'].pop()
+        if state['child_time']:
+            state['child_time'][-1] += elapsed
+        return False
+
+
+class _StackSampler(threading.Thread):
+    """取樣式分析：定期讀取正在匯出頻道的執行緒的呼叫堆疊，累計為 folded stack"""
+    
+    def __init__(self, profiler, interval: float):
+        super().__init__(name="export-profiler-sampler", daemon=True)
+        self.profiler = profiler
+        self.interval = interval
+        self._stop_event = threading.Event()
+    
+    @staticmethod
+    def _fold(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+    
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, state in self.profiler.active_states():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = self._fold(frame)
+                    state['samples'][stack] = state['samples'].get(stack, 0) + 1
+    
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=1)
+
+
+class ExportProfiler:
+    """
+    匯出流程的效能分析（config "profile" 或環境變數 MM_PROFILE 啟用）
+    - timers：以低成本計時器記錄各區段（API 請求、JSON 序列化、檔案寫入、檔名衝突檢查、日誌）的耗時
+    - cprofile：另外以 cProfile 分析每個頻道，輸出 .prof（可用 snakeviz、flameprof 檢視）
+    - sample：另外以取樣方式記錄呼叫堆疊，輸出 folded stack（可用 flamegraph.pl、speedscope 檢視）
+    每個頻道輸出一組檔案到 logs/profile_<時間>/，結束時寫入 summary.json
+    """
+    
+    MODES = ("timers", "cprofile", "sample")
+    
+    def __init__(self, output_dir: str, mode: str = "timers", sample_interval: float = 0.005):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profile mode: {mode} (expected one of {', '.join(self.MODES)})")
+        self.output_dir = pathlib.Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.summary = {}
+        self._local = threading.local()
+        self._states = {}  # thread id -> 正在匯出的頻道狀態（取樣執行緒讀取）
+        self._lock = threading.Lock()
+        self._sampler = None
+        if mode == "sample":
+            self._sampler = _StackSampler(self, sample_interval)
+            self._sampler.start()
+    
+    @classmethod
+    def from_config(cls, config: Dict, log_dir: str):
+        """依 config 的 profile/profile_interval_ms 或環境變數 MM_PROFILE 建立，未啟用時回傳 None"""
+        setting = os.environ.get("MM_PROFILE", config.get("profile", False))
+        if setting in (False, None, "", "0", "false", "off"):
+            return None
+        mode = "timers" if setting in (True, "1", "true", "on") else str(setting)
+        interval = float(config.get("profile_interval_ms", 5)) / 1000
+        output_dir = os.path.join(log_dir, datetime.now().strftime("profile_%Y%m%d_%H%M%S"))
+        return cls(output_dir, mode, interval)
+    
+    def active_states(self):
+        with self._lock:
+            return list(self._states.items())
+    
+    def section(self, name: str):
+        """區段計時；目前執行緒沒有正在分析的頻道時不記錄"""
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            return _NULL_SECTION
+        return _ProfileSection(state, name)
+    
+    def instrument_logger(self, target_logger: logging.Logger):
+        """將 logger 處理記錄的時間計入 logging 區段"""
+        original_handle = target_logger.handle
+        
+        def timed_handle(record):
+            with self.section("logging"):
+                return original_handle(record)
+        
+        target_logger.handle = timed_handle
+    
+    def start_channel(self, channel_name: str):
+        state = {
+            'channel': channel_name,
+            'stack': [],
+            'child_time': [],
+            'self_time': {},
+            'sections': {},
+            'samples': {},
+            'cprofile': None,
+            'started': time.perf_counter()
+        }
+        if self.mode == "cprofile":
+            import cProfile
+            state['cprofile'] = cProfile.Profile()
+            state['cprofile'].enable()
+        self._local.state = state
+        with self._lock:
+            self._states[threading.get_ident()] = state
+    
+    def finish_channel(self):
+        """結束目前頻道的分析並輸出檔案"""
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            return
+        if state['cprofile'] is not None:
+            state['cprofile'].disable()
+        elapsed = time.perf_counter() - state['started']
+        self._local.state = None
+        with self._lock:
+            self._states.pop(threading.get_ident(), None)
+        
+        stem = ''.join(ch if ch not in "?!/\\.;:*\"<>| " else "_" for ch in state['channel']) or "channel"
+        # flamegraph.pl 的 folded 格式：呼叫路徑以分號連接，數值為自身耗時（微秒）
+        with open(self.output_dir / f"{stem}.timers.folded", "w", encoding="utf-8") as f:
+            for path, seconds in sorted(state['self_time'].items()):
+                f.write(f"{path} {max(0, int(seconds * 1_000_000))}\n")
+        if state['cprofile'] is not None:
+            state['cprofile'].dump_stats(str(self.output_dir / f"{stem}.prof"))
+        if state['samples']:
+            with open(self.output_dir / f"{stem}.samples.folded", "w", encoding="utf-8") as f:
+                for stack, count in sorted(state['samples'].items()):
+                    f.write(f"{stack} {count}\n")
+        
+        self.summary[state['channel']] = {
+            'elapsed_seconds': round(elapsed, 4),
+            'sections': {name: {'calls': calls, 'total_seconds': round(total, 4), 'self_seconds': round(own, 4)}
+                         for name, (calls, total, own) in sorted(state['sections'].items(),
+                                                                 key=lambda item: -item[1][2])}
+        }
+    
+    def totals(self) -> Dict[str, float]:
+        """所有頻道各區段的自身耗時合計（秒，由大到小）"""
+        totals = {}
+        for channel in self.summary.values():
+            for name, stats in channel['sections'].items():
+                totals[name] = totals.get(name, 0.0) + stats['self_seconds']
+        return dict(sorted(totals.items(), key=lambda item: -item[1]))
+    
+    def close(self) -> str:
+        """停止取樣並寫入 summary.json，回傳輸出目錄"""
+        if self._sampler:
+            self._sampler.stop()
+        with open(self.output_dir / "summary.json", "w", encoding="utf-8") as f:
+            json.dump({'mode': self.mode, 'totals': self.totals(), 'channels': self.summary},
+                      f, indent=2, ensure_ascii=False)
+        return str(self.output_dir)
+
+
+_NULL_SECTION = contextlib.nullcontext()
+
+
+def profile_section(profiler: Optional[ExportProfiler], name: str):
+    """未啟用效能分析時回傳不做任何事的 context manager"""
+    return profiler.section(name) if profiler else _NULL_SECTION
 
 
 def find_mmauthtoken_firefox(host):
@@ -274,7 +1092,8 @@ def complete_config(config: dict, config_filename: str = "config.json") -> dict:
     return config
 
 
-def connect(host: str, port: int, token: str = None, username: str = None, password: str = None) -> Driver:
+def connect(host: str, port: int, token: str = None, username: str = None, password: str = None,
+            scheme: str = 'https') -> Driver:
     """連接到 Mattermost 伺服器"""
     d = Driver({
         'url': host,
@@ -282,7 +1101,7 @@ def connect(host: str, port: int, token: str = None, username: str = None, passw
         'token': token,
         'login_id': username,
         'password': password,
-        'scheme': 'https'
+        'scheme': scheme
     })
     d.login()
     return d
@@ -314,8 +1133,582 @@ def select_team(d: Driver, my_user_id: str):
     return team
 
 
+class ChannelPack:
+    """
+    頻道的小檔案封裝檔
+    小於 max_size 的附件與程式碼區塊依序附加到 .index/pack.bin，
+    並在 .index/pack_index.json 記錄檔名對應的 [offset, size, sha256]，避免頻道資料夾累積大量小檔案。
+    EasyViewer 找不到實體檔案時會依此索引直接從封裝檔讀取。
+    同名項目重新寫入時舊資料留在封裝檔中，孤立的資料超過 COMPACT_MIN_BYTES 且佔封裝檔 COMPACT_RATIO 以上時，
+    save() 會只保留索引中的項目重寫為新的封裝檔（pack.<n>.bin，索引的 "pack" 記錄目前的檔名）；
+    verify --repair 也會整理所有封裝檔。
+    """
+    
+    PACK_NAME = "pack.bin"
+    INDEX_NAME = "pack_index.json"
+    INDEX_VERSION = 1
+    DEFAULT_MAX_SIZE = 64 * 1024
+    COMPACT_MIN_BYTES = 1024 * 1024
+    COMPACT_RATIO = 0.5
+    
+    def __init__(self, directory: pathlib.Path, max_size: int = DEFAULT_MAX_SIZE):
+        self.index_dir = pathlib.Path(directory) / INDEX_DIRNAME
+        self.pack_path = self.index_dir / self.PACK_NAME
+        self.index_path = self.index_dir / self.INDEX_NAME
+        self.max_size = max_size
+        self.entries = {}
+        self._file = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            with open(self.index_path, "r", encoding="utf8") as f:
+                data = json.load(f)
+            if data.get("version") == self.INDEX_VERSION:
+                self.entries = data.get("entries", {})
+                pack_name = data.get("pack", self.PACK_NAME)
+                if os.path.basename(pack_name) == pack_name and pack_name.startswith("pack"):
+                    self.pack_path = self.index_dir / pack_name
+        except (OSError, ValueError):
+            pass
+        # 上次中斷時可能留下索引未記錄的資料，新資料一律附加在檔案結尾
+        try:
+            self.size = self.pack_path.stat().st_size
+        except OSError:
+            self.size = 0
+    
+    @classmethod
+    def from_config(cls, config: Dict, directory: pathlib.Path) -> Optional["ChannelPack"]:
+        """config 設定 pack_small_files 時建立封裝檔，否則回傳 None"""
+        if not (config or {}).get("pack_small_files", False):
+            return None
+        return cls(directory, int(config.get("pack_max_file_size", cls.DEFAULT_MAX_SIZE)))
+    
+    def put(self, name: str, data: bytes):
+        """附加資料並記錄位置；同名項目重新寫入時索引指向新的資料"""
+        digest = file_sha256(data)
+        with self._lock:
+            if self._file is None:
+                self.index_dir.mkdir(exist_ok=True)
+                self._file = open(self.pack_path, "ab")
+            self._file.write(data)
+            self.entries[name] = [self.size, len(data), digest]
+            self.size += len(data)
+            self._dirty = True
+    
+    def matches(self, name: str, data: bytes) -> bool:
+        """封裝檔中已有相同內容的 name（比對大小與索引記錄的 sha256）"""
+        with self._lock:
+            entry = self.entries.get(name)
+        return (entry is not None and entry[1] == len(data) and len(entry) > 2
+                and entry[2] == file_sha256(data))
+    
+    def discard(self, name: str):
+        with self._lock:
+            if self.entries.pop(name, None) is not None:
+                self._dirty = True
+    
+    def orphaned_bytes(self) -> int:
+        """封裝檔中不再被索引引用的位元組數"""
+        with self._lock:
+            return self.size - sum(entry[1] for entry in self.entries.values())
+    
+    def save(self):
+        """先將資料寫入封裝檔，再以原子方式更新索引，索引不會指向尚未寫入的資料"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._close_file()
+            self._write_index()
+        orphaned = self.orphaned_bytes()
+        if orphaned >= self.COMPACT_MIN_BYTES and orphaned >= self.size * self.COMPACT_RATIO:
+            self.compact()
+    
+    def compact(self) -> int:
+        """只保留索引中的項目重寫封裝檔，回傳回收的位元組數
+
+        新的封裝檔使用新的檔名，索引更新後才生效；前一個封裝檔保留到下次整理，
+        讀取舊索引的 EasyViewer 請求仍可完成。
+        """
+        with self._lock:
+            self._close_file()
+            reclaimed = self.size - sum(entry[1] for entry in self.entries.values())
+            if reclaimed <= 0 or not self.pack_path.exists():
+                return 0
+            stem = self.pack_path.name.split(".")
+            generation = int(stem[1]) + 1 if len(stem) == 3 and stem[1].isdigit() else 1
+            new_path = self.index_dir / f"pack.{generation}.bin"
+            tmp_path = new_path.with_name(new_path.name + ".tmp")
+            entries = {}
+            position = 0
+            with open(self.pack_path, "rb") as src, open(tmp_path, "wb") as dst:
+                for name, entry in sorted(self.entries.items(), key=lambda item: item[1][0]):
+                    src.seek(entry[0])
+                    data = src.read(entry[1])
+                    if len(data) != entry[1]:
+                        continue  # 資料不完整的項目交由 verify 回報為遺失
+                    dst.write(data)
+                    entries[name] = [position] + entry[1:]
+                    position += len(data)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, new_path)
+            previous = self.pack_path
+            self.pack_path = new_path
+            self.entries = entries
+            self.size = position
+            self._write_index()
+            for path in self.index_dir.glob("pack*.bin"):
+                if path not in (new_path, previous):
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+            return reclaimed
+    
+    def _close_file(self):
+        if self._file is not None:
+            # 關閉後下次寫入再開啟，匯入大量頻道時不會累積開啟的檔案
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+    
+    def _write_index(self):
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"version": self.INDEX_VERSION, "pack": self.pack_path.name, "entries": self.entries}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+
+class ChannelFolderRegistry:
+    """
+    頻道資料夾名稱的集中配置（頻道 id -> 資料夾名稱）
+    顯示名稱相同或清理後相同（例如 "a/b" 與 "ab"，或只有大小寫不同）的頻道會得到不同的資料夾：
+    第一個使用原名稱，其餘加上 _(n) 後綴。建立時傳入的頻道依 id 排序配置，同一組頻道每次執行結果相同；
+    平行匯出前先配置完成，各 worker 不會寫入同一個資料夾。
+    """
+    
+    def __init__(self, channels: list = ()):
+        self._folders = {}
+        self._used = set()
+        self._lock = threading.Lock()
+        for channel in sorted(channels, key=lambda c: c["id"]):
+            self.folder(channel)
+    
+    def reserve(self, key, display_name: str) -> str:
+        """取得 key 的資料夾名稱，第一次呼叫時配置"""
+        with self._lock:
+            name = self._folders.get(key)
+            if name is None:
+                base = display_name.replace("\\", "").replace("/", "")
+                name = base
+                counter = 1
+                while name.casefold() in self._used:
+                    name = f"{base}_({counter})"
+                    counter += 1
+                self._used.add(name.casefold())
+                self._folders[key] = name
+            return name
+    
+    def folder(self, channel: Dict) -> str:
+        return self.reserve(channel["id"], channel["display_name"])
+
+
+class ChannelFileNamer:
+    """
+    頻道資料夾的檔名配置
+    以單次 scandir 建立已存在檔名的集合，之後的衝突檢查只查詢集合，不需要逐一 stat；
+    並在 .index/files.json 記錄附件 id（或程式碼區塊的訊息 id）對應的檔名，
+    重新匯出到同一個資料夾時直接沿用已儲存的檔案，不會重複下載或產生 _(n) 副本。
+    提供 pack 時，小檔案寫入封裝檔，封裝檔中的檔名與實體檔案共用同一個命名空間。
+    """
+    
+    MANIFEST_NAME = "files.json"
+    MANIFEST_VERSION = 1
+    
+    def __init__(self, directory: pathlib.Path, pack: ChannelPack = None):
+        self.directory = pathlib.Path(directory)
+        with os.scandir(self.directory) as entries:
+            self.loose_names = {entry.name for entry in entries}
+        self.pack = pack
+        self.names = set(self.loose_names)
+        if pack is not None:
+            self.names.update(pack.entries)
+        self.manifest_path = self.directory / INDEX_DIRNAME / self.MANIFEST_NAME
+        self.manifest = {}
+        self._dirty = False
+        self._lock = threading.Lock()  # tail 模式的附件下載執行緒也會使用
+        try:
+            with open(self.manifest_path, "r", encoding="utf8") as f:
+                data = json.load(f)
+            if data.get("version") == self.MANIFEST_VERSION:
+                self.manifest = data.get("files", {})
+        except (OSError, ValueError):
+            pass
+    
+    def existing(self, key: str, prefix: str) -> Optional[str]:
+        """之前已儲存且仍存在的檔名（需有相同的 NNN_ 前綴，EasyViewer 依前綴對應訊息）"""
+        with self._lock:
+            name = self.manifest.get(key)
+            if name and name in self.names and name.startswith(prefix):
+                return name
+            return None
+    
+    def allocate(self, stem: str, suffix: str = "") -> str:
+        """配置未被使用的檔名：<stem><suffix>，已存在時依序嘗試 <stem>_(n)<suffix>"""
+        with self._lock:
+            name = stem + suffix
+            counter = 1
+            while name in self.names:
+                name = f"{stem}_({counter}){suffix}"
+                counter += 1
+            self.names.add(name)
+            return name
+    
+    def record(self, key: str, name: str):
+        """記錄 key 對應的檔名，save() 時寫入 manifest"""
+        with self._lock:
+            if self.manifest.get(key) != name:
+                self.manifest[key] = name
+                self._dirty = True
+    
+    def _use_pack(self, name: str, size: int) -> bool:
+        # 已經是實體檔案的名稱繼續寫入實體檔案，EasyViewer 優先傳送實體檔案
+        return self.pack is not None and size <= self.pack.max_size and name not in self.loose_names
+    
+    def unchanged(self, name: str, data: bytes) -> bool:
+        """name 已儲存相同的內容（重新匯出時不需再寫入）"""
+        if self.pack is not None and name not in self.loose_names:
+            return self.pack.matches(name, data)
+        path = self.directory / name
+        try:
+            if path.stat().st_size != len(data):
+                return False
+            with open(path, "rb") as f:
+                return f.read() == data
+        except OSError:
+            return False
+    
+    def write(self, name: str, data: bytes):
+        """寫入檔案內容：小檔案寫入封裝檔，其餘寫成頻道資料夾中的檔案"""
+        if self._use_pack(name, len(data)):
+            self.pack.put(name, data)
+            return
+        with open(self.directory / name, "wb") as f:
+            f.write(data)
+        self._mark_loose(name)
+    
+    def write_stream(self, name: str, source):
+        """由檔案物件寫入；只讀取封裝上限內的內容判斷是否為小檔案"""
+        if self.pack is not None and name not in self.loose_names:
+            head = source.read(self.pack.max_size + 1)
+            if len(head) <= self.pack.max_size:
+                self.pack.put(name, head)
+                return
+        else:
+            head = b""
+        with open(self.directory / name, "wb") as f:
+            f.write(head)
+            shutil.copyfileobj(source, f, 1024 * 1024)
+        self._mark_loose(name)
+    
+    def _mark_loose(self, name: str):
+        with self._lock:
+            self.loose_names.add(name)
+        if self.pack is not None:
+            self.pack.discard(name)
+    
+    def save(self):
+        if self.pack is not None:
+            self.pack.save()
+        with self._lock:
+            if not self._dirty:
+                return
+            self.manifest_path.parent.mkdir(exist_ok=True)
+            tmp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump({"version": self.MANIFEST_VERSION, "files": self.manifest}, f,
+                          ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.manifest_path)
+            self._dirty = False
+
+
+# fenced code block：行首（最多 3 個空白）的 ``` 或 ~~~ 開始，後接語言標示；
+# 以相同的圍欄結束，圍欄緊接在最後一行結尾或沒有結束圍欄時延伸到訊息結尾
+# （EasyViewer 的 index.html 使用相同的規則）
+class ChannelCodeIndex:
+    """
+    頻道 JSON 對應的程式碼區塊索引 .index/<JSON 檔名>.code.jsonl
+    每行為一則訊息的所有區塊 {"id", "idx", "blocks": [{"lang", "code"}]}，同一則訊息以最後一行為準
+    （tail 模式編輯或刪除訊息時追加新的一行）。新增的區塊暫存在記憶體，累積 FLUSH_RECORDS 筆或 FLUSH_BYTES
+    位元組時，或 flush() 時一次附加寫入，大型頻道的記憶體用量不會隨區塊數增加。
+    """
+    
+    FLUSH_RECORDS = 1000
+    FLUSH_BYTES = 1024 * 1024
+    
+    def __init__(self, directory: pathlib.Path, json_filename: str, append: bool = False):
+        self.path = pathlib.Path(directory) / INDEX_DIRNAME / (pathlib.Path(json_filename).stem + ".code.jsonl")
+        self._pending = []
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(exist_ok=True)
+        if not append or not self.path.exists():
+            open(self.path, "w", encoding="utf8").close()
+    
+    def add(self, post_id: str, idx: Optional[int], blocks: list):
+        line = json.dumps({"id": post_id, "idx": idx, "blocks": blocks}, ensure_ascii=False)
+        with self._lock:
+            self._pending.append(line)
+            self._pending_bytes += len(line)
+            if len(self._pending) >= self.FLUSH_RECORDS or self._pending_bytes >= self.FLUSH_BYTES:
+                self._write_pending()
+    
+    def remove(self, post_id: str):
+        """訊息被刪除或編輯時清除先前的區塊（編輯後的區塊由之後的 add 寫入）"""
+        self.add(post_id, None, [])
+    
+    def flush(self, touch: bool = False):
+        """附加寫入暫存的區塊；touch 時一併更新修改時間
+        （EasyViewer 以索引不早於頻道 JSON 判斷索引是否完整）"""
+        with self._lock:
+            if self._pending:
+                self._write_pending()
+            elif touch:
+                os.utime(self.path)
+    
+    def _write_pending(self):
+        with open(self.path, "a", encoding="utf8") as f:
+            f.write("\n".join(self._pending) + "\n")
+        self._pending = []
+        self._pending_bytes = 0
+
+
+def attachment_type(filename: str) -> str:
+    """統計用的附件類型：小寫副檔名，沒有副檔名時為 other（與 EasyViewer 相同）"""
+    name_parts = filename.rsplit('.', 1)
+    return name_parts[1].lower() if len(name_parts) == 2 and name_parts[1] else "other"
+
+
+class ChannelRollup:
+    """
+    頻道 JSON 對應的統計彙總 .index/<JSON 檔名>.stats.json
+    依日期（UTC）記錄訊息數、各使用者的訊息數、有回覆的討論串數與各類型附件的數量與大小（取自訊息 metadata），
+    匯出時逐則累加，頻道完成後寫入；EasyViewer 直接讀取，不需解析整個頻道 JSON
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, directory: pathlib.Path, json_filename: str):
+        self.path = pathlib.Path(directory) / INDEX_DIRNAME / (pathlib.Path(json_filename).stem + ".stats.json")
+        self.json_filename = json_filename
+        self.posts = 0
+        self.last_message_at = None
+        self.days = {}
+        self._threads_by_day = {}  # 日期 -> 當天有回覆的討論串 root_id
+    
+    def add(self, simple_post: Dict, files: list = ()):
+        created = simple_post.get("created", "")
+        day = created[:10]
+        record = self.days.get(day)
+        if record is None:
+            record = self.days[day] = {"messages": 0, "users": {}, "active_threads": 0, "attachments": {}}
+        record["messages"] += 1
+        username = simple_post.get("username", "")
+        record["users"][username] = record["users"].get(username, 0) + 1
+        if simple_post.get("root_id"):
+            self._threads_by_day.setdefault(day, set()).add(simple_post["root_id"])
+        for file in files:
+            counts = record["attachments"].setdefault(attachment_type(file.get("name", "")), [0, 0])
+            counts[0] += 1
+            counts[1] += file.get("size") or 0
+        self.posts += 1
+        if created and (self.last_message_at is None or created > self.last_message_at):
+            self.last_message_at = created
+    
+    def save(self):
+        """寫入彙總檔（在頻道 JSON 寫完之後呼叫，EasyViewer 以彙總檔不早於 JSON 判斷是否有效）"""
+        for day, roots in self._threads_by_day.items():
+            self.days[day]["active_threads"] = len(roots)
+        self.path.parent.mkdir(exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"version": self.VERSION, "json_file": self.json_filename, "posts": self.posts,
+                       "last_message_at": self.last_message_at, "days": self.days},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def get_team_channels(d: Driver, my_user_id: str, team: Dict, user_id_to_name: Dict[str, str]) -> list:
+    """獲取使用者在團隊中的所有頻道（直接訊息以對方的使用者名稱顯示），依名稱排序"""
+    channels = d.channels.get_channels_for_user(my_user_id, team["id"])
+    
+    # 為直接訊息添加顯示名稱
+    for channel in channels:
+        channel["team_id"] = team["id"]
+        if channel["type"] != "D":
+            continue
+        # 頻道名稱由兩個使用者 ID 用雙底線連接組成
+        user_ids = channel["name"].split("__")
+        other_user_id = user_ids[1] if user_ids[0] == my_user_id else user_ids[0]
+        if other_user_id in user_id_to_name:
+            channel["display_name"] = user_id_to_name[other_user_id]
+        else:
+            # 如果找不到使用者名稱，使用 ID
+            channel["display_name"] = f"Unknown_User_{other_user_id}"
+    
+    # 按名稱排序頻道
+    return sorted(channels, key=lambda x: x["display_name"].lower())
+
+
+def download_post_files(post, i_post, d, output_base, config=None, file_stats=None, incremental_manager=None,
+                        metrics=None, progress=None, profiler=None, namer: ChannelFileNamer = None,
+                        policy: DownloadPolicy = None):
+    """
+    下載訊息的所有附件（依下載政策過濾、已下載檢查、檔名衝突處理與重試）
+    回傳依政策只保留資訊（metadata_only）的附件清單
+    """
+    if policy is None:
+        policy = DownloadPolicy(config)
+    channel_key = post.get("channel_id") or str(output_base)
+    metadata_only = []
+    for file in post["metadata"]["files"]:
+        filename = file["name"]
+        file_id = file["id"]
+        
+        # 檢查檔案是否已下載（增量下載功能）
+        if incremental_manager and incremental_manager.is_file_downloaded(file_id):
+            file_event_logger.info(f"檔案已存在，跳過: {filename}",
+                                   extra={"event": "file_skipped", "file": filename, "reason": "already_downloaded"})
+            if file_stats:
+                file_stats['skipped'] += 1
+                file_stats['skip_reasons']['already_downloaded'] = file_stats['skip_reasons'].get('already_downloaded', 0) + 1
+            continue
+        
+        if namer is None:
+            namer = ChannelFileNamer(output_base)
+        
+        # 之前匯出到此資料夾時已儲存的附件直接沿用
+        existing_filename = namer.existing(file_id, "%03d_" % i_post)
+        if existing_filename:
+            file_event_logger.info(f"檔案已存在，跳過: {existing_filename}",
+                                   extra={"event": "file_skipped", "file": existing_filename, "reason": "already_exists"})
+            if file_stats:
+                file_stats['skipped'] += 1
+                file_stats['skip_reasons']['already_exists'] = file_stats['skip_reasons'].get('already_exists', 0) + 1
+            policy.record_downloaded(file_id)
+            continue
+        
+        # 依 metadata 檢查下載政策（副檔名、MIME 類型、大小上限與位元組預算）
+        action, skip_reason = policy.evaluate(file, channel_key)
+        if action != DownloadPolicy.DOWNLOAD:
+            file_event_logger.info(f"跳過檔案 {filename}: 不符合下載政策 ({skip_reason})",
+                                   extra={"event": "file_skipped", "file": filename, "reason": skip_reason,
+                                          "bytes": file.get("size", 0)})
+            if file_stats:
+                file_stats['skipped'] += 1
+                file_stats['skip_reasons'][skip_reason] = file_stats['skip_reasons'].get(skip_reason, 0) + 1
+                file_stats['skipped_bytes'] = file_stats.get('skipped_bytes', 0) + (file.get("size") or 0)
+            policy.record_skip(file, post, i_post, output_base, skip_reason)
+            if action == DownloadPolicy.METADATA_ONLY:
+                metadata_only.append({"id": file_id, "name": filename, "size": file.get("size", 0),
+                                      "mime_type": file.get("mime_type", ""), "reason": skip_reason})
+            continue
+        
+        # 生成基礎檔案名稱，如果已被使用則添加數字後綴
+        base_filename = "%03d" % i_post + "_" + file["name"]
+        with profile_section(profiler, "filename_resolve"):
+            name_parts = file["name"].rsplit('.', 1)
+            if len(name_parts) == 2:
+                # 有副檔名的情況
+                filename_to_save = namer.allocate("%03d" % i_post + "_" + name_parts[0], "." + name_parts[1])
+            else:
+                # 沒有副檔名的情況
+                filename_to_save = namer.allocate(base_filename)
+        
+        file_event_logger.debug(f"Downloading {file['name']}", extra={"event": "file_download_started", "file": file["name"]})
+        if progress:
+            progress.add_file(file.get("size", 0))
+        if filename_to_save != base_filename:
+            file_event_logger.info(f"  -> 檔案已存在，儲存為: {filename_to_save}",
+                                   extra={"event": "file_renamed", "file": filename_to_save})
+        
+        # 限制重試次數，避免無限迴圈
+        max_retries = 3
+        retry_count = 0
+        resp = None
+        download_success = False
+        
+        while retry_count < max_retries:
+            try:
+                with profile_section(profiler, "fetch_file"):
+                    resp = d.files.get_file(file["id"])
+                break
+            except Exception as e:
+                retry_count += 1
+                file_event_logger.warning(f"Downloading file failed (attempt {retry_count}/{max_retries}): {str(e)}",
+                                          extra={"event": "file_download_retry", "file": file["name"], "attempt": retry_count})
+                if metrics and retry_count < max_retries:
+                    metrics.record_retry(DownloadMetrics.endpoint_label('get', f"/files/{file_id}"))
+                if retry_count >= max_retries:
+                    file_event_logger.warning(f"Failed to download {file['name']} after {max_retries} attempts, skipping...",
+                                              extra={"event": "file_download_failed", "file": file["name"]})
+                    break
+        
+        # 只有成功下載才寫入檔案
+        if resp is not None:
+            try:
+                # Mattermost Driver unfortunately parses json files to dicts
+                with profile_section(profiler, "file_write"):
+                    data = json.dumps(resp).encode() if isinstance(resp, (dict, list)) else resp.content
+                    namer.write(filename_to_save, data)
+                file_event_logger.info(f"Successfully downloaded {file['name']}",
+                                       extra={"event": "file_downloaded", "file": filename_to_save,
+                                              "bytes": file.get("size", 0)})
+                download_success = True
+                namer.record(file_id, filename_to_save)
+                policy.record_downloaded(file_id)
+                
+                # 標記檔案為已下載（增量下載功能）
+                if incremental_manager:
+                    file_path = str(output_base / filename_to_save)
+                    with profile_section(profiler, "sync_state_save"):
+                        incremental_manager.mark_file_downloaded(file_id, file_path, file_sha256(data), len(data))
+                
+            except Exception as e:
+                file_event_logger.error(f"Failed to save file {file['name']}: {str(e)}",
+                                        extra={"event": "file_save_failed", "file": filename_to_save})
+                download_success = False
+        else:
+            file_event_logger.warning(f"Skipped downloading {file['name']} due to repeated failures",
+                                      extra={"event": "file_skipped", "file": file["name"], "reason": "download_failed"})
+            download_success = False
+        
+        if progress:
+            progress.file_done(file.get("size", 0) if download_success else 0)
+        
+        if not download_success:
+            # 歸還預算，並記錄下來讓 backfill 之後重試
+            policy.release(channel_key, file.get("size", 0))
+            policy.record_skip(file, post, i_post, output_base, "download_failed")
+        
+        # 更新檔案統計
+        if file_stats:
+            if download_success:
+                file_stats['downloaded'] += 1
+            else:
+                file_stats['skipped'] += 1
+                file_stats['skip_reasons']['download_failed'] = file_stats['skip_reasons'].get('download_failed', 0) + 1
+    
+    return metadata_only
+
+
 def process_single_post(post, i_post, user_id_to_name, d, output_base, download_files, before, after, 
-                       config=None, file_stats=None, incremental_manager=None):
+                       config=None, file_stats=None, incremental_manager=None, metrics=None, progress=None,
+                       profiler=None, namer: ChannelFileNamer = None, code_index: ChannelCodeIndex = None,
+                       policy: DownloadPolicy = None):
     """處理單個 post，返回處理後的 post 資料或 None（如果被日期過濾）"""
     
     # Filter posts by date range
@@ -326,7 +1719,8 @@ def process_single_post(post, i_post, user_id_to_name, d, output_base, download_
     user_id = post["user_id"]
     if user_id not in user_id_to_name:
         try:
-            user_id_to_name[user_id] = d.users.get_user(user_id)["username"]
+            with profile_section(profiler, "fetch_user"):
+                user_id_to_name[user_id] = d.users.get_user(user_id)["username"]
         except exceptions.ResourceNotFound:
             user_id_to_name[user_id] = user_id
     username = user_id_to_name[user_id]
@@ -336,139 +1730,117 @@ def process_single_post(post, i_post, user_id_to_name, d, output_base, download_
     if post.get("root_id"):
         simple_post["root_id"] = post["root_id"]
 
-    # If a code block is given in the message, dump it to file
-    if message.count("```") > 1:
-        start_pos = message.find("```") + 3
-        end_pos = message.rfind("```")
-
-        cut = message[start_pos:end_pos]
-        if not len(cut):
-            print("Code has no length")
-        else:
-            # 生成基礎檔案名稱並檢查是否已存在
+    # 單次掃描取出所有程式碼區塊（含語言標示），寫入頻道的程式碼索引；
+    # 每個區塊也存成 NNN_code.txt（設定 "code_block_files": false 時只寫入索引）
+    with profile_section(profiler, "extract_code"):
+        code_blocks = extract_code_blocks(message)
+    if code_blocks and code_index is not None:
+        code_index.add(post["id"], i_post, code_blocks)
+    if code_blocks and (code_index is None or (config or {}).get("code_block_files", True)):
+        if namer is None:
+            namer = ChannelFileNamer(output_base)
+        for i_block, block in enumerate(code_blocks):
+            if not block["code"]:
+                file_event_logger.debug("Code has no length", extra={"event": "code_empty", "idx": i_post})
+                continue
+            # 生成基礎檔案名稱；重新匯出時覆寫同一則訊息之前儲存的檔案
             base_filename = "%03d" % i_post + "_code.txt"
-            filename = base_filename
-            counter = 1
-            while (output_base / filename).exists():
-                filename = "%03d" % i_post + f"_code_({counter}).txt"
-                counter += 1
+            code_key = "code:" + post["id"] + (f":{i_block}" if i_block else "")
+            data = block["code"].encode()
+            with profile_section(profiler, "filename_resolve"):
+                filename = namer.existing(code_key, "%03d_" % i_post)
+                renamed = False
+                if filename is None:
+                    filename = namer.allocate("%03d" % i_post + "_code", ".txt")
+                    namer.record(code_key, filename)
+                    renamed = filename != base_filename and i_block == 0
+                elif namer.unchanged(filename, data):
+                    continue  # 重新匯出且內容相同：不再附加到封裝檔或覆寫檔案
             
-            with open(output_base / filename, "wb") as f:
-                f.write(cut.encode())
+            with profile_section(profiler, "file_write"):
+                namer.write(filename, data)
             
-            if filename != base_filename:
-                print(f"程式碼區塊已存在，儲存為: {filename}")
+            if renamed:
+                file_event_logger.info(f"程式碼區塊已存在，儲存為: {filename}",
+                                       extra={"event": "code_renamed", "file": filename})
 
     # If any files are attached to the message, download each
     if "files" in post["metadata"]:
-        filenames = []
-        for file in post["metadata"]["files"]:
-            filename = file["name"]
-            file_id = file["id"]
-            filenames.append(filename)
-            
-            if download_files:
-                # 檢查檔案是否已下載（增量下載功能）
-                if incremental_manager and incremental_manager.is_file_downloaded(file_id):
-                    print(f"檔案已存在，跳過: {filename}")
-                    if file_stats:
-                        file_stats['skipped'] += 1
-                        file_stats['skip_reasons']['already_downloaded'] = file_stats['skip_reasons'].get('already_downloaded', 0) + 1
-                    continue
-                
-                # 檢查副檔名過濾
-                should_download, skip_reason = should_download_file(filename, config or {})
-                if not should_download:
-                    print(f"跳過檔案 {filename}: 副檔名被排除 ({skip_reason})")
-                    if file_stats:
-                        file_stats['skipped'] += 1
-                        file_stats['skip_reasons'][skip_reason] = file_stats['skip_reasons'].get(skip_reason, 0) + 1
-                    continue
-                
-                # 生成基礎檔案名稱
-                base_filename = "%03d" % i_post + "_" + file["name"]
-                filename_to_save = base_filename
-                
-                # 檢查檔案是否已存在，如果存在則添加數字後綴
-                counter = 1
-                while (output_base / filename_to_save).exists():
-                    name_parts = file["name"].rsplit('.', 1)
-                    if len(name_parts) == 2:
-                        # 有副檔名的情況
-                        filename_to_save = "%03d" % i_post + "_" + name_parts[0] + f"_({counter})." + name_parts[1]
-                    else:
-                        # 沒有副檔名的情況
-                        filename_to_save = "%03d" % i_post + "_" + file["name"] + f"_({counter})"
-                    counter += 1
-                
-                print("Downloading", file["name"])
-                if filename_to_save != base_filename:
-                    print(f"  -> 檔案已存在，儲存為: {filename_to_save}")
-                
-                # 限制重試次數，避免無限迴圈
-                max_retries = 3
-                retry_count = 0
-                resp = None
-                download_success = False
-                
-                while retry_count < max_retries:
-                    try:
-                        resp = d.files.get_file(file["id"])
-                        break
-                    except Exception as e:
-                        retry_count += 1
-                        print(f"Downloading file failed (attempt {retry_count}/{max_retries}): {str(e)}")
-                        if retry_count >= max_retries:
-                            print(f"Failed to download {file['name']} after {max_retries} attempts, skipping...")
-                            break
-                
-                # 只有成功下載才寫入檔案
-                if resp is not None:
-                    try:
-                        # Mattermost Driver unfortunately parses json files to dicts
-                        if isinstance(resp, dict):
-                            with open(output_base / filename_to_save, "w") as f:
-                                json.dump(resp, f)
-                        elif isinstance(resp, list):
-                            with open(output_base / filename_to_save, "w") as f:
-                                json.dump(resp, f)
-                        else:
-                            with open(output_base / filename_to_save, "wb") as f:
-                                f.write(resp.content)
-                        print(f"Successfully downloaded {file['name']}")
-                        download_success = True
-                        
-                        # 標記檔案為已下載（增量下載功能）
-                        if incremental_manager:
-                            file_path = str(output_base / filename_to_save)
-                            incremental_manager.mark_file_downloaded(file_id, file_path)
-                        
-                    except Exception as e:
-                        print(f"Failed to save file {file['name']}: {str(e)}")
-                        download_success = False
-                else:
-                    print(f"Skipped downloading {file['name']} due to repeated failures")
-                    download_success = False
-                
-                # 更新檔案統計
-                if file_stats:
-                    if download_success:
-                        file_stats['downloaded'] += 1
-                    else:
-                        file_stats['skipped'] += 1
-                        file_stats['skip_reasons']['download_failed'] = file_stats['skip_reasons'].get('download_failed', 0) + 1
-
-        simple_post["files"] = filenames
+        simple_post["files"] = [file["name"] for file in post["metadata"]["files"]]
+        if download_files:
+            metadata_only = download_post_files(post, i_post, d, output_base, config, file_stats,
+                                                incremental_manager, metrics, progress, profiler, namer, policy)
+            if metadata_only:
+                # 超過大小上限或預算的附件只保留資訊，之後可用 backfill 子命令補下載
+                simple_post["files_metadata"] = metadata_only
     
     return simple_post
 
 
+def write_thread_index(output_base: pathlib.Path, json_filename: str, thread_replies: Dict[str, list],
+                       post_idx_by_id: Dict[str, int]):
+    """輸出頻道的討論串索引（root_id -> 依時間排序的回覆 idx、回覆數、最後回覆時間）"""
+    threads = {}
+    for root_id, replies in thread_replies.items():
+        replies.sort()
+        threads[root_id] = {
+            "root_idx": post_idx_by_id.get(root_id),
+            "replies": [idx for _, idx in replies],
+            "reply_count": len(replies),
+            "last_reply_at": replies[-1][0]
+        }
+
+    index_dir = output_base / INDEX_DIRNAME
+    index_dir.mkdir(exist_ok=True)
+    index_path = index_dir / (pathlib.Path(json_filename).stem + ".threads.json")
+    with open(index_path, "w", encoding="utf8") as f:
+        json.dump({"version": 1, "threads": threads}, f, ensure_ascii=False, separators=(',', ':'))
+    return index_path
+
+
+def _post_create_at(d: Driver, channel_id: str, offset: int) -> Optional[int]:
+    """頻道中第 offset 則訊息（由新到舊排序）的建立時間（毫秒），超出範圍時回傳 None"""
+    posts = d.posts.get_posts_for_channel(channel_id, params={"per_page": 1, "page": offset})
+    if not posts["order"]:
+        return None
+    return posts["posts"][posts["order"][0]]["create_at"]
+
+
+def find_first_page_before(d: Driver, channel_id: str, before_ms: float, per_page: int) -> int:
+    """
+    找出第一個包含 before 之前訊息的分頁
+    API 依建立時間由新到舊分頁，但不提供依時間定位的游標；以每次只取一則訊息的請求先倍增、再二分搜尋
+    第一則不晚於 before 的訊息位置，只需 O(log n) 個小請求，不必下載 before 之後的所有分頁
+    """
+    def is_old_enough(offset):
+        create_at = _post_create_at(d, channel_id, offset)
+        return create_at is None or create_at <= before_ms
+
+    if is_old_enough(0):
+        return 0
+    newer, older = 0, per_page  # newer 的訊息晚於 before；older 的訊息不晚於 before（或已超出範圍）
+    while not is_old_enough(older):
+        newer, older = older, older * 2
+    while older - newer > 1:
+        middle = (newer + older) // 2
+        if is_old_enough(middle):
+            older = middle
+        else:
+            newer = middle
+    return older // per_page
+
+
 def export_channel(d: Driver, channel: str, user_id_to_name: Dict[str, str], output_base: str,
                    download_files: bool = True, before: str = None, after: str = None, 
-                   config: Dict = None, file_stats: Dict = None, incremental_manager=None):
-    """匯出頻道資料，包含檔案覆蓋防護和流式寫入"""
+                   config: Dict = None, file_stats: Dict = None, incremental_manager=None,
+                   metrics: DownloadMetrics = None, progress: ProgressTracker = None,
+                   profiler: ExportProfiler = None, policy: DownloadPolicy = None, folder_name: str = None):
+    """匯出頻道資料，包含檔案覆蓋防護和流式寫入
+
+    folder_name 為 ChannelFolderRegistry 配置的資料夾名稱；未指定時使用清理後的顯示名稱
+    """
     # Sanitize channel name
-    channel_name = channel["display_name"].replace("\\", "").replace("/", "")
+    channel_name = folder_name or channel["display_name"].replace("\\", "").replace("/", "")
 
     print("Exporting channel", channel_name)
     if after:
@@ -480,19 +1852,20 @@ def export_channel(d: Driver, channel: str, user_id_to_name: Dict[str, str], out
     output_base = pathlib.Path(output_base) / channel_name
     output_base.mkdir(parents=True, exist_ok=True)
     
+    # 單次掃描頻道資料夾，之後的檔名衝突檢查都在記憶體中完成
+    namer = ChannelFileNamer(output_base, ChannelPack.from_config(config, output_base))
+    
     # 準備 JSON 檔案輸出路徑
     filtered_channel_name = ''.join(filter(lambda ch: ch not in "?!/\\.;:*\"<>|", channel_name))
     base_output_filename = filtered_channel_name + ".json"
-    output_filename = base_output_filename
     
     # 檢查 JSON 檔案是否已存在，如果存在則添加數字後綴
-    counter = 1
-    while (output_base / output_filename).exists():
-        name_without_ext = filtered_channel_name
-        output_filename = f"{name_without_ext}_({counter}).json"
-        counter += 1
+    with profile_section(profiler, "filename_resolve"):
+        output_filename = namer.allocate(filtered_channel_name, ".json")
     
     output_filepath = output_base / output_filename
+    code_index = ChannelCodeIndex(output_base, output_filename)
+    rollup = ChannelRollup(output_base, output_filename)
     
     # 開始流式寫入 JSON 檔案
     with open(output_filepath, "w", encoding='utf8') as json_file:
@@ -511,13 +1884,25 @@ def export_channel(d: Driver, channel: str, user_id_to_name: Dict[str, str], out
         json_file.flush()  # 立即寫入檔案
         
         # 分批處理 posts，減少記憶體佔用
+        per_page = 200
         page = 0
+        if before:
+            with profile_section(profiler, "seek_posts"):
+                page = find_first_page_before(d, channel["id"], before * 1000, per_page)
+            if page:
+                print(f"Skipping {page} page(s) of posts newer than the 'before' date")
         total_posts_processed = 0
         first_post = True
         
+        # 討論串索引：root_id -> [(回覆時間, idx)]
+        thread_replies = {}
+        post_idx_by_id = {}
+        
         while True:
-            print(f"Requesting channel page {page}")
-            posts = d.posts.get_posts_for_channel(channel["id"], params={"per_page": 200, "page": page})
+            if progress is None:
+                print(f"Requesting channel page {page}")
+            with profile_section(profiler, "fetch_posts"):
+                posts = d.posts.get_posts_for_channel(channel["id"], params={"per_page": per_page, "page": page})
 
             if len(posts["posts"]) == 0:
                 # If no posts are returned, we have reached the end
@@ -529,9 +1914,11 @@ def export_channel(d: Driver, channel: str, user_id_to_name: Dict[str, str], out
             
             for post in page_posts:
                 # 即時處理每個 post，減少記憶體佔用
-                simple_post = process_single_post(post, total_posts_processed, user_id_to_name, d, 
-                                                 output_base, download_files, before, after,
-                                                 config, file_stats, incremental_manager)
+                with profile_section(profiler, "process_single_post"):
+                    simple_post = process_single_post(post, total_posts_processed, user_id_to_name, d, 
+                                                     output_base, download_files, before, after,
+                                                     config, file_stats, incremental_manager, metrics, progress,
+                                                     profiler, namer, code_index, policy)
                 
                 if simple_post is not None:  # 如果 post 通過日期過濾
                     if not first_post:
@@ -540,19 +1927,43 @@ def export_channel(d: Driver, channel: str, user_id_to_name: Dict[str, str], out
                         first_post = False
                     
                     # 寫入 post 資料
-                    json.dump(simple_post, json_file, indent=4, ensure_ascii=False)
-                    json_file.flush()  # 立即寫入檔案
+                    with profile_section(profiler, "json_serialize"):
+                        json.dump(simple_post, json_file, indent=4, ensure_ascii=False)
+                    with profile_section(profiler, "file_write"):
+                        json_file.flush()  # 立即寫入檔案
+                    
+                    post_idx_by_id[simple_post["id"]] = simple_post["idx"]
+                    if "root_id" in simple_post:
+                        thread_replies.setdefault(simple_post["root_id"], []).append(
+                            (simple_post["created"], simple_post["idx"]))
+                    rollup.add(simple_post, post["metadata"].get("files", []))
                     
                 total_posts_processed += 1
             
+            # 每頁更新一次附件對應表與程式碼索引，中斷後重新執行也能沿用已下載的檔案
+            namer.save()
+            code_index.flush()
+            if metrics:
+                metrics.add_posts(len(page_posts))
             page += 1
-            print(f"Processed {total_posts_processed} posts so far...")
+            if progress:
+                progress.advance_posts(len(page_posts))
+            else:
+                print(f"Processed {total_posts_processed} posts so far...")
+            
+            # 分頁由新到舊，本頁最舊的訊息已早於 after 時，之後的分頁都不在範圍內
+            if after and page_posts[0]["create_at"] / 1000 < after:
+                break
         
         # 寫入 JSON 結尾
         json_file.write('\n  ]\n')
         json_file.write('}\n')
         json_file.flush()
     
+    with profile_section(profiler, "write_thread_index"):
+        write_thread_index(output_base, output_filename, thread_replies, post_idx_by_id)
+    code_index.flush(touch=True)
+    rollup.save()
     print(f"Found and processed {total_posts_processed} posts")
     if output_filename != base_output_filename:
         print(f"頻道資料檔案已存在，儲存為: '{output_filepath}'")
@@ -560,65 +1971,229 @@ def export_channel(d: Driver, channel: str, user_id_to_name: Dict[str, str], out
         print(f"Exported channel data to '{output_filepath}'")
 
 
-def setup_logging(output_base):
-    """設置日誌記錄"""
+class ChannelScheduler:
+    """依預估成本排程頻道匯出工作，縮短整批匯出的總耗時
+    
+    排序：使用者指定的優先順序高者先，同一優先順序內預估成本大者先（LPT）。
+    依序把工作分配給目前負載最小的 worker；worker 自己的佇列清空後，
+    從剩餘負載最重的 worker 佇列尾端（成本最小的工作）竊取工作，避免有 worker 閒置。
+    """
+    
+    DEFAULT_SECONDS_PER_POST = 0.005  # 沒有任何歷史紀錄時每則訊息的預估耗時
+    
+    def __init__(self, channels: list, workers: int = 1, priorities: Dict[str, int] = None,
+                 history: IncrementalDownloadManager = None):
+        self.workers = max(1, int(workers))
+        self.priorities = priorities or {}
+        self.history = history
+        self.seconds_per_post = self._history_seconds_per_post(channels)
+        self.costs = {channel['id']: self.estimate_cost(channel) for channel in channels}
+        self.order = sorted(channels, key=lambda channel: (-self.priority(channel), -self.costs[channel['id']],
+                                                           channel.get('display_name', '')))
+        self._queues = [deque() for _ in range(self.workers)]
+        self._remaining = [0.0] * self.workers
+        for channel in self.order:
+            worker = self._remaining.index(min(self._remaining))
+            self._queues[worker].append(channel)
+            self._remaining[worker] += self.costs[channel['id']]
+        self._lock = threading.Lock()
+        self.steals = 0
+    
+    def _export_stats(self, channel: Dict) -> Optional[Dict]:
+        return self.history.get_channel_export_stats(channel['id']) if self.history else None
+    
+    def _history_seconds_per_post(self, channels: list) -> float:
+        """以有歷史紀錄的頻道估算每則訊息的平均耗時"""
+        seconds = posts = 0
+        for channel in channels:
+            stats = self._export_stats(channel)
+            if stats and stats.get('posts'):
+                seconds += stats.get('seconds', 0)
+                posts += stats['posts']
+        return seconds / posts if posts and seconds else self.DEFAULT_SECONDS_PER_POST
+    
+    def priority(self, channel: Dict) -> int:
+        """優先順序可用頻道的顯示名稱、name 或 id 指定，未指定為 0"""
+        for key in (channel.get('display_name'), channel.get('name'), channel.get('id')):
+            if key in self.priorities:
+                return int(self.priorities[key])
+        return 0
+    
+    def estimate_cost(self, channel: Dict) -> float:
+        """預估匯出秒數：有歷史紀錄時依上次耗時按訊息數比例調整，否則以訊息數乘上平均每則耗時"""
+        total = channel.get('total_msg_count') or 0
+        stats = self._export_stats(channel)
+        if stats and stats.get('posts'):
+            return stats.get('seconds', 0) * max(total, stats['posts']) / stats['posts']
+        return total * self.seconds_per_post
+    
+    def estimated_makespan(self) -> float:
+        """預估整批匯出的秒數（負載最重的 worker 的預估成本合計）"""
+        with self._lock:
+            return max(self._remaining)
+    
+    def next_channel(self, worker: int = 0) -> Optional[Dict]:
+        """取得 worker 的下一個頻道；全部工作都已分派時回傳 None"""
+        with self._lock:
+            queue_ = self._queues[worker]
+            if not queue_:
+                candidates = [i for i, pending in enumerate(self._queues) if pending]
+                if not candidates:
+                    return None
+                victim = max(candidates, key=lambda i: self._remaining[i])
+                channel = self._queues[victim].pop()
+                self._remaining[victim] -= self.costs[channel['id']]
+                self.steals += 1
+                return channel
+            channel = queue_.popleft()
+            self._remaining[worker] -= self.costs[channel['id']]
+            return channel
+
+
+class BatchedFileHandler(logging.FileHandler):
+    """批次寫入的日誌檔：累積一定筆數或時間後才 flush，避免每筆記錄都觸發一次磁碟寫入"""
+    
+    def __init__(self, filename, flush_interval: float = 1.0, flush_records: int = 500):
+        super().__init__(filename, encoding='utf-8')
+        self.flush_interval = flush_interval
+        self.flush_records = flush_records
+        self._pending = 0
+        self._last_flush = time.monotonic()
+    
+    def emit(self, record):
+        # 與 StreamHandler.emit 相同，但寫入後不立即 flush，而是累積到批次上限
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self._pending += 1
+            if self._pending >= self.flush_records or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+    
+    def flush(self):
+        """立即寫入尚未 flush 的記錄"""
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        super().flush()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """結構化日誌：每筆記錄為一行 JSON，logger 呼叫時的 extra 欄位（event、file 等）一併輸出"""
+    
+    RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+    
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED_ATTRS:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ConsoleFilter(logging.Filter):
+    """控制台過濾：file_only 的記錄只寫入檔案；單一檔案層級的訊息只在 verbose 模式或警告以上時顯示"""
+    
+    def __init__(self, verbose: bool):
+        super().__init__()
+        self.verbose = verbose
+    
+    def filter(self, record):
+        if record.name == 'file_only':
+            return False
+        if record.name == file_event_logger.name and record.levelno < logging.WARNING:
+            return self.verbose
+        return True
+
+
+class _BatchingQueueListener(logging.handlers.QueueListener):
+    """佇列閒置時把批次中尚未寫入的記錄 flush 到檔案"""
+    
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=1.0)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+
+
+def _stop_logging():
+    """停止日誌背景執行緒並寫入剩餘的記錄"""
+    global _log_listener
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
+
+
+def setup_logging(output_base, verbosity: str = "normal", log_format: str = "json"):
+    """設置日誌記錄
+    
+    日誌檔的記錄先放入佇列，由背景執行緒批次寫入，下載流程不會被檔案 I/O 阻塞；
+    控制台則直接同步輸出，確保互動提示（input）出現前，前面的選項已經顯示。
+    verbosity: quiet（只顯示警告以上的檔案訊息）、normal（檔案訊息只寫入日誌檔）、verbose（全部顯示）
+    log_format: json（每行一筆 JSON，副檔名 .jsonl）或 text
+    """
     # 確保日誌目錄存在
     log_dir = os.path.join(output_base, "logs")
     os.makedirs(log_dir, exist_ok=True)
     
     # 設置日誌檔案名稱（包含時間戳）
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = os.path.join(log_dir, f"auto_download_{timestamp}.log")
+    extension = ".jsonl" if log_format == "json" else ".log"
+    log_file = os.path.join(log_dir, f"auto_download_{timestamp}{extension}")
     
     # 設置日誌格式
-    log_format = '%(asctime)s - %(levelname)s - %(message)s'
+    text_format = '%(asctime)s - %(levelname)s - %(message)s'
     date_format = '%Y-%m-%d %H:%M:%S'
     
-    # 創建無緩衝的檔案處理器，確保即時寫入
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setFormatter(logging.Formatter(log_format, date_format))
+    # 批次寫入的檔案處理器
+    file_handler = BatchedFileHandler(log_file)
+    if log_format == "json":
+        file_handler.setFormatter(JsonLinesFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(text_format, date_format))
     
     # 創建控制台處理器
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(logging.Formatter(log_format, date_format))
+    console_handler.setFormatter(logging.Formatter(text_format, date_format))
+    console_handler.addFilter(_ConsoleFilter(verbosity == "verbose"))
+    
+    # 重新設置時先停止舊的背景執行緒
+    global _log_listener
+    if _log_listener is None:
+        atexit.register(_stop_logging)
+    else:
+        _stop_logging()
+    
+    log_queue = queue.Queue()
+    _log_listener = _BatchingQueueListener(log_queue, file_handler, respect_handler_level=True)
+    _log_listener.start()
     
-    # 配置日誌記錄器
+    # 配置日誌記錄器：檔案經由 QueueHandler 交給背景執行緒，控制台同步輸出
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))  # 時間與等級由背景執行緒的 handler 格式化
     logging.basicConfig(
         level=logging.INFO,
-        format=log_format,
-        datefmt=date_format,
-        handlers=[file_handler, console_handler],
+        handlers=[queue_handler, console_handler],
         force=True  # 強制重新配置
     )
+    file_event_logger.setLevel({"quiet": logging.WARNING, "verbose": logging.DEBUG}.get(verbosity, logging.INFO))
     
-    # 設置檔案處理器為無緩衝模式
-    if hasattr(file_handler, 'stream'):
-        # 強制每次寫入後立即刷新
-        original_emit = file_handler.emit
-        def flush_emit(record):
-            original_emit(record)
-            if hasattr(file_handler.stream, 'flush'):
-                file_handler.stream.flush()
-        file_handler.emit = flush_emit
-    
-    # 創建一個只輸出到檔案的 logger，設置即時寫入
+    # 只輸出到檔案的 logger（由控制台過濾器排除）
     file_logger = logging.getLogger('file_only')
     file_logger.setLevel(logging.INFO)
-    file_logger.handlers.clear()  # 清除繼承的 handlers
-    file_only_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_only_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
-    # 設置檔案專用處理器也為無緩衝模式
-    if hasattr(file_only_handler, 'stream'):
-        original_emit_file = file_only_handler.emit
-        def flush_emit_file(record):
-            original_emit_file(record)
-            if hasattr(file_only_handler.stream, 'flush'):
-                file_only_handler.stream.flush()
-        file_only_handler.emit = flush_emit_file
-    
-    file_logger.addHandler(file_only_handler)
-    file_logger.propagate = False  # 防止向上傳播
+    file_logger.handlers.clear()
+    file_logger.propagate = True
     
     logger = logging.getLogger(__name__)
     logger.info(f"日誌記錄已啟動，日誌檔案: {log_file}")
@@ -635,6 +2210,32 @@ def log_and_print(logger, message, level='info'):
     elif level == 'debug':
         logger.debug(message)
 
+def update_channel_timelines(results_root: str, folder_names, logger):
+    """
+    更新 EasyViewer 的跨快照合併時間軸（results/.index/timeline，見 EasyViewer/timeline.py），
+    檢視器開啟頻道時不需在請求中建立；只有最新的快照變動時只讀取該快照。
+    設定 "update_timeline": false 或專案中沒有 EasyViewer 時略過
+    """
+    viewer_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "EasyViewer")
+    if viewer_dir not in sys.path:
+        sys.path.append(viewer_dir)
+    try:
+        from timeline import update_timeline
+    except ImportError:
+        return
+    folder_names = sorted(set(folder_names))
+    if not folder_names:
+        return
+    log_and_print(logger, f"正在更新 {len(folder_names)} 個頻道的合併時間軸...")
+    started = time.time()
+    for folder_name in folder_names:
+        try:
+            update_timeline(results_root, folder_name)
+        except Exception as e:
+            log_and_print(logger, f"無法更新頻道 {folder_name} 的合併時間軸: {str(e)}", 'warning')
+    log_and_print(logger, f"合併時間軸已更新，耗時 {time.time() - started:.1f} 秒")
+
+
 def auto_download_all_channels():
     """自動下載所有頻道"""
     print("=== 自動批量下載所有頻道 ===")
@@ -646,7 +2247,8 @@ def auto_download_all_channels():
     output_base = "results/" + date.today().strftime("%Y%m%d")
     
     # 設置日誌記錄
-    logger, file_logger, log_file = setup_logging(output_base)
+    logger, file_logger, log_file = setup_logging(output_base, config.get("verbosity", "normal"),
+                                                  config.get("log_format", "json"))
     
     # 初始化增量下載管理器
     incremental_manager = None
@@ -654,6 +2256,21 @@ def auto_download_all_channels():
         incremental_manager = IncrementalDownloadManager(output_base)
         log_and_print(logger, "已啟用增量下載功能")
     
+    # 效能指標（config 設定 metrics_port 時提供 Prometheus /metrics 端點）
+    metrics = DownloadMetrics()
+    metrics_port = config.get("metrics_port")
+    if metrics_port:
+        metrics_host = config.get("metrics_host", "127.0.0.1")
+        start_metrics_server(metrics, int(metrics_port), metrics_host)
+        log_and_print(logger, f"效能指標端點: http://{metrics_host}:{metrics_port}/metrics")
+    
+    # 效能分析（config "profile" 或環境變數 MM_PROFILE：timers / cprofile / sample）
+    profiler = ExportProfiler.from_config(config, os.path.dirname(log_file))
+    if profiler:
+        profiler.instrument_logger(logger)
+        profiler.instrument_logger(file_event_logger)
+        log_and_print(logger, f"已啟用效能分析 ({profiler.mode})，輸出目錄: {profiler.output_dir}")
+    
     # 初始化全域檔案統計
     global_file_stats = {
         'downloaded': 0,
@@ -677,8 +2294,9 @@ def auto_download_all_channels():
     # 連接到 Mattermost
     log_and_print(logger, "正在連接到 Mattermost...")
     d = connect(config["host"], config.get("port", 443), config.get("token", None),
-                config.get("username", None), config.get("password", None))
+                config.get("username", None), config.get("password", None), config.get("scheme", "https"))
     log_and_print(logger, "成功連接到 Mattermost")
+    instrument_driver(d, metrics)
     
     # 獲取使用者資訊
     log_and_print(logger, "正在獲取使用者資訊...")
@@ -692,26 +2310,7 @@ def auto_download_all_channels():
     
     # 獲取所有頻道
     log_and_print(logger, "正在下載所有頻道資訊...")
-    channels = d.channels.get_channels_for_user(my_user_id, team["id"])
-    log_and_print(logger, f"獲取到 {len(channels)} 個頻道")
-    
-    # 為直接訊息添加顯示名稱
-    for channel in channels:
-        channel["team_id"] = team["id"]
-        if channel["type"] != "D":
-            continue
-        # 頻道名稱由兩個使用者 ID 用雙底線連接組成
-        user_ids = channel["name"].split("__")
-        other_user_id = user_ids[1] if user_ids[0] == my_user_id else user_ids[0]
-        if other_user_id in user_id_to_name:
-            channel["display_name"] = user_id_to_name[other_user_id]
-        else:
-            # 如果找不到使用者名稱，使用 ID
-            channel["display_name"] = f"Unknown_User_{other_user_id}"
-    
-    # 按名稱排序頻道
-    channels = sorted(channels, key=lambda x: x["display_name"].lower())
-    
+    channels = get_team_channels(d, my_user_id, team, user_id_to_name)
     log_and_print(logger, f"找到 {len(channels)} 個頻道！")
     
     # 檢查增量下載歷史
@@ -956,52 +2555,130 @@ def auto_download_all_channels():
     # 開始批量下載
     log_and_print(logger, f"\n=== 開始{sync_mode}下載 {len(filtered_channels)} 個頻道 ===")
     
+    # 依預估成本（total_msg_count 與 results/sync_state.json 中的歷史耗時）與優先順序排程；
+    # 未下載的附件也記錄在同一份狀態中，供 backfill 子命令使用
+    export_history = IncrementalDownloadManager(os.path.dirname(output_base))
+    
     # 顯示檔案過濾設定
-    if config.get('excluded_extensions'):
-        log_and_print(logger, f"檔案過濾設定: 排除 {', '.join(config['excluded_extensions'])} 檔案")
-    else:
-        log_and_print(logger, "檔案過濾設定: 下載所有檔案")
+    policy = DownloadPolicy(config, export_history)
+    log_and_print(logger, f"檔案過濾設定: {policy.describe()}")
     
     failed_channels = []
     total_new_posts = 0
     total_new_files = 0
     
-    for i_channel, channel in enumerate(filtered_channels):
+    # 進度列（依頻道的 total_msg_count 估算整體進度與剩餘時間）
+    # 今天以 plan 子命令估算過相同日期範圍時，進度列改用估算的訊息數與下載量
+    plan = load_download_plan(output_base, after, before)
+    if plan:
+        log_and_print(logger, f"使用下載計畫估算進度: {os.path.join(output_base, PLAN_FILENAME)}")
+    progress = (ProgressTracker(filtered_channels, plan=plan).install() if config.get("show_progress", True)
+                else None)
+    
+    channel_workers = max(1, int(config.get("channel_workers", 1)))
+    scheduler = ChannelScheduler(filtered_channels, channel_workers, config.get("channel_priorities"),
+                                 export_history)
+    # 排程前集中配置資料夾名稱，名稱相同的頻道平行匯出時不會互相覆寫
+    folders = ChannelFolderRegistry(filtered_channels)
+    log_and_print(logger, f"頻道排程: {channel_workers} 個 worker，預估總工作量 "
+                          f"{sum(scheduler.costs.values()):.1f} 秒")
+    stats_lock = threading.Lock()
+    started_count = [0]
+    exported_folders = []
+    
+    def export_scheduled_channel(channel: Dict) -> bool:
+        """匯出單一頻道並更新統計，成功回傳 True"""
+        with stats_lock:
+            started_count[0] += 1
+            position = started_count[0]
+        # 重置頻道級別的檔案統計
+        channel_file_stats = {
+            'downloaded': 0,
+            'skipped': 0,
+            'skip_reasons': {}
+        }
         try:
-            progress_msg = f"\n[{i_channel + 1}/{len(filtered_channels)}] 開始匯出頻道: {channel['display_name']}"
+            progress_msg = f"\n[{position}/{len(filtered_channels)}] 開始匯出頻道: {channel['display_name']}"
             log_and_print(logger, progress_msg)
             
-            # 重置頻道級別的檔案統計
-            channel_file_stats = {
-                'downloaded': 0,
-                'skipped': 0,
-                'skip_reasons': {}
-            }
-            
-            export_channel(d, channel, user_id_to_name, output_base, 
-                         config["download_files"], before, after, 
-                         config, channel_file_stats, incremental_manager)
+            metrics.start_channel(channel['display_name'])
+            if progress:
+                progress.start_channel(channel)
+            if profiler:
+                profiler.start_channel(channel['display_name'])
+            with profile_section(profiler, "export_channel"):
+                export_channel(d, channel, user_id_to_name, output_base, 
+                             config["download_files"], before, after, 
+                             config, channel_file_stats, incremental_manager, metrics, progress, profiler,
+                             policy, folders.folder(channel))
+            if profiler:
+                profiler.finish_channel()
+            channel_metrics = metrics.finish_channel(True, channel_file_stats['downloaded'])
+            if progress:
+                progress.finish_channel()
+            if channel_metrics:
+                export_history.record_channel_export(channel['id'], channel['display_name'],
+                                                     channel_metrics['seconds'], channel_metrics['posts'],
+                                                     channel_metrics['bytes'])
             
             # 更新全域統計
-            global_file_stats['downloaded'] += channel_file_stats['downloaded']
-            global_file_stats['skipped'] += channel_file_stats['skipped']
-            for reason, count in channel_file_stats['skip_reasons'].items():
-                global_file_stats['skip_reasons'][reason] = global_file_stats['skip_reasons'].get(reason, 0) + count
+            with stats_lock:
+                global_file_stats['downloaded'] += channel_file_stats['downloaded']
+                global_file_stats['skipped'] += channel_file_stats['skipped']
+                global_file_stats['skipped_bytes'] = (global_file_stats.get('skipped_bytes', 0)
+                                                      + channel_file_stats.get('skipped_bytes', 0))
+                for reason, count in channel_file_stats['skip_reasons'].items():
+                    global_file_stats['skip_reasons'][reason] = global_file_stats['skip_reasons'].get(reason, 0) + count
+                exported_folders.append(folders.folder(channel))
             
             success_msg = f"✓ 完成匯出: {channel['display_name']} (下載 {channel_file_stats['downloaded']} 檔案, 跳過 {channel_file_stats['skipped']} 檔案)"
             log_and_print(logger, success_msg)
+            return True
             
         except Exception as e:
+            if profiler:
+                profiler.finish_channel()
+            metrics.finish_channel(False, channel_file_stats['downloaded'])
+            if progress:
+                progress.finish_channel()
             error_msg = f"✗ 匯出失敗: {channel['display_name']} - 錯誤: {str(e)}"
             log_and_print(logger, error_msg, 'error')
-            failed_channels.append((channel['display_name'], str(e)))
-            
-            # 詢問是否繼續
-            continue_download = input("是否繼續下載其他頻道？ (y/n): ")
-            log_and_print(logger, f"使用者選擇是否繼續: {continue_download}")
-            if continue_download.lower() != 'y':
-                log_and_print(logger, "使用者選擇停止下載")
+            with stats_lock:
+                failed_channels.append((channel['display_name'], str(e)))
+            return False
+    
+    if channel_workers == 1:
+        while True:
+            channel = scheduler.next_channel()
+            if channel is None:
                 break
+            if not export_scheduled_channel(channel):
+                # 詢問是否繼續
+                continue_download = input("是否繼續下載其他頻道？ (y/n): ")
+                log_and_print(logger, f"使用者選擇是否繼續: {continue_download}")
+                if continue_download.lower() != 'y':
+                    log_and_print(logger, "使用者選擇停止下載")
+                    break
+    else:
+        # 多個 worker 同時匯出時不逐一詢問，失敗的頻道列在最後的摘要中
+        def channel_worker(worker: int):
+            while True:
+                channel = scheduler.next_channel(worker)
+                if channel is None:
+                    return
+                export_scheduled_channel(channel)
+        
+        worker_threads = [threading.Thread(target=channel_worker, args=(worker,), daemon=True,
+                                           name=f"channel-worker-{worker}")
+                          for worker in range(channel_workers)]
+        for thread in worker_threads:
+            thread.start()
+        for thread in worker_threads:
+            thread.join()
+        log_and_print(logger, f"工作竊取次數: {scheduler.steals}")
+    
+    if progress:
+        progress.close()
     
     # 顯示結果摘要
     log_and_print(logger, "\n=== 下載完成摘要 ===")
@@ -1019,10 +2696,42 @@ def auto_download_all_channels():
         log_and_print(logger, "\n跳過檔案原因統計:")
         for reason, count in global_file_stats['skip_reasons'].items():
             log_and_print(logger, f"  - {reason}: {count} 個")
+    if global_file_stats.get('skipped_bytes'):
+        log_and_print(logger, f"依下載政策略過: {global_file_stats['skipped_bytes'] / 1024 / 1024:.2f} MB")
+    
+    if config.get("update_timeline", True):
+        update_channel_timelines(os.path.dirname(output_base), exported_folders, logger)
+    
+    # 未下載的附件已記錄在 sync_state.json，之後可直接補下載
+    export_history.save()
+    pending_files = len(export_history.get_skipped_files())
+    if pending_files:
+        log_and_print(logger, f"未下載的附件: {pending_files} 個（可用 python auto_download_all.py backfill 補下載）")
+    
+    # 效能統計報告
+    report_file = os.path.join(os.path.dirname(log_file),
+                               os.path.basename(os.path.splitext(log_file)[0]).replace("auto_download_", "metrics_") + ".json")
+    report = metrics.write_report(report_file)
+    log_and_print(logger, "\n=== 效能統計 ===")
+    log_and_print(logger, f"總耗時: {report['elapsed_seconds']:.1f} 秒，請求數: {report['requests']}，"
+                          f"重試: {report['retries']}，錯誤: {report['errors']}")
+    log_and_print(logger, f"平均速率: {report['requests_per_second']:.2f} 請求/秒，"
+                          f"{report['bytes_per_second'] / 1024 / 1024:.2f} MB/秒")
+    for label, stats in report['endpoints'].items():
+        log_and_print(logger, f"  - {label}: {stats['requests']} 次，p50 {stats['latency_p50'] * 1000:.0f} ms，"
+                              f"p99 {stats['latency_p99'] * 1000:.0f} ms，{stats['bytes'] / 1024 / 1024:.2f} MB")
+    log_and_print(logger, f"效能報告: {report_file}")
+    
+    if profiler:
+        profile_dir = profiler.close()
+        log_and_print(logger, "\n=== 效能分析（各區段自身耗時）===")
+        for name, seconds in profiler.totals().items():
+            log_and_print(logger, f"  - {name}: {seconds:.3f} 秒")
+        log_and_print(logger, f"效能分析輸出: {profile_dir}")
     
     # 保存增量下載狀態
     if incremental_manager:
-        incremental_manager.save_sync_state()
+        incremental_manager.save()
         log_and_print(logger, "增量下載狀態已保存")
     
     if failed_channels:
@@ -1048,9 +2757,1289 @@ def auto_download_all_channels():
     log_and_print(logger, f"日誌檔案位置: {log_file}")
     log_and_print(logger, "批量下載完成！")
 
-if __name__ == '__main__':
+def channel_json_header(channel_info: Dict) -> str:
+    """頻道 JSON 的開頭（channel 區塊與 posts 陣列開始），之後逐則寫入訊息並以 ]} 結尾"""
+    return ('{\n  "channel": ' + json.dumps(channel_info, indent=4, ensure_ascii=False).replace('\n', '\n  ') +
+            ',\n  "posts": [\n')
+
+
+class TailChannelArchive:
+    """
+    tail 模式下單一頻道在某一天的封存檔（results/<日期>/<頻道>/<頻道>.json，格式與批量匯出相同）
+    新訊息覆寫檔案結尾的 `]}` 後追加，不需重寫整個檔案；編輯與刪除先暫存，flush() 時才一次重寫整個檔案，
+    內容沒有變動時不重寫
+    """
+    
+    TRAILER = '\n  ]\n}\n'
+    
+    def __init__(self, channel: Dict, team: Dict, output_base: str, config: Dict = None, folder_name: str = None):
+        channel_name = folder_name or channel["display_name"].replace("\\", "").replace("/", "")
+        self.channel = channel
+        self.directory = pathlib.Path(output_base) / channel_name
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.namer = ChannelFileNamer(self.directory, ChannelPack.from_config(config, self.directory))
+        filtered_channel_name = ''.join(filter(lambda ch: ch not in "?!/\\.;:*\"<>|", channel_name))
+        self.path = self.directory / (filtered_channel_name + ".json")
+        self.code_index = ChannelCodeIndex(self.directory, self.path.name, append=self.path.exists())
+        self.idx_by_id = {}
+        self.next_idx = 0
+        self._file_posts = 0  # 檔案中的訊息數（暫存的刪除尚未寫入時，與 idx_by_id 不同）
+        self._replacements = {}  # 訊息 id -> 新內容（None 表示刪除），flush() 時寫入
+        
+        if self.path.exists():
+            # 同一天已有匯出或先前的 tail 結果：接續編號並記錄已封存的訊息（重新連線補齊時去重）
+            with open(self.path, "r", encoding="utf8") as f:
+                posts = json.load(f).get("posts", [])
+            for post in posts:
+                self.idx_by_id[post["id"]] = post["idx"]
+            self.next_idx = max(self.idx_by_id.values(), default=-1) + 1
+            self._file_posts = len(posts)
+        else:
+            self._write({
+                "name": channel["name"],
+                "display_name": channel["display_name"],
+                "header": channel.get("header", ""),
+                "id": channel["id"],
+                "team": team["name"],
+                "team_id": team["id"],
+                "exported_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            }, [])
+    
+    def _write(self, channel_info: Dict, posts: list):
+        """以批量匯出的版面寫入整個檔案（先寫暫存檔再取代）"""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.write(channel_json_header(channel_info))
+            f.write(',\n'.join(json.dumps(post, indent=4, ensure_ascii=False) for post in posts))
+            f.write(self.TRAILER)
+        os.replace(tmp_path, self.path)
+    
+    def append(self, simple_post: Dict):
+        """在檔案結尾追加一則訊息"""
+        with open(self.path, "r+b") as f:
+            f.seek(-len(self.TRAILER), os.SEEK_END)
+            if f.read() != self.TRAILER.encode():
+                raise ValueError(f"Unexpected end of archive {self.path}")
+            f.seek(-len(self.TRAILER), os.SEEK_END)
+            separator = ',\n' if self._file_posts else '\n'
+            f.write((separator + json.dumps(simple_post, indent=4, ensure_ascii=False) + self.TRAILER).encode("utf8"))
+        self.idx_by_id[simple_post["id"]] = simple_post["idx"]
+        self.next_idx = max(self.next_idx, simple_post["idx"] + 1)
+        self._file_posts += 1
+    
+    def replace(self, post_id: str, simple_post: Optional[Dict]):
+        """以新的內容取代已封存的訊息；simple_post 為 None 時刪除該訊息（flush() 時寫入）"""
+        self._replacements[post_id] = simple_post
+        if simple_post is None:
+            self.idx_by_id.pop(post_id, None)
+    
+    def flush(self) -> bool:
+        """寫入暫存的編輯與刪除，有重寫檔案時回傳 True"""
+        if not self._replacements:
+            return False
+        replacements, self._replacements = self._replacements, {}
+        with open(self.path, "r", encoding="utf8") as f:
+            data = json.load(f)
+        posts = []
+        changed = False
+        for post in data["posts"]:
+            if post["id"] not in replacements:
+                posts.append(post)
+                continue
+            new_post = replacements[post["id"]]
+            changed = changed or new_post != post
+            if new_post is not None:
+                posts.append(new_post)
+        if changed:
+            self._write(data["channel"], posts)
+            self._file_posts = len(posts)
+        # 索引不早於頻道 JSON 時 EasyViewer 才使用索引
+        self.code_index.flush(touch=changed)
+        return changed
+
+
+class ChannelTail:
+    """
+    tail 模式：訂閱 WebSocket 的 posted / post_edited / post_deleted 事件，即時更新當天的頻道封存
+    - WebSocket 事件只放入佇列，由事件執行緒依序處理，不阻塞接收迴圈
+    - 附件放入下載佇列，由獨立的下載執行緒處理
+    - 每次（重新）連線收到 hello 事件時，以 IncrementalDownloadManager 記錄的各頻道游標
+      （最後處理的訊息更新時間）呼叫 since 查詢補齊斷線期間的訊息
+    - 當天封存以外的舊訊息被編輯（或 since 查詢只因反應等變動而回傳）時不寫入當天的封存，
+      避免舊訊息重複出現在錯誤的日期；封存中訊息的編輯與刪除與游標一起定期寫入
+    """
+    
+    CURSOR_FLUSH_INTERVAL = 5.0  # 同步狀態最多每 5 秒寫入一次
+    
+    def __init__(self, d: Driver, channels: list, team: Dict, user_id_to_name: Dict[str, str], config: Dict,
+                 incremental_manager: IncrementalDownloadManager, logger, metrics: DownloadMetrics = None,
+                 output_root: str = "results"):
+        self.d = d
+        self.channels = {channel["id"]: channel for channel in channels}
+        self.folders = ChannelFolderRegistry(channels)
+        self.team = team
+        self.user_id_to_name = user_id_to_name
+        self.config = config
+        self.download_files = config.get("download_files", True)
+        self.incremental_manager = incremental_manager
+        self.policy = DownloadPolicy(config, incremental_manager)  # 預算以整個 tail 執行期間計算
+        self.logger = logger
+        self.metrics = metrics
+        self.output_root = output_root
+        self.started_at_ms = int(time.time() * 1000)
+        self.events = queue.Queue()
+        self.attachments = queue.Queue()
+        self._archives = {}  # (日期, 頻道 id) -> TailChannelArchive
+        self._cursors = {}  # 頻道 id -> (更新時間毫秒, 訊息 id)，尚未寫入同步狀態
+        self._last_cursor_flush = time.monotonic()
+        self._threads = [
+            threading.Thread(target=self._event_worker, name="tail-events", daemon=True),
+            threading.Thread(target=self._attachment_worker, name="tail-attachments", daemon=True)
+        ]
+    
+    async def handle_websocket_message(self, message: str):
+        """WebSocket 事件處理（在事件迴圈中執行，只做解析與排入佇列）"""
+        try:
+            event = json.loads(message)
+        except ValueError:
+            return
+        name = event.get("event")
+        if name == "hello":
+            self.events.put(("gap_fill", None))
+        elif name in ("posted", "post_edited", "post_deleted"):
+            try:
+                post = json.loads(event["data"]["post"])
+            except (KeyError, TypeError, ValueError):
+                return
+            if post.get("channel_id") in self.channels:
+                self.events.put((name, post))
+    
+    def run(self):
+        """連線 WebSocket 並持續處理事件，直到使用者中斷"""
+        for thread in self._threads:
+            thread.start()
+        # 斷線後由 mattermostdriver 自動重新連線，重新連線時會再次收到 hello 事件並補齊訊息
+        self.d.options["keepalive"] = True
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        try:
+            self.d.init_websocket(self.handle_websocket_message)
+        except KeyboardInterrupt:
+            log_and_print(self.logger, "\n使用者停止即時同步")
+        finally:
+            self.close()
+    
+    def close(self):
+        """停止背景執行緒並保存游標"""
+        if getattr(self.d, "websocket", None):
+            self.d.disconnect()
+        self.events.put((None, None))
+        self._threads[0].join(timeout=10)
+        self.attachments.put(None)
+        self._threads[1].join(timeout=60)
+        self._flush_cursors(force=True)
+    
+    def _archive(self, channel_id: str) -> TailChannelArchive:
+        """當天的頻道封存（跨日時自動使用新的日期資料夾）"""
+        day = date.today().strftime("%Y%m%d")
+        key = (day, channel_id)
+        archive = self._archives.get(key)
+        if archive is None:
+            channel = self.channels[channel_id]
+            archive = TailChannelArchive(channel, self.team, os.path.join(self.output_root, day),
+                                         self.config, self.folders.folder(channel))
+            for old_key, old_archive in self._archives.items():
+                if old_key[0] != day:
+                    old_archive.flush()
+            self._archives = {k: v for k, v in self._archives.items() if k[0] == day}
+            self._archives[key] = archive
+        return archive
+    
+    def _event_worker(self):
+        while True:
+            try:
+                kind, post = self.events.get(timeout=1)
+            except queue.Empty:
+                self._flush_cursors()
+                continue
+            if kind is None:
+                break
+            try:
+                if kind == "gap_fill":
+                    self._gap_fill()
+                else:
+                    self._apply_post(post, kind)
+            except Exception as e:
+                log_and_print(self.logger, f"處理 {kind} 事件失敗: {str(e)}", 'error')
+            self._flush_cursors()
+    
+    def _apply_post(self, post: Dict, event: str = "posted", since: int = None):
+        """新增、更新或刪除封存中的訊息
+
+        event 為 WebSocket 事件名稱；since 為補齊時查詢的起點（毫秒），since 查詢會同時回傳新訊息與
+        之後有任何變動（編輯、反應）的舊訊息。有更新封存時回傳 True
+        """
+        channel_id = post["channel_id"]
+        archive = self._archive(channel_id)
+        channel_name = self.channels[channel_id]["display_name"]
+        deleted = event == "post_deleted" or bool(post.get("delete_at"))
+        archived = post["id"] in archive.idx_by_id
+        if since is not None:
+            # 已封存的訊息只有內容被編輯或刪除時才更新；未封存的訊息只有在 since 之後建立才是新訊息
+            ignored = (post.get("edit_at", 0) <= since and not deleted) if archived else post["create_at"] <= since
+        else:
+            ignored = not archived and event != "posted"
+        
+        applied = not ignored and (archived or not deleted)
+        if ignored:
+            if not archived and not deleted:
+                file_event_logger.debug(f"[{channel_name}] 略過當天封存以外的訊息更新: {post['id']}",
+                                        extra={"event": "tail_update_ignored", "post_id": post["id"]})
+        elif archived:
+            archive.code_index.remove(post["id"])
+            if deleted:
+                archive.replace(post["id"], None)
+                log_and_print(self.logger, f"[{channel_name}] 訊息已刪除: {post['id']}")
+            else:
+                simple_post = process_single_post(post, archive.idx_by_id[post["id"]], self.user_id_to_name, self.d,
+                                                  archive.directory, False, None, None, self.config,
+                                                  namer=archive.namer, code_index=archive.code_index)
+                archive.replace(post["id"], simple_post)
+                log_and_print(self.logger, f"[{channel_name}] 訊息已編輯: {post['id']}")
+        elif not deleted:
+            idx = archive.next_idx
+            simple_post = process_single_post(post, idx, self.user_id_to_name, self.d, archive.directory,
+                                              False, None, None, self.config, namer=archive.namer,
+                                              code_index=archive.code_index)
+            archive.append(simple_post)
+            archive.code_index.flush(touch=True)
+            log_and_print(self.logger, f"[{channel_name}] {simple_post['username']}: "
+                                       f"{simple_post['message'][:80].replace(chr(10), ' ')}")
+            if self.metrics:
+                self.metrics.add_posts(1)
+            if self.download_files and post.get("metadata", {}).get("files"):
+                self.attachments.put((archive, post, idx))
+        
+        updated_at = max(post.get("update_at", 0), post.get("create_at", 0), post.get("delete_at", 0))
+        if updated_at > self._cursors.get(channel_id, (0, None))[0]:
+            self._cursors[channel_id] = (updated_at, post["id"])
+        return applied
+    
+    def _gap_fill(self):
+        """以各頻道的游標補齊斷線期間新增、編輯或刪除的訊息"""
+        filled = 0
+        for channel_id, channel in self.channels.items():
+            cursor = self.incremental_manager.get_channel_last_sync_time(channel_id)
+            since = int(cursor * 1000) if cursor else self.started_at_ms
+            pending = self._cursors.get(channel_id)
+            if pending:
+                since = max(since, pending[0])
+            result = self.d.posts.get_posts_for_channel(channel_id, params={"since": since})
+            posts = sorted(result.get("posts", {}).values(), key=lambda post: post["create_at"])
+            for post in posts:
+                filled += self._apply_post(post, since=since)
+        if filled:
+            log_and_print(self.logger, f"已補齊 {filled} 則斷線期間的訊息")
+    
+    def _attachment_worker(self):
+        while True:
+            job = self.attachments.get()
+            if job is None:
+                break
+            archive, post, idx = job
+            try:
+                download_post_files(post, idx, self.d, archive.directory, self.config, metrics=self.metrics,
+                                    namer=archive.namer, policy=self.policy)
+                archive.namer.save()
+            except Exception as e:
+                log_and_print(self.logger, f"下載附件失敗 ({post['id']}): {str(e)}", 'error')
+    
+    def _flush_cursors(self, force: bool = False):
+        """將游標寫入同步狀態（合併多個事件，避免每則訊息都重寫狀態檔）"""
+        if not self._cursors or (not force and time.monotonic() - self._last_cursor_flush < self.CURSOR_FLUSH_INTERVAL):
+            return
+        for channel_id, (updated_at, post_id) in self._cursors.items():
+            timestamp = datetime.fromtimestamp(updated_at / 1000, timezone.utc).isoformat()
+            self.incremental_manager.update_channel_sync_time(channel_id, self.channels[channel_id]["display_name"],
+                                                              timestamp, post_id)
+        self._cursors = {}
+        for archive in self._archives.values():
+            archive.flush()
+            archive.namer.save()
+        self._last_cursor_flush = time.monotonic()
+
+
+def select_channels_by_name(channels: list, channel_names: list) -> list:
+    """依顯示名稱或頻道名稱（不分大小寫）選擇頻道"""
+    wanted = {name.lower() for name in channel_names}
+    return [channel for channel in channels
+            if channel["display_name"].lower() in wanted or channel["name"].lower() in wanted]
+
+
+def tail_channels(channel_names: list = None):
+    """即時同步頻道（tail 模式）"""
+    print("=== 即時同步頻道 (tail) ===")
+    
+    config = get_config_from_json()
+    config = complete_config(config)
+    
+    output_root = "results"
+    logger, file_logger, log_file = setup_logging(os.path.join(output_root, date.today().strftime("%Y%m%d")),
+                                                  config.get("verbosity", "normal"),
+                                                  config.get("log_format", "json"))
+    # 游標存放在 results 根目錄，跨日重新啟動時仍可補齊
+    incremental_manager = IncrementalDownloadManager(output_root)
+    
+    metrics = DownloadMetrics()
+    metrics_port = config.get("metrics_port")
+    if metrics_port:
+        metrics_host = config.get("metrics_host", "127.0.0.1")
+        start_metrics_server(metrics, int(metrics_port), metrics_host)
+        log_and_print(logger, f"效能指標端點: http://{metrics_host}:{metrics_port}/metrics")
+    
+    log_and_print(logger, "正在連接到 Mattermost...")
+    d = connect(config["host"], config.get("port", 443), config.get("token", None),
+                config.get("username", None), config.get("password", None), config.get("scheme", "https"))
+    instrument_driver(d, metrics)
+    user_id_to_name, my_user_id = get_users(d)
+    team = select_team(d, my_user_id)
+    channels = get_team_channels(d, my_user_id, team, user_id_to_name)
+    
+    if channel_names:
+        channels = select_channels_by_name(channels, channel_names)
+        if not channels:
+            log_and_print(logger, f"找不到指定的頻道: {', '.join(channel_names)}", 'error')
+            return
+    
+    log_and_print(logger, f"即時同步 {len(channels)} 個頻道，儲存到 {output_root}/<日期>/（按 Ctrl+C 停止）")
+    log_and_print(logger, f"日誌檔案位置: {log_file}")
+    ChannelTail(d, channels, team, user_id_to_name, config, incremental_manager, logger, metrics, output_root).run()
+
+
+PLAN_FILENAME = "plan.json"
+
+
+def load_download_plan(output_base: str, after: str = None, before: str = None) -> Optional[Dict]:
+    """載入今天的下載計畫；日期範圍與目前設定不同時不使用"""
+    plan_path = os.path.join(output_base, PLAN_FILENAME)
+    try:
+        with open(plan_path, 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if plan.get("after") != after or plan.get("before") != before:
+        return None
+    return plan
+
+
+def scan_channel_plan(d: Driver, channel: Dict, before: float, after: float, state: IncrementalDownloadManager,
+                      history: IncrementalDownloadManager, policy: DownloadPolicy, page_pool: ThreadPoolExecutor,
+                      page_batch: int, incremental: bool) -> Dict:
+    """
+    只讀取分頁的訊息 metadata（不下載附件）估算單一頻道的匯出工作量
+    分頁範圍與 export_channel 相同；依 total_msg_count 一次平行請求多個分頁
+    """
+    per_page = 200
+    page = find_first_page_before(d, channel["id"], before * 1000, per_page) if before else 0
+    # 上次同步的位置：tail / import 的游標，沒有時以上次匯出完成的時間為準
+    cursor = history.get_channel_last_sync_time(channel["id"])
+    if cursor is None:
+        last_export = history.get_channel_export_stats(channel["id"]) or {}
+        if last_export.get("finished_at"):
+            cursor = datetime.fromisoformat(last_export["finished_at"]).timestamp()
+    entry = {"id": channel["id"], "name": channel["display_name"], "total_msg_count": channel.get("total_msg_count", 0),
+             "scan_posts": 0, "posts": 0, "files": 0, "bytes": 0, "new_posts": 0, "new_files": 0, "new_bytes": 0,
+             "download_files": 0, "download_bytes": 0, "skipped": {}}
+    
+    def fetch(page_number):
+        return d.posts.get_posts_for_channel(channel["id"], params={"per_page": per_page, "page": page_number})
+    
+    batch = max(1, min(page_batch, -(-(channel.get("total_msg_count") or 0) // per_page) - page))
+    done = False
+    while not done:
+        for posts in page_pool.map(fetch, range(page, page + batch)):
+            if not posts["order"]:
+                done = True
+                break
+            page_posts = [posts["posts"][post_id] for post_id in posts["order"]]
+            entry["scan_posts"] += len(page_posts)
+            for post in page_posts:
+                created = post["create_at"] / 1000
+                if (before and created > before) or (after and created < after):
+                    continue
+                entry["posts"] += 1
+                if cursor is None or (post.get("update_at") or post["create_at"]) / 1000 > cursor:
+                    entry["new_posts"] += 1
+                for file in (post.get("metadata") or {}).get("files", []):
+                    size = file.get("size") or 0
+                    entry["files"] += 1
+                    entry["bytes"] += size
+                    is_new = not state.is_file_downloaded(file["id"])
+                    if is_new:
+                        entry["new_files"] += 1
+                        entry["new_bytes"] += size
+                    # 增量下載只會下載新的附件，否則所有附件都會依下載政策下載
+                    if incremental and not is_new:
+                        continue
+                    action, reason = policy.evaluate(file, channel["id"])
+                    if action == DownloadPolicy.DOWNLOAD:
+                        entry["download_files"] += 1
+                        entry["download_bytes"] += size
+                    else:
+                        entry["skipped"][reason] = entry["skipped"].get(reason, 0) + 1
+            # 與匯出相同：本頁最舊的訊息已早於 after 或分頁未滿時，之後沒有需要的分頁
+            if (after and min(post["create_at"] for post in page_posts) / 1000 < after) or \
+                    len(page_posts) < per_page:
+                done = True
+                break
+        page += batch
+        batch = page_batch
+    return entry
+
+
+def plan_channels(channel_names: list = None):
+    """
+    估算匯出工作量（plan 模式）：訊息數、附件數與位元組數，以及相對於同步狀態的差異
+    結果儲存到 results/<日期>/plan.json，當天的批量下載會用它估算進度與剩餘時間
+    """
+    print("=== 估算匯出工作量 (plan) ===")
+    
+    config = get_config_from_json()
+    config = complete_config(config)
+    
+    output_base = "results/" + date.today().strftime("%Y%m%d")
+    logger, file_logger, log_file = setup_logging(output_base, config.get("verbosity", "normal"),
+                                                  config.get("log_format", "json"))
+    after = config.get("after", None)
+    before = config.get("before", None)
+    incremental = config.get('enable_incremental_download', False)
+    # 增量下載使用當天資料夾的已下載檔案紀錄；游標與匯出歷史在 results 根目錄
+    state = IncrementalDownloadManager(output_base)
+    history = IncrementalDownloadManager(os.path.dirname(output_base))
+    policy = DownloadPolicy(config)
+    
+    log_and_print(logger, "正在連接到 Mattermost...")
+    d = connect(config["host"], config.get("port", 443), config.get("token", None),
+                config.get("username", None), config.get("password", None), config.get("scheme", "https"))
+    metrics = DownloadMetrics()
+    instrument_driver(d, metrics)
+    user_id_to_name, my_user_id = get_users(d)
+    team = select_team(d, my_user_id)
+    channels = get_team_channels(d, my_user_id, team, user_id_to_name)
+    if channel_names:
+        channels = select_channels_by_name(channels, channel_names)
+        if not channels:
+            log_and_print(logger, f"找不到指定的頻道: {', '.join(channel_names)}", 'error')
+            return
+    
+    workers = max(1, int(config.get("plan_workers", 8)))
+    log_and_print(logger, f"掃描 {len(channels)} 個頻道的訊息 metadata（{workers} 個並行請求）...")
+    before_ts = datetime.strptime(before, '%Y-%m-%d').timestamp() if before else None
+    after_ts = datetime.strptime(after, '%Y-%m-%d').timestamp() if after else None
+    started = time.monotonic()
+    # 頻道與分頁分開的執行緒池：頻道工作等待分頁請求時不會佔住分頁的執行緒
+    with ThreadPoolExecutor(workers, thread_name_prefix="plan-page") as page_pool, \
+            ThreadPoolExecutor(workers, thread_name_prefix="plan-channel") as channel_pool:
+        entries = list(channel_pool.map(
+            lambda channel: scan_channel_plan(d, channel, before_ts, after_ts, state, history, policy,
+                                              page_pool, workers, incremental), channels))
+    
+    totals = {key: sum(entry[key] for entry in entries)
+              for key in ("scan_posts", "posts", "files", "bytes", "new_posts", "new_files", "new_bytes",
+                          "download_files", "download_bytes")}
+    skipped = {}
+    for entry in entries:
+        for reason, count in entry["skipped"].items():
+            skipped[reason] = skipped.get(reason, 0) + count
+    
+    # 依估算的訊息數預估匯出時間（與批量下載相同的排程與歷史耗時）
+    channel_workers = max(1, int(config.get("channel_workers", 1)))
+    scheduler = ChannelScheduler([dict(channel, total_msg_count=entry["scan_posts"])
+                                  for channel, entry in zip(channels, entries)],
+                                 channel_workers, config.get("channel_priorities"), history)
+    disk_free = shutil.disk_usage(os.path.dirname(output_base)).free
+    
+    plan = {
+        "version": 1,
+        "created_at": datetime.now().isoformat(),
+        "team": team.get("name", ""),
+        "after": after,
+        "before": before,
+        "incremental": incremental,
+        "totals": totals,
+        "skipped": skipped,
+        "estimated_seconds": round(scheduler.estimated_makespan(), 1),
+        "channel_workers": channel_workers,
+        "disk_free_bytes": disk_free,
+        "channels": {entry["id"]: entry for entry in entries}
+    }
+    plan_path = os.path.join(output_base, PLAN_FILENAME)
+    with open(plan_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
+    os.replace(plan_path + ".tmp", plan_path)
+    
+    print(f"\n{'頻道':<24}{'訊息':>10}{'新訊息':>10}{'附件':>8}{'新附件':>8}{'附件 MB':>10}{'預計下載 MB':>12}")
+    for entry in sorted(entries, key=lambda entry: -entry["download_bytes"]):
+        print(f"{entry['name'][:22]:<24}{entry['posts']:>10}{entry['new_posts']:>10}{entry['files']:>8}"
+              f"{entry['new_files']:>8}{entry['bytes'] / 1024 / 1024:>10.1f}{entry['download_bytes'] / 1024 / 1024:>12.1f}")
+    log_and_print(logger, f"\n=== 估算結果（掃描耗時 {time.monotonic() - started:.1f} 秒）===")
+    log_and_print(logger, f"訊息: {totals['posts']} 則（新訊息 {totals['new_posts']} 則，需讀取 {totals['scan_posts']} 則）")
+    log_and_print(logger, f"附件: {totals['files']} 個，{totals['bytes'] / 1024 / 1024:.1f} MB"
+                          f"（新附件 {totals['new_files']} 個，{totals['new_bytes'] / 1024 / 1024:.1f} MB）")
+    log_and_print(logger, f"預計下載: {totals['download_files']} 個附件，{totals['download_bytes'] / 1024 / 1024:.1f} MB"
+                          f"（檔案過濾設定: {policy.describe()}）")
+    for reason, count in skipped.items():
+        log_and_print(logger, f"  - 略過 {reason}: {count} 個")
+    log_and_print(logger, f"預估匯出時間: {ProgressTracker._format_duration(plan['estimated_seconds'])}"
+                          f"（{channel_workers} 個 worker）")
+    if totals['download_bytes'] > disk_free:
+        log_and_print(logger, f"磁碟剩餘空間不足: 剩餘 {disk_free / 1024 / 1024:.1f} MB", 'warning')
+    log_and_print(logger, f"計畫已儲存到: {plan_path}")
+
+
+def backfill_skipped_files(reasons: list = None, ignore_policy: bool = False):
+    """
+    補下載之前依下載政策略過或下載失敗的附件（backfill 模式）
+    直接依 results/sync_state.json 記錄的檔案 id 與頻道資料夾下載，不需重新掃描頻道
+    """
+    print("=== 補下載略過的附件 (backfill) ===")
+    
+    config = get_config_from_json()
+    config = complete_config(config)
+    
+    output_root = "results"
+    logger, file_logger, log_file = setup_logging(os.path.join(output_root, date.today().strftime("%Y%m%d")),
+                                                  config.get("verbosity", "normal"),
+                                                  config.get("log_format", "json"))
+    state = IncrementalDownloadManager(output_root)
+    pending = state.get_skipped_files()
+    if reasons:
+        pending = {file_id: entry for file_id, entry in pending.items()
+                   if any(entry.get("reason", "").startswith(reason) for reason in reasons)}
+    if not pending:
+        log_and_print(logger, "沒有需要補下載的附件")
+        return
+    
+    # 依頻道資料夾與訊息分組，每個資料夾只建立一次檔名索引
+    posts = OrderedDict()
+    missing_dirs = 0
+    for file_id, entry in sorted(pending.items(), key=lambda item: (item[1].get("channel_dir", ""),
+                                                                   item[1].get("idx", 0))):
+        if not os.path.isdir(entry.get("channel_dir", "")):
+            missing_dirs += 1
+            continue
+        post = posts.setdefault((entry["channel_dir"], entry.get("post_id", ""), entry.get("idx", 0)), {
+            "id": entry.get("post_id", ""), "channel_id": entry.get("channel_id", ""), "metadata": {"files": []}})
+        post["metadata"]["files"].append({"id": file_id, "name": entry.get("name", ""),
+                                          "size": entry.get("size", 0), "mime_type": entry.get("mime_type", "")})
+    log_and_print(logger, f"待補下載附件: {len(pending)} 個" +
+                          (f"（{missing_dirs} 個的頻道資料夾已不存在，略過）" if missing_dirs else ""))
+    if not posts:
+        return
+    
+    log_and_print(logger, "正在連接到 Mattermost...")
+    d = connect(config["host"], config.get("port", 443), config.get("token", None),
+                config.get("username", None), config.get("password", None), config.get("scheme", "https"))
+    metrics = DownloadMetrics()
+    instrument_driver(d, metrics)
+    
+    # 預設仍套用目前設定的下載政策（例如放寬大小上限後再執行），--all 則忽略所有限制
+    policy = DownloadPolicy({} if ignore_policy else config, state)
+    log_and_print(logger, f"檔案過濾設定: {policy.describe()}")
+    file_stats = {'downloaded': 0, 'skipped': 0, 'skip_reasons': {}}
+    namers = {}
+    # 補下載的檔案記錄到頻道所在日期資料夾的 sync_state.json（與增量下載相同），verify 才能檢查
+    date_states = {}
+    for (channel_dir, post_id, idx), post in posts.items():
+        namer = namers.get(channel_dir)
+        if namer is None:
+            directory = pathlib.Path(channel_dir)
+            namer = namers[channel_dir] = ChannelFileNamer(directory, ChannelPack.from_config(config, directory))
+        date_dir = os.path.dirname(os.path.normpath(channel_dir))
+        if date_dir not in date_states:
+            date_states[date_dir] = IncrementalDownloadManager(date_dir)
+        download_post_files(post, idx, d, pathlib.Path(channel_dir), config, file_stats,
+                            incremental_manager=date_states[date_dir], metrics=metrics, namer=namer, policy=policy)
+    for namer in namers.values():
+        namer.save()
+    state.save()
+    
+    log_and_print(logger, f"補下載完成: 下載 {file_stats['downloaded']} 個，仍略過 {file_stats['skipped']} 個")
+    for reason, count in file_stats['skip_reasons'].items():
+        log_and_print(logger, f"  - {reason}: {count} 個")
+    log_and_print(logger, f"日誌檔案位置: {log_file}")
+
+
+VERIFY_CHUNK_SIZE = 1024 * 1024
+VERIFY_MMAP_THRESHOLD = 8 * 1024 * 1024  # 超過此大小的檔案以 mmap 計算雜湊
+
+
+def _hash_file_region(task: Tuple[str, str, int, Optional[int]]) -> Tuple[str, Optional[int], Optional[str]]:
+    """
+    在 worker 程序中計算檔案（或封裝檔中的一段）的大小與 sha256，回傳 (檔案 id, 大小, 雜湊)
+    大檔案以 mmap 分段餵給 hashlib，不必複製到 Python 的緩衝區；讀取失敗時大小與雜湊為 None
+    """
+    file_id, path, offset, size = task
+    digest = hashlib.sha256()
     try:
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if size is None:
+                size = file_size
+            end = min(offset + size, file_size)
+            if end - offset >= VERIFY_MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    for start in range(offset, end, VERIFY_CHUNK_SIZE):
+                        digest.update(view[start:min(start + VERIFY_CHUNK_SIZE, end)])
+            else:
+                f.seek(offset)
+                remaining = end - offset
+                while remaining > 0:
+                    chunk = f.read(min(VERIFY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+    except OSError:
+        return file_id, None, None
+    return file_id, max(end - offset, 0), "sha256:" + digest.hexdigest()
+
+
+def _count_untracked_attachments(date_dirs: list, tracked_ids: set) -> int:
+    """頻道檔名對照表（.index/files.json）中有、但沒有下載紀錄而無法檢查的附件數"""
+    count = 0
+    for date_dir in date_dirs:
+        try:
+            with os.scandir(date_dir) as entries:
+                channel_dirs = [entry.path for entry in entries if entry.is_dir() and not entry.name.startswith('.')]
+        except OSError:
+            continue
+        for channel_dir in channel_dirs:
+            manifest_path = os.path.join(channel_dir, INDEX_DIRNAME, ChannelFileNamer.MANIFEST_NAME)
+            try:
+                with open(manifest_path, "r", encoding="utf8") as f:
+                    files = json.load(f).get("files", {})
+            except (OSError, ValueError):
+                continue
+            # 程式碼區塊的鍵值為 code:<訊息 id>，其餘為附件的檔案 id
+            count += sum(1 for key in files if not key.startswith("code:") and key not in tracked_ids)
+    return count
+
+
+def _compact_channel_packs(date_dirs, logger) -> int:
+    """整理各頻道的封裝檔（同名項目重新寫入時舊資料留在檔案中），回傳釋放的位元組數"""
+    reclaimed = 0
+    for date_dir in date_dirs:
+        for index_path in pathlib.Path(date_dir).glob(f"*/{INDEX_DIRNAME}/{ChannelPack.INDEX_NAME}"):
+            reclaimed += ChannelPack(index_path.parent.parent).compact()
+    if reclaimed:
+        log_and_print(logger, f"已整理封裝檔，釋放 {reclaimed / 1024 / 1024:.2f} MB")
+    return reclaimed
+
+
+def verify_archive(output_date: str = None, repair: bool = False, workers: int = None, quick: bool = False):
+    """
+    檢查已下載附件的完整性（verify 模式）
+    依各個 sync_state.json 的 downloaded_files 檢查檔案是否存在、大小與 sha256 是否相符，
+    雜湊在多個程序中平行計算；repair 時只重新下載遺失或損毀的檔案
+    沒有雜湊的舊紀錄以目前的內容作為基準寫回狀態，之後的檢查即可發現損毀
+    下載紀錄只在啟用增量下載（或 backfill、修復）時寫入，沒有紀錄的附件列為未檢查
+    只檢查時不需連線，repair 時才補齊連線設定；repair 也會整理封裝檔中不再使用的資料
+    """
+    print("=== 檢查附件完整性 (verify) ===")
+    
+    config = get_config_from_json()
+    
+    output_root = "results"
+    logger, file_logger, log_file = setup_logging(os.path.join(output_root, date.today().strftime("%Y%m%d")),
+                                                  config.get("verbosity", "normal"),
+                                                  config.get("log_format", "json"))
+    state_dirs = [output_root] + sorted(str(path.parent) for path in pathlib.Path(output_root).glob("*/sync_state.json"))
+    if output_date:
+        state_dirs = [os.path.join(output_root, output_date)]
+    managers = [IncrementalDownloadManager(state_dir) for state_dir in state_dirs]
+    managers = [manager for manager in managers if manager.sync_state.get('downloaded_files')]
+    date_dirs = ([os.path.join(output_root, output_date)] if output_date else
+                 sorted(str(path) for path in pathlib.Path(output_root).glob("[0-9]" * 8) if path.is_dir()))
+    untracked = _count_untracked_attachments(date_dirs, {file_id for manager in managers
+                                                         for file_id in manager.sync_state['downloaded_files']})
+    untracked_msg = (f"{untracked} 個附件沒有下載紀錄（未啟用增量下載時不會記錄），不在檢查範圍內；"
+                     f"啟用 enable_incremental_download 後下載的附件才能檢查")
+    if not managers:
+        log_and_print(logger, "沒有已下載檔案的紀錄")
+        if untracked:
+            log_and_print(logger, untracked_msg, 'warning')
+        if repair:
+            _compact_channel_packs(date_dirs, logger)
+        return
+    
+    started = time.monotonic()
+    results = {}  # (狀態索引, 檔案 id) -> 狀態
+    tasks = []
+    task_keys = {}
+    pack_indexes = {}
+    for i_manager, manager in enumerate(managers):
+        for file_id, entry in manager.sync_state['downloaded_files'].items():
+            key = (i_manager, file_id)
+            path = entry.get("path") or ""
+            directory, name = os.path.split(path)
+            if directory not in pack_indexes:
+                pack_indexes[directory] = ChannelPack(pathlib.Path(directory)) if directory else None
+            pack = pack_indexes[directory]
+            packed = pack.entries.get(name) if pack else None
+            if packed:
+                # 封裝的小檔案：檢查封裝檔中記錄的區段
+                pack_path = str(pack.pack_path)
+                task = (f"{i_manager}:{file_id}", pack_path, packed[0], packed[1])
+                expected_size = packed[1] if entry.get("size") is None else entry["size"]
+                if not os.path.isfile(pack_path) or os.path.getsize(pack_path) < packed[0] + packed[1]:
+                    results[key] = "missing"
+                    continue
+                actual_size = packed[1]
+            elif os.path.isfile(path):
+                task = (f"{i_manager}:{file_id}", path, 0, None)
+                expected_size = entry.get("size")
+                actual_size = os.path.getsize(path)
+            else:
+                results[key] = "missing"
+                continue
+            if expected_size is not None and actual_size != expected_size:
+                results[key] = "size_mismatch"
+            elif quick:
+                results[key] = "ok"
+            else:
+                tasks.append(task)
+                task_keys[task[0]] = key
+    
+    verified_bytes = 0
+    baselines = 0
+    if tasks:
+        workers = max(1, int(workers or os.cpu_count() or 1))
+        log_and_print(logger, f"計算 {len(tasks)} 個檔案的 sha256（{workers} 個程序）...")
+        with ProcessPoolExecutor(workers) as pool:
+            # 小檔案多時批次送給 worker，減少程序間往返
+            chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+            for task_id, actual_size, digest in pool.map(_hash_file_region, tasks, chunksize=chunksize):
+                key = task_keys[task_id]
+                manager, file_id = managers[key[0]], key[1]
+                entry = manager.sync_state['downloaded_files'][file_id]
+                if digest is None:
+                    results[key] = "missing"
+                    continue
+                verified_bytes += actual_size
+                if not entry.get("hash"):
+                    manager.mark_file_downloaded(file_id, entry["path"], digest, actual_size, save=False)
+                    baselines += 1
+                    results[key] = "ok"
+                else:
+                    results[key] = "ok" if entry["hash"] == digest else "hash_mismatch"
+    
+    problems = [key for key, status in results.items() if status != "ok"]
+    counts = {}
+    for status in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    elapsed = time.monotonic() - started
+    log_and_print(logger, f"\n=== 檢查結果（{elapsed:.1f} 秒，{verified_bytes / 1024 / 1024 / max(elapsed, 1e-9):.1f} MB/秒）===")
+    log_and_print(logger, f"檢查檔案: {len(results)} 個，{verified_bytes / 1024 / 1024:.1f} MB")
+    for status, count in sorted(counts.items()):
+        log_and_print(logger, f"  - {status}: {count} 個")
+    if baselines:
+        log_and_print(logger, f"{baselines} 個舊紀錄沒有雜湊，已以目前的內容作為基準")
+    if untracked:
+        log_and_print(logger, untracked_msg, 'warning')
+    
+    repaired = []
+    if repair and problems:
+        log_and_print(logger, f"\n正在重新下載 {len(problems)} 個遺失或損毀的檔案...")
+        config = complete_config(config)
+        d = connect(config["host"], config.get("port", 443), config.get("token", None),
+                    config.get("username", None), config.get("password", None), config.get("scheme", "https"))
+        metrics = DownloadMetrics()
+        instrument_driver(d, metrics)
+        namers = {}
+        for key in problems:
+            manager, file_id = managers[key[0]], key[1]
+            path = manager.sync_state['downloaded_files'][file_id]["path"]
+            directory, name = os.path.split(path)
+            try:
+                resp = d.files.get_file(file_id)
+                data = json.dumps(resp).encode() if isinstance(resp, (dict, list)) else resp.content
+                namer = namers.get(directory)
+                if namer is None:
+                    os.makedirs(directory, exist_ok=True)
+                    pack = ChannelPack.from_config(config, pathlib.Path(directory))
+                    if pack is None and pack_indexes.get(directory) and pack_indexes[directory].entries:
+                        # 資料夾已有封裝檔時沿用，封裝的小檔案修復後仍寫回封裝檔
+                        pack = ChannelPack(pathlib.Path(directory))
+                    namer = namers[directory] = ChannelFileNamer(pathlib.Path(directory), pack)
+                namer.write(name, data)
+                manager.mark_file_downloaded(file_id, path, file_sha256(data), len(data), save=False)
+                repaired.append(key)
+                file_event_logger.info(f"已重新下載: {path}", extra={"event": "file_repaired", "file": path,
+                                                                  "reason": results[key], "bytes": len(data)})
+            except Exception as e:
+                log_and_print(logger, f"重新下載失敗 {path}: {str(e)}", 'error')
+        for namer in namers.values():
+            namer.save()
+        log_and_print(logger, f"已修復: {len(repaired)} 個，失敗: {len(problems) - len(repaired)} 個")
+    
+    if baselines or repaired:
+        for manager in managers:
+            manager.save()
+    
+    reclaimed = _compact_channel_packs(date_dirs, logger) if repair else 0
+    
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "elapsed_seconds": round(elapsed, 3),
+        "files": len(results),
+        "verified_bytes": verified_bytes,
+        "counts": counts,
+        "baselines": baselines,
+        "untracked": untracked,
+        "repaired": len(repaired),
+        "reclaimed_bytes": reclaimed,
+        "problems": [{"state": managers[key[0]].sync_state_file, "file_id": key[1],
+                      "path": managers[key[0]].sync_state['downloaded_files'][key[1]]["path"],
+                      "status": results[key], "repaired": key in repaired} for key in problems]
+    }
+    report_file = os.path.join(os.path.dirname(log_file),
+                               os.path.basename(os.path.splitext(log_file)[0]).replace("auto_download_", "verify_") + ".json")
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log_and_print(logger, f"檢查報告: {report_file}")
+
+
+class _ImportChannel:
+    """匯入中的單一頻道：串流寫入頻道 JSON 與討論串暫存檔"""
+    
+    def __init__(self, directory: pathlib.Path, json_filename: str, channel_info: Dict):
+        self.directory = directory
+        self.namer = None
+        self.json_path = directory / json_filename
+        self.threads_path = directory / INDEX_DIRNAME / (pathlib.Path(json_filename).stem + ".threads.jsonl.tmp")
+        self.channel_info = channel_info
+        self.next_idx = 0
+        self.last_post_at = 0
+        self.last_post_id = None
+        self.json_file = None
+        self.threads_file = None
+        self.code_index = ChannelCodeIndex(directory, json_filename)
+        self.rollup = ChannelRollup(directory, json_filename)
+    
+    def open(self):
+        self.json_file = open(self.json_path, "a", encoding="utf8")
+        self.threads_file = open(self.threads_path, "a", encoding="utf8")
+    
+    def close(self):
+        if self.json_file:
+            self.json_file.close()
+            self.threads_file.close()
+            self.json_file = self.threads_file = None
+        self.code_index.flush()
+
+
+class BulkExportImporter:
+    """
+    匯入 Mattermost 大量匯出檔（mmctl export create 產生的 zip，或解壓後的資料夾）
+    逐行串流讀取匯出的 JSONL，依頻道寫入與 export_channel 相同的 results/<日期>/<頻道>/ 結構
+    （頻道 JSON、NNN_ 附件與程式碼區塊、.index 討論串索引），並記錄各頻道的同步游標。
+    記憶體用量與頻道數有關而與訊息數無關：訊息直接寫入各頻道的檔案，同時開啟的檔案數有上限，
+    討論串索引先寫入暫存檔，結束時再組合
+    """
+    
+    MAX_OPEN_CHANNELS = 64
+    PROGRESS_INTERVAL = 10000
+    
+    def __init__(self, source: str, output_base: str, config: Dict = None, me: str = None,
+                 channel_ids: Dict = None, logger=None):
+        self.source = source
+        self.output_base = pathlib.Path(output_base)
+        self.config = config or {}
+        self.download_files = self.config.get("download_files", True)
+        # 匯出檔中的附件沒有 file id，略過的附件只計入統計，不記錄到 backfill 清單
+        self.policy = DownloadPolicy(self.config)
+        self.me = me
+        self.channel_ids = channel_ids or {}  # 頻道 key -> (channel_id, team_id)，由 API 對照取得
+        self.logger = logger
+        self.zip_file = None
+        self.channel_infos = {}  # 頻道 key -> 匯出檔中的頻道資訊
+        self.channels = {}  # 頻道 key -> _ImportChannel
+        self.folders = ChannelFolderRegistry()  # 顯示名稱相同的頻道寫入不同資料夾
+        self.open_channels = OrderedDict()  # 目前開啟檔案的頻道（LRU）
+        self.usernames = {}
+        self.stats = {"posts": 0, "replies": 0, "files": 0, "skipped_files": 0, "channels": 0}
+    
+    @staticmethod
+    def channel_key(team: str, name: str) -> Tuple[str, str]:
+        return (team, name)
+    
+    @staticmethod
+    def direct_channel_key(members: list) -> Tuple[str, ...]:
+        return ("__direct__",) + tuple(sorted(members))
+    
+    def _log(self, message: str, level: str = "info"):
+        if self.logger:
+            log_and_print(self.logger, message, level)
+        else:
+            print(message)
+    
+    def _open_jsonl(self):
+        """開啟匯出檔中的 JSONL（zip 內或資料夾中的第一個 .jsonl 檔）"""
+        if zipfile.is_zipfile(self.source):
+            self.zip_file = zipfile.ZipFile(self.source)
+            names = sorted(name for name in self.zip_file.namelist() if name.endswith(".jsonl"))
+            if not names:
+                raise ValueError(f"No .jsonl file found in {self.source}")
+            return io.TextIOWrapper(self.zip_file.open(names[0]), encoding="utf-8")
+        names = sorted(name for name in os.listdir(self.source) if name.endswith(".jsonl"))
+        if not names:
+            raise ValueError(f"No .jsonl file found in {self.source}")
+        return open(os.path.join(self.source, names[0]), "r", encoding="utf-8")
+    
+    def _open_attachment(self, path: str):
+        if self.zip_file:
+            return self.zip_file.open(path.lstrip("/"))
+        return open(os.path.join(self.source, path), "rb")
+    
+    def _attachment_info(self, path: str, filename: str) -> Dict:
+        """附件的大小與 MIME 類型（匯出檔中沒有，由 zip 目錄或檔案系統與副檔名取得）"""
+        try:
+            if self.zip_file:
+                size = self.zip_file.getinfo(path.lstrip("/")).file_size
+            else:
+                size = os.path.getsize(os.path.join(self.source, path))
+        except (OSError, KeyError):
+            size = 0
+        return {"name": filename, "size": size, "mime_type": mimetypes.guess_type(filename)[0] or ""}
+    
+    def _channel_display_name(self, key, info: Dict) -> str:
+        if key[0] != "__direct__":
+            return info.get("display_name") or info["name"]
+        # 直接訊息與群組訊息：以其他成員的使用者名稱命名（與 API 匯出相同）
+        members = [member for member in key[1:] if member != self.me] or list(key[1:])
+        return ", ".join(members)
+    
+    def _channel(self, key) -> _ImportChannel:
+        """取得頻道的寫入狀態，第一次出現時建立資料夾並寫入 JSON 開頭"""
+        channel = self.channels.get(key)
+        if channel is None:
+            info = self.channel_infos.get(key, {"name": key[-1]})
+            display_name = self._channel_display_name(key, info)
+            channel_name = self.folders.reserve(key, display_name)
+            directory = self.output_base / channel_name
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / INDEX_DIRNAME).mkdir(exist_ok=True)
+            namer = ChannelFileNamer(directory, ChannelPack.from_config(self.config, directory))
+            filtered_channel_name = ''.join(filter(lambda ch: ch not in "?!/\\.;:*\"<>|", channel_name))
+            channel_id, team_id = self.channel_ids.get(key, ("", ""))
+            channel_info = {
+                "name": info.get("name", "__".join(key[1:])),
+                "display_name": display_name,
+                "header": info.get("header", ""),
+                "id": channel_id,
+                "team": key[0] if key[0] != "__direct__" else "",
+                "team_id": team_id,
+                "exported_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            }
+            channel = _ImportChannel(directory, namer.allocate(filtered_channel_name, ".json"), channel_info)
+            channel.namer = namer
+            with open(channel.json_path, "w", encoding="utf8") as f:
+                f.write(channel_json_header(channel_info))
+            self.channels[key] = channel
+            self.stats["channels"] += 1
+        
+        if channel.json_file is None:
+            if len(self.open_channels) >= self.MAX_OPEN_CHANNELS:
+                _, oldest = self.open_channels.popitem(last=False)
+                oldest.close()
+            channel.open()
+            self.open_channels[key] = channel
+        else:
+            self.open_channels.move_to_end(key)
+        return channel
+    
+    def _post_id(self, key, post: Dict, idx: int) -> str:
+        """匯出檔不含訊息 id，以頻道、時間、作者與內容產生固定的 26 字元 id（重新匯入時相同）"""
+        digest = hashlib.sha1("\x1f".join([*key, str(post.get("create_at")), post.get("user", ""),
+                                             post.get("message", ""), str(idx)]).encode("utf-8"))
+        return digest.hexdigest()[:26]
+    
+    def _write_post(self, key, channel: _ImportChannel, post: Dict, root_id: str = None) -> Dict:
+        idx = channel.next_idx
+        channel.next_idx += 1
+        username = post.get("user", "")
+        self.usernames.setdefault(username, username)
+        api_post = {
+            "id": self._post_id(key, post, idx),
+            "create_at": post.get("create_at", 0),
+            "user_id": username,
+            "message": post.get("message", ""),
+            "root_id": root_id or "",
+            "metadata": {}
+        }
+        # 使用與 API 匯出相同的處理（時間格式、程式碼區塊索引）
+        simple_post = process_single_post(api_post, idx, self.usernames, None, channel.directory, False,
+                                          None, None, self.config, namer=channel.namer,
+                                          code_index=channel.code_index)
+        
+        attachments = post.get("attachments") or []
+        files = []
+        if attachments:
+            simple_post["files"] = []
+            for attachment in attachments:
+                path = attachment.get("path", "")
+                filename = os.path.basename(path)
+                simple_post["files"].append(filename)
+                info = self._attachment_info(path, filename)
+                files.append(info)
+                metadata_only = self._copy_attachment(channel, idx, path, filename, info)
+                if metadata_only:
+                    simple_post.setdefault("files_metadata", []).append(metadata_only)
+        channel.rollup.add(simple_post, files)
+        
+        if channel.next_idx > 1:
+            channel.json_file.write(',\n')
+        json.dump(simple_post, channel.json_file, indent=4, ensure_ascii=False)
+        if api_post["create_at"] >= channel.last_post_at:
+            channel.last_post_at = api_post["create_at"]
+            channel.last_post_id = api_post["id"]
+        return simple_post
+    
+    def _copy_attachment(self, channel: _ImportChannel, idx: int, path: str, filename: str,
+                         info: Dict = None) -> Optional[Dict]:
+        """
+        從匯出檔複製附件，使用與 API 匯出相同的 NNN_ 檔名
+        依下載政策只保留資訊時回傳附件資訊
+        """
+        if not self.download_files:
+            self.stats["skipped_files"] += 1
+            return None
+        key = "import:" + path
+        if channel.namer.existing(key, "%03d_" % idx):
+            self.stats["skipped_files"] += 1
+            return None
+        info = info or self._attachment_info(path, filename)
+        action, skip_reason = self.policy.evaluate(info, str(channel.directory))
+        if action != DownloadPolicy.DOWNLOAD:
+            file_event_logger.info(f"跳過檔案 {filename}: 不符合下載政策 ({skip_reason})",
+                                   extra={"event": "file_skipped", "file": filename, "reason": skip_reason})
+            self.stats["skipped_files"] += 1
+            if action == DownloadPolicy.METADATA_ONLY:
+                return dict(info, reason=skip_reason)
+            return None
+        name_parts = filename.rsplit('.', 1)
+        if len(name_parts) == 2:
+            target = channel.namer.allocate("%03d" % idx + "_" + name_parts[0], "." + name_parts[1])
+        else:
+            target = channel.namer.allocate("%03d" % idx + "_" + filename)
+        try:
+            with self._open_attachment(path) as src:
+                channel.namer.write_stream(target, src)
+        except (OSError, KeyError) as e:
+            file_event_logger.warning(f"Attachment not found in export: {path} ({e})",
+                                      extra={"event": "file_skipped", "file": filename, "reason": "missing_in_export"})
+            self.policy.release(str(channel.directory), info["size"])
+            self.stats["skipped_files"] += 1
+            return None
+        channel.namer.record(key, target)
+        self.stats["files"] += 1
+        return None
+    
+    def _import_post(self, key, post: Dict):
+        """匯入一則根訊息與其回覆（回覆緊接在根訊息之後寫入）"""
+        channel = self._channel(key)
+        root = self._write_post(key, channel, post)
+        self.stats["posts"] += 1
+        replies = sorted(post.get("replies") or [], key=lambda reply: reply.get("create_at", 0))
+        if not replies:
+            return
+        reply_idx = []
+        for reply in replies:
+            reply_idx.append(self._write_post(key, channel, reply, root_id=root["id"])["idx"])
+        self.stats["replies"] += len(replies)
+        last_reply_at = datetime.fromtimestamp(replies[-1].get("create_at", 0) / 1000,
+                                               timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        channel.threads_file.write(json.dumps([root["id"], root["idx"], reply_idx, last_reply_at]) + "\n")
+    
+    def _finish_channel(self, channel: _ImportChannel):
+        """寫入 JSON 結尾並由暫存檔組合討論串索引"""
+        channel.close()
+        with open(channel.json_path, "a", encoding="utf8") as f:
+            f.write(TailChannelArchive.TRAILER)
+        index_path = channel.directory / INDEX_DIRNAME / (channel.json_path.stem + ".threads.json")
+        with open(index_path, "w", encoding="utf8") as out:
+            out.write('{"version":1,"threads":{')
+            first = True
+            with open(channel.threads_path, "r", encoding="utf8") as f:
+                for line in f:
+                    root_id, root_idx, replies, last_reply_at = json.loads(line)
+                    entry = {"root_idx": root_idx, "replies": replies, "reply_count": len(replies),
+                             "last_reply_at": last_reply_at}
+                    out.write(("" if first else ",") + json.dumps(root_id) + ":" +
+                              json.dumps(entry, separators=(',', ':')))
+                    first = False
+            out.write('}}')
+        channel.threads_path.unlink()
+        channel.code_index.flush(touch=True)
+        channel.rollup.save()
+        channel.namer.save()
+    
+    def run(self, incremental_manager: IncrementalDownloadManager = None) -> Dict:
+        """執行匯入，回傳統計"""
+        lines = 0
+        try:
+            with self._open_jsonl() as f:
+                for line in f:
+                    lines += 1
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    kind = entry.get("type")
+                    if kind == "channel":
+                        channel = entry["channel"]
+                        self.channel_infos[self.channel_key(channel.get("team", ""), channel["name"])] = channel
+                    elif kind == "direct_channel":
+                        channel = entry["direct_channel"]
+                        self.channel_infos[self.direct_channel_key(channel.get("members", []))] = channel
+                    elif kind == "post":
+                        post = entry["post"]
+                        self._import_post(self.channel_key(post.get("team", ""), post["channel"]), post)
+                    elif kind == "direct_post":
+                        post = entry["direct_post"]
+                        self._import_post(self.direct_channel_key(post.get("channel_members", [])), post)
+                    else:
+                        continue
+                    if kind in ("post", "direct_post") and self.stats["posts"] % self.PROGRESS_INTERVAL == 0:
+                        self._log(f"已匯入 {self.stats['posts']} 則訊息（{self.stats['channels']} 個頻道）")
+        finally:
+            for channel in self.channels.values():
+                self._finish_channel(channel)
+            if self.zip_file:
+                self.zip_file.close()
+        
+        # 記錄各頻道最後一則訊息的時間，之後的 API 增量同步（tail）由此接續
+        if incremental_manager:
+            for key, channel in self.channels.items():
+                if not channel.last_post_id:
+                    continue
+                channel_id = self.channel_ids.get(key, (None,))[0] or "import:" + "/".join(key)
+                timestamp = datetime.fromtimestamp(channel.last_post_at / 1000, timezone.utc).isoformat()
+                incremental_manager.update_channel_sync_time(channel_id, channel.channel_info["display_name"],
+                                                             timestamp, channel.last_post_id)
+        self.stats["lines"] = lines
+        return self.stats
+
+
+def resolve_export_channel_ids(d: Driver, my_user_id: str, team: Dict, user_id_to_name: Dict[str, str]) -> Dict:
+    """以 API 對照匯出檔的頻道 key 與實際的頻道 id（同步游標需要 id 才能由 API 增量同步接續）
+
+    直接訊息的成員可由頻道名稱（user_id__user_id）得知；群組訊息的名稱是成員的雜湊值，需另外查詢成員
+    """
+    channel_ids = {}
+    for channel in get_team_channels(d, my_user_id, team, user_id_to_name):
+        if channel["type"] == "D":
+            members = [user_id_to_name.get(user_id, user_id) for user_id in channel["name"].split("__")]
+            key = BulkExportImporter.direct_channel_key(members)
+        elif channel["type"] == "G":
+            try:
+                # 群組訊息最多 8 位成員，一頁即可取得全部
+                member_ids = [member["user_id"] for member in
+                              d.channels.get_channel_members(channel["id"], params={"per_page": 200})]
+            except Exception as e:
+                print(f"無法取得群組訊息 {channel['display_name']} 的成員，略過對照: {e}")
+                continue
+            key = BulkExportImporter.direct_channel_key([user_id_to_name.get(user_id, user_id)
+                                                          for user_id in member_ids])
+        else:
+            key = BulkExportImporter.channel_key(team["name"], channel["name"])
+        channel_ids[key] = (channel["id"], team["id"])
+    return channel_ids
+
+
+def import_bulk_export(source: str, output_date: str = None, me: str = None, resolve_ids: bool = False):
+    """匯入 Mattermost 大量匯出檔（import 子命令）"""
+    print("=== 匯入 Mattermost 大量匯出檔 ===")
+    if not os.path.exists(source):
+        print(f"錯誤：找不到匯出檔 {source}")
+        sys.exit(1)
+    
+    config = get_config_from_json()
+    output_root = "results"
+    output_base = os.path.join(output_root, output_date or date.today().strftime("%Y%m%d"))
+    logger, file_logger, log_file = setup_logging(output_base, config.get("verbosity", "normal"),
+                                                  config.get("log_format", "json"))
+    
+    channel_ids = {}
+    if resolve_ids:
+        config = complete_config(config)
+        log_and_print(logger, "正在連接到 Mattermost 以對照頻道 id...")
+        d = connect(config["host"], config.get("port", 443), config.get("token", None),
+                    config.get("username", None), config.get("password", None), config.get("scheme", "https"))
+        user_id_to_name, my_user_id = get_users(d)
+        team = select_team(d, my_user_id)
+        me = me or user_id_to_name.get(my_user_id)
+        channel_ids = resolve_export_channel_ids(d, my_user_id, team, user_id_to_name)
+        log_and_print(logger, f"已對照 {len(channel_ids)} 個頻道")
+    
+    started = time.time()
+    importer = BulkExportImporter(source, output_base, config, me, channel_ids, logger)
+    stats = importer.run(IncrementalDownloadManager(output_root))
+    
+    log_and_print(logger, "\n=== 匯入完成 ===")
+    log_and_print(logger, f"頻道: {stats['channels']}，訊息: {stats['posts']}，回覆: {stats['replies']}，"
+                          f"附件: {stats['files']}（跳過 {stats['skipped_files']}），耗時 {time.time() - started:.1f} 秒")
+    log_and_print(logger, f"所有資料已儲存到: {output_base}")
+    if config.get("update_timeline", True):
+        update_channel_timelines(output_root, [channel.directory.name for channel in importer.channels.values()],
+                                 logger)
+    if not channel_ids:
+        log_and_print(logger, "未對照頻道 id（--resolve-ids），同步游標以頻道名稱記錄，tail 模式不會由此接續", 'warning')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下載 Mattermost 頻道")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("export", help="批量下載頻道（預設）")
+    tail_parser = subparsers.add_parser("tail", help="透過 WebSocket 即時同步新訊息與附件")
+    tail_parser.add_argument("channels", nargs="*", help="頻道名稱（預設為團隊中的所有頻道）")
+    import_parser = subparsers.add_parser("import", help="匯入 Mattermost 大量匯出檔（mmctl export 的 zip 或解壓後的資料夾）")
+    import_parser.add_argument("source", help="匯出檔 zip 或資料夾")
+    import_parser.add_argument("--date", help="輸出的日期資料夾（YYYYMMDD，預設為今天）")
+    import_parser.add_argument("--me", help="自己的使用者名稱（直接訊息以對方名稱命名）")
+    import_parser.add_argument("--resolve-ids", action="store_true",
+                               help="連線到伺服器對照頻道 id，讓之後的 tail 同步由匯入的位置接續")
+    plan_parser = subparsers.add_parser("plan", help="只讀取訊息 metadata，估算訊息數、附件數與下載量")
+    plan_parser.add_argument("channels", nargs="*", help="頻道名稱（預設為團隊中的所有頻道）")
+    backfill_parser = subparsers.add_parser("backfill", help="補下載之前依下載政策略過或下載失敗的附件")
+    backfill_parser.add_argument("--reason", action="append",
+                                 help="只補下載此原因略過的附件（可重複指定，比對開頭，例如 file_too_large）")
+    backfill_parser.add_argument("--all", action="store_true", dest="ignore_policy",
+                                 help="忽略大小上限、MIME 與預算限制，下載所有記錄的附件")
+    verify_parser = subparsers.add_parser("verify", help="檢查已下載附件是否存在、大小與 sha256 是否相符")
+    verify_parser.add_argument("--date", help="只檢查此日期資料夾（YYYYMMDD，預設為所有日期）")
+    verify_parser.add_argument("--repair", action="store_true", help="重新下載遺失或損毀的檔案")
+    verify_parser.add_argument("--workers", type=int, help="計算雜湊的程序數（預設為 CPU 核心數）")
+    verify_parser.add_argument("--quick", action="store_true", help="只檢查存在與大小，不計算雜湊")
+    args = parser.parse_args()
+    
+    if args.command == "tail":
+        tail_channels(args.channels)
+    elif args.command == "import":
+        import_bulk_export(args.source, args.date, args.me, args.resolve_ids)
+    elif args.command == "plan":
+        plan_channels(args.channels)
+    elif args.command == "backfill":
+        backfill_skipped_files(args.reason, args.ignore_policy)
+    elif args.command == "verify":
+        verify_archive(args.date, args.repair, args.workers, args.quick)
+    else:
         auto_download_all_channels()
+
+
+if __name__ == '__main__':
+    try:
+        main()
     except KeyboardInterrupt:
         print("\n\n使用者中斷下載")
         # 嘗試記錄到日誌（如果日誌已設置）
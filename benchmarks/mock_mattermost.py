@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+本機模擬 Mattermost API 伺服器（效能測試用）
+實作 auto_download_all.py 會呼叫的 API 端點，資料依參數與亂數種子固定產生，
+可注入延遲與 429 Too Many Requests，用來重現大型伺服器或限流情況：
+
+    python mock_mattermost.py --port 8065 --channels 20 --posts 5000 --latency-ms 20 --rate-limit-ratio 0.01
+
+之後在 config.json 設定 "host": "127.0.0.1", "port": 8065, "scheme": "http",
+"login_mode": "token" 並使用任意 token 即可連線。GET /__stats 回傳各端點的請求統計。
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = '/api/v4'
+DEFAULT_USERS_PER_PAGE = 60  # 與 Mattermost 預設的 per_page 相同
+BASE_CREATE_AT = 1704067200000  # 2024-01-01T00:00:00Z（毫秒）
+WORDS = ('hello', 'deploy', 'build', 'review', 'release', 'database', 'server', 'client', 'meeting',
+         'bug', 'fix', 'test', 'report', '測試', '部署', '會議', '報告', '問題', '修正', '版本')
+
+
+def make_id(kind: str, number) -> str:
+    """產生與 Mattermost 相同格式（26 個小寫英數字）的固定 id"""
+    return hashlib.md5(f"{kind}:{number}".encode()).hexdigest()[:26]
+
+
+class MockData:
+    """依參數產生的使用者、團隊、頻道、訊息與附件"""
+
+    def __init__(self, channels=5, posts=1000, users=50, attachment_ratio=0.1, attachment_size=64 * 1024,
+                 reply_ratio=0.2, code_ratio=0.05, seed=1):
+        self.seed = seed
+        self.posts_per_channel = posts
+        self.attachment_ratio = attachment_ratio
+        self.attachment_size = attachment_size
+        self.reply_ratio = reply_ratio
+        self.code_ratio = code_ratio
+
+        self.users = [{
+            'id': make_id('user', i),
+            'username': f"user{i:04d}",
+            'email': f"user{i:04d}@example.com"
+        } for i in range(users)]
+        self.me = self.users[0]
+        self.team = {'id': make_id('team', 0), 'name': 'benchmark', 'display_name': 'Benchmark'}
+
+        channel_types = ('O', 'P', 'O', 'G')
+        self.channels = []
+        for i in range(channels):
+            self.channels.append({
+                'id': make_id('channel', i),
+                'team_id': self.team['id'],
+                'name': f"channel-{i:04d}",
+                'display_name': f"Channel {i:04d}",
+                'type': channel_types[i % len(channel_types)],
+                'header': '',
+                'total_msg_count': posts,
+                'total_msg_count_root': posts - int(posts * reply_ratio),
+                'last_post_at': BASE_CREATE_AT + posts * 60000
+            })
+        self.channels_by_id = {channel['id']: channel for channel in self.channels}
+        self._posts = {}  # channel id -> 依時間由舊到新的訊息列表（第一次請求時產生）
+        self._files = {}  # file id -> 檔案大小
+        self._lock = threading.Lock()
+
+    def channel_posts(self, channel_id: str) -> list:
+        """取得頻道的所有訊息（依時間由舊到新）"""
+        with self._lock:
+            posts = self._posts.get(channel_id)
+            if posts is None:
+                posts = self._posts[channel_id] = self._generate_posts(channel_id)
+            return posts
+
+    def _generate_posts(self, channel_id: str) -> list:
+        rng = random.Random(f"{self.seed}:{channel_id}")
+        posts = []
+        for i in range(self.posts_per_channel):
+            post_id = make_id(f"post:{channel_id}", i)
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+            message = f"{words} #{i}"
+            if rng.random() < self.code_ratio:
+                message += f"\n```python\nprint({i})\n```"
+            root_id = ''
+            if posts and rng.random() < self.reply_ratio:
+                root = posts[rng.randrange(max(0, len(posts) - 50), len(posts))]
+                root_id = root['root_id'] or root['id']
+            files = []
+            if rng.random() < self.attachment_ratio:
+                file_id = make_id(f"file:{channel_id}", i)
+                size = max(1, int(self.attachment_size * rng.uniform(0.5, 1.5)))
+                extension = rng.choice(('png', 'pdf', 'txt', 'zip'))
+                files.append({'id': file_id, 'name': f"attachment_{i}.{extension}", 'extension': extension,
+                              'size': size, 'mime_type': 'application/octet-stream', 'post_id': post_id})
+                self._files[file_id] = size
+            create_at = BASE_CREATE_AT + i * 60000
+            post = {
+                'id': post_id,
+                'create_at': create_at,
+                'update_at': create_at,
+                'edit_at': 0,
+                'delete_at': 0,
+                'user_id': self.users[rng.randrange(len(self.users))]['id'],
+                'channel_id': channel_id,
+                'root_id': root_id,
+                'type': '',
+                'message': message,
+                'metadata': {'files': files} if files else {}
+            }
+            posts.append(post)
+        return posts
+
+    def file_size(self, file_id: str):
+        with self._lock:
+            size = self._files.get(file_id)
+            if size is not None:
+                return size
+        # 檔案 id 屬於尚未產生的頻道時，先產生所有頻道的訊息
+        for channel in self.channels:
+            self.channel_posts(channel['id'])
+        with self._lock:
+            return self._files.get(file_id)
+
+
+class MockMattermostServer(ThreadingHTTPServer):
+    """模擬伺服器：持有資料、注入設定與請求統計"""
+
+    daemon_threads = True
+
+    def __init__(self, address, data: MockData, latency_ms=0.0, jitter_ms=0.0, rate_limit_ratio=0.0,
+                 rate_limit_scope='files', seed=1):
+        super().__init__(address, MockMattermostHandler)
+        self.data = data
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self.rate_limit_scope = rate_limit_scope
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {}  # 端點 -> {'requests', 'rate_limited', 'bytes'}
+
+    def random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def record(self, label: str, nbytes: int, rate_limited: bool = False):
+        with self._stats_lock:
+            stats = self.stats.setdefault(label, {'requests': 0, 'rate_limited': 0, 'bytes': 0})
+            stats['requests'] += 1
+            stats['bytes'] += nbytes
+            if rate_limited:
+                stats['rate_limited'] += 1
+
+    def snapshot_stats(self) -> dict:
+        with self._stats_lock:
+            return json.loads(json.dumps(self.stats))
+
+
+class MockMattermostHandler(BaseHTTPRequestHandler):
+    """處理 API 請求；路由表對應 mattermostdriver 使用的端點"""
+
+    protocol_version = 'HTTP/1.1'
+    ROUTES = (
+        ('POST', re.compile(r'^/users/login$'), 'login'),
+        ('GET', re.compile(r'^/users$'), 'users'),
+        ('GET', re.compile(r'^/users/(?P<user_id>[^/]+)$'), 'user'),
+        ('GET', re.compile(r'^/users/(?P<user_id>[^/]+)/teams$'), 'user_teams'),
+        ('GET', re.compile(r'^/users/(?P<user_id>[^/]+)/teams/(?P<team_id>[^/]+)/channels$'), 'user_channels'),
+        ('GET', re.compile(r'^/teams/(?P<team_id>[^/]+)$'), 'team'),
+        ('GET', re.compile(r'^/channels/(?P<channel_id>[^/]+)$'), 'channel'),
+        ('GET', re.compile(r'^/channels/(?P<channel_id>[^/]+)/posts$'), 'channel_posts'),
+        ('GET', re.compile(r'^/files/(?P<file_id>[^/]+)$'), 'file'),
+    )
+
+    def log_message(self, format, *args):
+        pass  # 大量請求時不輸出存取記錄
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        if method == 'GET' and parsed.path == '/__stats':
+            self._send_json(self.server.snapshot_stats(), record_as=None)
+            return
+        if not parsed.path.startswith(API_PREFIX):
+            self._send_error(404, 'Not found', None)
+            return
+
+        path = parsed.path[len(API_PREFIX):]
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            self._send_error(404, f"Unknown endpoint {method} {path}", None)
+            return
+
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+
+        server = self.server
+        if server.latency_ms or server.jitter_ms:
+            time.sleep(max(0.0, server.latency_ms + server.random() * server.jitter_ms) / 1000)
+        if server.rate_limit_ratio and (server.rate_limit_scope == 'all' or name == 'file') \
+                and server.random() < server.rate_limit_ratio:
+            self.send_response(429)
+            body = json.dumps({'message': 'Too many requests', 'status_code': 429}).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            server.record(name, len(body), rate_limited=True)
+            return
+
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        getattr(self, f"handle_{name}")(params=params, **match.groupdict())
+
+    def _send_json(self, payload, record_as, status=200, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if record_as:
+            self.server.record(record_as, len(body))
+
+    def _send_error(self, status: int, message: str, record_as):
+        self._send_json({'message': message, 'status_code': status}, record_as, status=status)
+
+    def _user(self, user_id: str):
+        data = self.server.data
+        if user_id == 'me':
+            return data.me
+        for user in data.users:
+            if user['id'] == user_id:
+                return user
+        return None
+
+    def handle_login(self, params):
+        self._send_json(self.server.data.me, 'login', headers={'Token': 'benchmark-token'})
+
+    def handle_users(self, params):
+        page = int(params.get('page', 0))
+        per_page = int(params.get('per_page', DEFAULT_USERS_PER_PAGE))
+        users = self.server.data.users[page * per_page:(page + 1) * per_page]
+        self._send_json(users, 'users')
+
+    def handle_user(self, params, user_id):
+        user = self._user(user_id)
+        if user is None:
+            self._send_error(404, 'User not found', 'user')
+        else:
+            self._send_json(user, 'user')
+
+    def handle_user_teams(self, params, user_id):
+        self._send_json([self.server.data.team], 'user_teams')
+
+    def handle_user_channels(self, params, user_id, team_id):
+        self._send_json(self.server.data.channels, 'user_channels')
+
+    def handle_team(self, params, team_id):
+        self._send_json(self.server.data.team, 'team')
+
+    def handle_channel(self, params, channel_id):
+        channel = self.server.data.channels_by_id.get(channel_id)
+        if channel is None:
+            self._send_error(404, 'Channel not found', 'channel')
+        else:
+            self._send_json(channel, 'channel')
+
+    def handle_channel_posts(self, params, channel_id):
+        """GET /channels/{id}/posts：支援 page/per_page、since、before/after（以訊息 id 為游標）"""
+        data = self.server.data
+        if channel_id not in data.channels_by_id:
+            self._send_error(404, 'Channel not found', 'channel_posts')
+            return
+        posts = data.channel_posts(channel_id)  # 由舊到新
+        page = int(params.get('page', 0))
+        per_page = int(params.get('per_page', 60))
+
+        if 'since' in params:
+            since = int(params['since'])
+            selected = [post for post in posts if post['update_at'] > since]
+        else:
+            newest_first = posts[::-1]
+            if params.get('before'):
+                ids = [post['id'] for post in newest_first]
+                start = ids.index(params['before']) + 1 if params['before'] in ids else len(ids)
+                newest_first = newest_first[start:]
+            elif params.get('after'):
+                ids = [post['id'] for post in posts]
+                start = ids.index(params['after']) + 1 if params['after'] in ids else 0
+                # after 游標：回傳游標之後最接近的一頁（仍以新到舊排序）
+                newer = posts[start:]
+                newest_first = newer[page * per_page:(page + 1) * per_page][::-1]
+                page = 0
+            selected = newest_first[page * per_page:(page + 1) * per_page]
+
+        order = [post['id'] for post in sorted(selected, key=lambda post: post['create_at'], reverse=True)]
+        self._send_json({
+            'order': order,
+            'posts': {post['id']: post for post in selected},
+            'next_post_id': '',
+            'prev_post_id': ''
+        }, 'channel_posts')
+
+    def handle_file(self, params, file_id):
+        size = self.server.data.file_size(file_id)
+        if size is None:
+            self._send_error(404, 'File not found', 'file')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = b'\0' * 65536
+        remaining = size
+        while remaining > 0:
+            self.wfile.write(chunk[:min(remaining, len(chunk))])
+            remaining -= len(chunk)
+        self.server.record('file', size)
+
+
+def add_data_arguments(parser: argparse.ArgumentParser):
+    """模擬資料與注入設定的共用參數（run_benchmark.py 也使用）"""
+    parser.add_argument('--channels', type=int, default=5, help="頻道數（預設 5）")
+    parser.add_argument('--posts', type=int, default=1000, help="每個頻道的訊息數（預設 1000）")
+    parser.add_argument('--users', type=int, default=50, help="使用者數（預設 50）")
+    parser.add_argument('--attachment-ratio', type=float, default=0.1, help="帶附件的訊息比例（預設 0.1）")
+    parser.add_argument('--attachment-size', type=int, default=64 * 1024, help="附件平均大小 bytes（預設 65536）")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="每個請求的固定延遲（毫秒）")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="額外的隨機延遲上限（毫秒）")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="回傳 429 的請求比例")
+    parser.add_argument('--rate-limit-scope', choices=('files', 'all'), default='files',
+                        help="429 注入範圍：files（只有附件下載）或 all（所有端點）")
+    parser.add_argument('--seed', type=int, default=1, help="亂數種子")
+
+
+def create_server(args, host: str = '127.0.0.1', port: int = 0) -> MockMattermostServer:
+    """依命令列參數建立模擬伺服器（port 0 表示自動選擇）"""
+    data = MockData(channels=args.channels, posts=args.posts, users=args.users,
+                    attachment_ratio=args.attachment_ratio, attachment_size=args.attachment_size, seed=args.seed)
+    return MockMattermostServer((host, port), data, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                rate_limit_ratio=args.rate_limit_ratio, rate_limit_scope=args.rate_limit_scope,
+                                seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機模擬 Mattermost API 伺服器")
+    parser.add_argument('--host', default='127.0.0.1', help="監聽位址（預設 127.0.0.1）")
+    parser.add_argument('--port', type=int, default=8065, help="監聽埠（預設 8065）")
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args, args.host, args.port)
+    print(f"Mock Mattermost API: http://{args.host}:{server.server_port}{API_PREFIX} "
+          f"({args.channels} 個頻道 × {args.posts} 則訊息，{args.users} 位使用者)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n已停止")
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
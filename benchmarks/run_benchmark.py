@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+端到端效能測試
+啟動本機模擬 Mattermost 伺服器（mock_mattermost.py），以 auto_download_all.py 下載所有頻道，
+再啟動 EasyViewer 對下載結果發出並行請求，輸出下載與檢視兩端的延遲（p50/p99）、吞吐量與
+記憶體峰值，方便在修改前後比較：
+
+    python benchmarks/run_benchmark.py --channels 10 --posts 5000 --latency-ms 10
+    python benchmarks/run_benchmark.py --rate-limit-ratio 0.02 --output before.json
+
+所有資料寫在暫存資料夾（--workdir 可指定並保留），不會影響 results/ 與 config.json。
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mock_mattermost import add_data_arguments, create_server
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DOWNLOADER = REPO_ROOT / 'auto_download_all.py'
+VIEWER_DIR = REPO_ROOT / 'EasyViewer'
+VIEWER_PASSWORD = 'benchmark'
+
+# 以子行程啟動 EasyViewer，將結果資料夾指向暫存資料夾
+VIEWER_BOOTSTRAP = """
+import sys
+from pathlib import Path
+import app
+app.RESULTS_BASE_PATH = Path(sys.argv[1])
+app.app.run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True, debug=False)
+"""
+
+
+def percentile(values, fraction):
+    """已排序數列的百分位數（最近排名法）"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize_latencies(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'latency_p50': percentile(latencies, 0.50),
+        'latency_p99': percentile(latencies, 0.99),
+        'requests_per_second': len(latencies) / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_from_proc(pid: int):
+    """從 /proc 讀取行程的記憶體峰值（bytes），不支援時回傳 None"""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_downloader(workdir: Path, mock_port: int, channels: int, timeout: float) -> dict:
+    """執行下載器並讀取它寫出的效能報告"""
+    config = {
+        'host': '127.0.0.1',
+        'port': mock_port,
+        'scheme': 'http',
+        'login_mode': 'token',
+        'token': 'benchmark-token',
+        'download_files': True,
+        'excluded_extensions': [],
+        'enable_incremental_download': False,
+        'show_progress': False,
+        'verbosity': 'quiet'
+    }
+    with open(workdir / 'config.json', 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+    # 模式 1（所有頻道）並確認；頻道失敗時的「是否繼續」一律回答 y
+    answers = "1\ny\n" + "y\n" * channels
+    stdout_path = workdir / 'downloader_stdout.txt'
+    started = time.perf_counter()
+    with open(stdout_path, 'w', encoding='utf-8') as stdout:
+        process = subprocess.Popen([sys.executable, str(DOWNLOADER)], cwd=workdir, stdin=subprocess.PIPE,
+                                   stdout=stdout, stderr=subprocess.STDOUT, text=True)
+        process.stdin.write(answers)
+        process.stdin.close()
+        peak_rss = None
+        if hasattr(os, 'wait4'):
+            deadline = time.monotonic() + timeout
+            while True:
+                pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    process.returncode = os.waitstatus_to_exitcode(status)
+                    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+                    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+                    break
+                if time.monotonic() > deadline:
+                    process.kill()
+                    raise TimeoutError(f"下載器執行超過 {timeout:.0f} 秒")
+                time.sleep(0.05)
+        else:
+            process.wait(timeout=timeout)
+    elapsed = time.perf_counter() - started
+
+    if process.returncode != 0:
+        raise RuntimeError(f"下載器結束代碼 {process.returncode}，請查看 {stdout_path}")
+    reports = sorted(glob.glob(str(workdir / 'results' / '*' / 'logs' / 'metrics_*.json')))
+    if not reports:
+        raise RuntimeError(f"找不到下載器的效能報告，請查看 {stdout_path}")
+    with open(reports[-1], 'r', encoding='utf-8') as f:
+        report = json.load(f)
+
+    return {
+        'elapsed_seconds': elapsed,
+        'peak_rss_bytes': peak_rss,
+        'requests': report['requests'],
+        'retries': report['retries'],
+        'errors': report['errors'],
+        'posts': report['posts_processed'],
+        'bytes': report['bytes'],
+        'requests_per_second': report['requests_per_second'],
+        'bytes_per_second': report['bytes_per_second'],
+        'channels': report['channels'],
+        'endpoints': {label: {
+            'requests': stats['requests'],
+            'latency_p50': stats['latency_p50'],
+            'latency_p99': stats['latency_p99'],
+            'bytes': stats['bytes']
+        } for label, stats in report['endpoints'].items()}
+    }
+
+
+def collect_viewer_targets(results_root: Path, max_files: int) -> dict:
+    """依下載結果產生 EasyViewer 的請求清單（依端點分組）"""
+    targets = {'channels': [], 'channel_compact': [], 'search_index': [], 'thread': [], 'files': []}
+    for date_dir in sorted(p for p in results_root.iterdir() if p.is_dir() and p.name.isdigit()):
+        date = date_dir.name
+        targets['channels'].append(f"/api/channels/{date}")
+        for channel_dir in sorted(p for p in date_dir.iterdir() if p.is_dir() and not p.name.startswith('.')
+                                  and p.name != 'logs'):
+            json_files = sorted(p for p in channel_dir.glob('*.json') if not p.name.startswith('.'))
+            if not json_files:
+                continue
+            json_file = json_files[0]
+            prefix = f"{date}/{quote(channel_dir.name)}/{quote(json_file.name)}"
+            targets['channel_compact'].append(f"/api/channel/{prefix}?format=compact")
+            targets['search_index'].append(f"/api/search_index/{prefix}")
+
+            thread_index = channel_dir / '.index' / f"{json_file.stem}.threads.json"
+            try:
+                with open(thread_index, 'r', encoding='utf-8') as f:
+                    root_ids = list(json.load(f).get('threads', {}))[:20]
+            except (OSError, ValueError):
+                root_ids = []
+            targets['thread'].extend(f"/api/thread/{prefix}/{root_id}" for root_id in root_ids)
+
+            files = [p for p in channel_dir.iterdir() if p.is_file() and p.suffix != '.json']
+            targets['files'].extend(f"/files/{date}/{quote(channel_dir.name)}/{quote(p.name)}"
+                                    for p in files[:max_files])
+    return targets
+
+
+def run_viewer(results_root: Path, concurrency: int, rounds: int, max_files: int, timeout: float) -> dict:
+    """啟動 EasyViewer 並以並行請求測量各端點"""
+    port = free_port()
+    env = dict(os.environ, ACCESS_PASSWORD=VIEWER_PASSWORD, SECRET_KEY='benchmark')
+    process = subprocess.Popen([sys.executable, '-c', VIEWER_BOOTSTRAP, str(results_root), str(port)],
+                               cwd=VIEWER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                requests.get(f"{base_url}/login", timeout=1)
+                break
+            except requests.ConnectionError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("EasyViewer 無法啟動")
+                time.sleep(0.1)
+
+        session = requests.Session()
+        session.post(f"{base_url}/login", data={'password': VIEWER_PASSWORD}, timeout=timeout)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        session.mount('http://', adapter)
+
+        targets = collect_viewer_targets(results_root, max_files)
+        endpoints = {}
+        for name, paths in targets.items():
+            if not paths:
+                continue
+            latencies = []
+            errors = 0
+            lock = threading.Lock()
+
+            def fetch(path):
+                nonlocal errors
+                started = time.perf_counter()
+                response = session.get(base_url + path, timeout=timeout)
+                _ = response.content
+                latency = time.perf_counter() - started
+                with lock:
+                    latencies.append(latency)
+                    if response.status_code != 200:
+                        errors += 1
+
+            # 第一輪為冷快取（建立索引與壓縮快取），之後各輪為熱快取
+            cold_started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(fetch, paths))
+            cold = summarize_latencies(latencies, time.perf_counter() - cold_started)
+            latencies = []
+            warm_started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(fetch, paths * rounds))
+            warm = summarize_latencies(latencies, time.perf_counter() - warm_started)
+            endpoints[name] = {'cold': cold, 'warm': warm, 'errors': errors}
+
+        return {
+            'concurrency': concurrency,
+            'rounds': rounds,
+            'peak_rss_bytes': peak_rss_from_proc(process.pid),
+            'endpoints': endpoints
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def format_bytes(value) -> str:
+    if value is None:
+        return "N/A"
+    return f"{value / 1024 / 1024:.1f} MB"
+
+
+def print_report(result: dict):
+    downloader = result['downloader']
+    print("\n=== 下載器 ===")
+    print(f"耗時: {downloader['elapsed_seconds']:.2f} 秒，訊息: {downloader['posts']}，"
+          f"請求: {downloader['requests']}，重試: {downloader['retries']}，錯誤: {downloader['errors']}")
+    print(f"吞吐量: {downloader['requests_per_second']:.1f} 請求/秒，"
+          f"{downloader['bytes_per_second'] / 1024 / 1024:.2f} MB/秒，記憶體峰值: {format_bytes(downloader['peak_rss_bytes'])}")
+    for label, stats in downloader['endpoints'].items():
+        print(f"  {label:<40} {stats['requests']:>7} 次  p50 {stats['latency_p50'] * 1000:7.1f} ms  "
+              f"p99 {stats['latency_p99'] * 1000:7.1f} ms")
+
+    viewer = result.get('viewer')
+    if viewer:
+        print(f"\n=== EasyViewer（並行 {viewer['concurrency']}）===")
+        print(f"記憶體峰值: {format_bytes(viewer['peak_rss_bytes'])}")
+        for name, stats in viewer['endpoints'].items():
+            for phase in ('cold', 'warm'):
+                phase_stats = stats[phase]
+                print(f"  {name:<16} {phase:<5} {phase_stats['requests']:>6} 次  "
+                      f"p50 {phase_stats['latency_p50'] * 1000:7.1f} ms  p99 {phase_stats['latency_p99'] * 1000:7.1f} ms  "
+                      f"{phase_stats['requests_per_second']:8.1f} 請求/秒")
+            if stats['errors']:
+                print(f"  {name:<16} 錯誤回應: {stats['errors']}")
+
+    mock = result.get('mock_server')
+    if mock:
+        print("\n=== 模擬伺服器 ===")
+        for label, stats in sorted(mock.items()):
+            print(f"  {label:<16} {stats['requests']:>7} 次  429: {stats['rate_limited']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下載器與 EasyViewer 的端到端效能測試")
+    add_data_arguments(parser)
+    parser.add_argument('--concurrency', type=int, default=8, help="EasyViewer 並行請求數（預設 8）")
+    parser.add_argument('--rounds', type=int, default=3, help="EasyViewer 熱快取的請求輪數（預設 3）")
+    parser.add_argument('--max-files', type=int, default=50, help="每個頻道測試的附件數上限（預設 50）")
+    parser.add_argument('--skip-viewer', action='store_true', help="只測試下載器")
+    parser.add_argument('--timeout', type=float, default=3600, help="各階段的逾時秒數（預設 3600）")
+    parser.add_argument('--workdir', help="工作資料夾（指定時保留下載結果，預設使用暫存資料夾）")
+    parser.add_argument('--output', help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    server = create_server(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"模擬伺服器: http://127.0.0.1:{server.server_port}（{args.channels} 個頻道 × {args.posts} 則訊息）")
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='mm_benchmark_'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        result = {
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'workdir')},
+            'downloader': run_downloader(workdir, server.server_port, args.channels, args.timeout)
+        }
+        if not args.skip_viewer:
+            result['viewer'] = run_viewer(workdir / 'results', args.concurrency, args.rounds, args.max_files,
+                                          args.timeout)
+        result['mock_server'] = server.snapshot_stats()
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
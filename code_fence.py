@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+程式碼區塊的擷取規則（下載工具與 EasyViewer 共用）
+CODE_FENCE_PATTERN 只使用 Python 與 JavaScript 都支援的語法，EasyViewer 前端以
+new RegExp(CODE_FENCE_PATTERN, 'gm') 使用同一個規則，伺服器與前端的區塊順序一致。
+
+- fenced code block：行首的 ``` 或 ~~~（可帶語言標示）到相同的結束標記，未結束時到訊息結尾
+- 單行的 ```code```：取出兩組 ``` 之間的內容，沒有語言標示
+"""
+
+import re
+
+CODE_FENCE_PATTERN = (r'^ {0,3}(`{3,}|~{3,})[ \t]*([^\s`~]*)[^`\n]*\n([\s\S]*?)'
+                      r'(?:^ {0,3}\1[ \t]*$|\1[ \t]*$(?![\s\S])|$(?![\s\S]))'
+                      r'|(`{3,})([^`\n]+?)\4')
+CODE_FENCE_RE = re.compile(CODE_FENCE_PATTERN, re.M)
+
+
+def extract_code_blocks(message: str) -> list:
+    """單次掃描訊息，依序取出所有程式碼區塊：[{"lang": 語言標示, "code": 內容}]"""
+    if "```" not in message and "~~~" not in message:
+        return []
+    blocks = []
+    for match in CODE_FENCE_RE.finditer(message):
+        if match.group(3) is None:
+            blocks.append({"lang": "", "code": match.group(5)})
+            continue
+        code = match.group(3)
+        if code.endswith("\n"):
+            code = code[:-1]
+        blocks.append({"lang": match.group(2).lower(), "code": code})
+    return blocks